@@ -1,51 +1,116 @@
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
-from flask_socketio import SocketIO, emit, join_room
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, g, copy_current_request_context
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from werkzeug.utils import secure_filename
 from supabase import create_client, Client
 from config import Config
 from functools import wraps
 import os
 import uuid
+import httpx
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 import sys
 from supabase_helper import get_data, get_count
-# Print Supabase version for debugging
-try:
-    import pkg_resources
-    print(f"Supabase package version: {pkg_resources.get_distribution('supabase').version}")
-except Exception as e:
-    print(f"Could not determine Supabase version: {e}")
+from message_helper import attach_reply_preview, compact_message, compact_room, emit_to_room, parse_seq_range
+from message_ids import new_message_id, parse_client_message_id
+from supabase_helper import get_users_by_ids, get_server_ids
+import logging
+from logging_helper import init_logging
 
 # Import blueprints
 from routes.friends import friends_bp
-from routes.servers import servers_bp
+from routes.servers import servers_bp, build_server_message, build_server_list, get_member_counts, SERVER_COLUMNS
+from message_cache import server_message_buffer, direct_message_buffer, conversation_key, message_order
+import response_helper
+import metrics
+from metrics import track_event, instrument_client, socket_connections_total
+from resilience import protect_client
+import degraded
+from degraded import snapshots, write_queue
+from rate_limit import rate_limited, rate_limited_event, CoalescedResults
+from presence import tracker as presence
+from emit_batcher import batcher
+from user_cache import known_users
+from friend_graph import friend_graph
+import password_helper
+from password_helper import hash_password, verify_password, needs_rehash
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# Structured logging before anything else logs
+init_logging(app)
+logger = logging.getLogger('chatapp')
+
 # CRITICAL: Session cookie configuration for production
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_HTTPONLY'] = True
 app.config['SESSION_COOKIE_SECURE'] = True  # HTTPS only
 app.config['PERMANENT_SESSION_LIFETIME'] = 86400  # 24 hours
 
-# Use threading mode for local development, gevent for production
+# Use threading mode for local development, gevent for production.
+# WebSockets are served by simple-websocket in both modes, which accepts the
+# browser's permessage-deflate offer; long-polling payloads are gzip-compressed
+# above the same size threshold as HTTP responses.
 async_mode = 'gevent' if os.environ.get('PORT') else 'threading'
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode)
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=async_mode,
+                    transports=Config.SOCKETIO_TRANSPORTS,
+                    ping_interval=Config.SOCKETIO_PING_INTERVAL,
+                    ping_timeout=Config.SOCKETIO_PING_TIMEOUT,
+                    http_compression=True,
+                    compression_threshold=Config.COMPRESS_MIN_SIZE)
+
+# Startup info (never log keys or secrets)
+try:
+    import pkg_resources
+    supabase_version = pkg_resources.get_distribution('supabase').version
+except Exception:
+    supabase_version = 'unknown'
+logger.info("Starting chat app", extra={'fields': {
+    'python_version': sys.version.split()[0],
+    'supabase_version': supabase_version,
+    'supabase_url': app.config['SUPABASE_URL'],
+    'async_mode': async_mode
+}})
+
+# Password hashes run on a bounded pool, not the request worker
+password_helper.init_app(socketio)
 
-# Debug prints
-print("Python version:", sys.version)
-print("SUPABASE_URL:", app.config['SUPABASE_URL'])
-print("SUPABASE_KEY:", app.config['SUPABASE_KEY'])
+# Online/typing state is flushed to rooms from a background task
+presence.init_app(socketio)
+
+# Broadcasts to busy rooms are coalesced into batched frames
+batcher.init_app(socketio)
 
 # Register blueprints
 app.register_blueprint(friends_bp)
 app.register_blueprint(servers_bp)
 
+# Per-route metrics first so they see the final (compressed) response size
+metrics.init_app(app)
+
+# Compression, hashed static URLs and HTTP caching
+response_helper.init_app(app)
+
+# Direct message history page size
+DM_PAGE_SIZE = 100
+
+# Max profiles per /api/profiles lookup
+PROFILES_BATCH_MAX = 100
+
+# Threads for independent Supabase queries issued by one request (e.g. /api/bootstrap)
+query_pool = ThreadPoolExecutor(max_workers=app.config['QUERY_POOL_SIZE'], thread_name_prefix='query')
+
+# Recent user searches, shared by everyone typing the same query
+search_results = CoalescedResults(ttl=app.config['SEARCH_COALESCE_SECONDS'])
+
 # Initialize Supabase client
-supabase: Client = create_client(app.config['SUPABASE_URL'], app.config['SUPABASE_KEY'])
+supabase: Client = protect_client(instrument_client(create_client(app.config['SUPABASE_URL'], app.config['SUPABASE_KEY'])))
+
+# Stale reads, read-only writes and queued messages while Supabase is down
+# (after compression, so it works on uncompressed JSON)
+degraded.init_app(app, socketio, supabase)
 
 # Login required decorator
 def login_required(f):
@@ -64,9 +129,7 @@ def index():
             return redirect(url_for('chat'))
         return render_template('index.html')
     except Exception as e:
-        print(f"Error in index route: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in index route")
         return f"Error: {e}", 500
 
 @app.route('/signup', methods=['GET', 'POST'])
@@ -97,13 +160,13 @@ def signup():
                     flash('Username already exists', 'error')
                     return render_template('signup.html')
             except Exception as e:
-                print(f"Error checking username: {e}")
+                logger.error("Error checking username: %s", e)
                 flash('Error checking username. Please try again.', 'error')
                 return render_template('signup.html')
             
             try:
                 # Hash the password
-                hashed_password = generate_password_hash(password)
+                hashed_password = hash_password(password)
                 
                 # Insert user directly into users table (let trigger handle discriminator/user_tag)
                 result = supabase.table('users').insert({
@@ -116,6 +179,7 @@ def signup():
                     user = result_data[0]
                     user_id = user['id']
                     user_tag = user.get('user_tag', f"{username}#00001")
+                    known_users.add([user_id])
                     
                     # Set session
                     session['user_id'] = user_id
@@ -127,17 +191,13 @@ def signup():
                 else:
                     flash('Error creating account', 'error')
                     
-            except Exception as e:
-                print(f"Signup error: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                logger.exception("Signup error")
                 flash('Error creating account. Please try again.', 'error')
         
         return render_template('signup.html')
     except Exception as e:
-        print(f"Signup route error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Signup route error")
         return f"Error: {e}", 500
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -152,15 +212,26 @@ def login():
                 return render_template('login.html')
             
             try:
-                # Get user from database
-                user_response = supabase.table('users').select('*').eq('username', username).execute()
+                # Get user from database (only what the session and hash check need)
+                user_response = supabase.table('users').select(
+                    'id, username, user_tag, password'
+                ).eq('username', username).execute()
                 user_data = get_data(user_response)
                 
                 if user_data and len(user_data) > 0:
                     user = user_data[0]
                     
                     # Check password hash
-                    if check_password_hash(user['password'], password):
+                    if verify_password(user['password'], password):
+                        if needs_rehash(user['password']):
+                            # Hash parameters changed since this password was stored
+                            try:
+                                supabase.table('users').update({
+                                    'password': hash_password(password)
+                                }).eq('id', user['id']).execute()
+                            except Exception as e:
+                                logger.warning("Password rehash failed: %s", e)
+                        known_users.add([user['id']])
                         session['user_id'] = user['id']
                         session['username'] = user['username']
                         session['user_tag'] = user.get('user_tag', f"{username}#00001")
@@ -171,17 +242,13 @@ def login():
                 else:
                     flash('Invalid username or password', 'error')
                     
-            except Exception as e:
-                print(f"Login error: {e}")
-                import traceback
-                traceback.print_exc()
+            except Exception:
+                logger.exception("Login error")
                 flash('Login failed. Please try again.', 'error')
         
         return render_template('login.html')
     except Exception as e:
-        print(f"Login route error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Login route error")
         return f"Error: {e}", 500
 
 @app.route('/logout')
@@ -218,16 +285,68 @@ def chat():
                                  'user_tag': session.get('user_tag', session['username'])
                              },
                              users=users,
-                             messages=[]
+                             messages=[],
+                             compact_events=app.config['SOCKETIO_COMPACT_EVENTS'],
+                             socket_transports=app.config['SOCKETIO_TRANSPORTS']
                              )
     except Exception as e:
-        print(f"Chat error: {e}")
+        logger.error("Chat error: %s", e)
         flash('Error loading chat', 'error')
         return redirect(url_for('index'))
 
+def deliver_direct_message(message, skip_sid=None):
+    """
+    Buffer a stored direct message and push it to both participants.
+    
+    Args:
+        message: Inserted direct_messages row
+        skip_sid: Socket id of the sending tab, which renders from its HTTP response
+    """
+    # Reply preview is filled in by the database on insert
+    attach_reply_preview(message)
+    direct_message_buffer.append(conversation_key(message['sender_id'], message['receiver_id']), message)
+    
+    # Emit via SocketIO for real-time delivery
+    compact = {'m': compact_message(message)}
+    emit_to_room(socketio, 'new_message', {'message': message}, message['receiver_id'], compact)
+    emit_to_room(socketio, 'message_sent', {'message': message}, message['sender_id'], compact,
+                 skip_sid=skip_sid)
+
+def queue_message(table, row, deliver):
+    """
+    Queue a message insert for replay while Supabase is down.
+    
+    Args:
+        table: 'direct_messages' or 'server_messages'
+        row: Row to insert, with its id already assigned
+        deliver: Called with the inserted row once it lands
+    
+    Returns:
+        False if the queue is full
+    """
+    sender_id = row['sender_id']
+    
+    def on_result(message):
+        if message is None:
+            # Rejected on replay (e.g. the recipient was deleted meanwhile)
+            emit_to_room(socketio, 'message_failed', {'id': row['id']}, sender_id)
+        else:
+            deliver(message)
+    
+    return write_queue.enqueue(table, row, on_result)
+
+def discard_upload(filename):
+    """Delete an uploaded chat file that no stored message ended up referencing"""
+    try:
+        supabase.storage.from_('chat-files').remove([filename])
+    except Exception as e:
+        logger.warning("Could not delete orphaned upload %s: %s", filename, e)
+
 @app.route('/api/send_message', methods=['POST'])
 @login_required
+@rate_limited('send_message')
 def send_message():
+    uploaded = None
     try:
         receiver_id = request.form.get('receiver_id')
         content = request.form.get('content', '').strip()
@@ -238,15 +357,21 @@ def send_message():
         if not receiver_id or receiver_id == '':
             return jsonify({'success': False, 'error': 'No recipient selected'}), 400
         
-        # Validate that receiver exists
-        try:
-            receiver_check = supabase.table('users').select('id').eq('id', receiver_id).execute()
-            receiver_data = get_data(receiver_check)
-            if not receiver_data:
+        # Validate that receiver exists, skipping the query for ids we have already seen
+        if receiver_id not in known_users:
+            try:
+                uuid.UUID(receiver_id)
+            except ValueError:
                 return jsonify({'success': False, 'error': 'Recipient not found'}), 400
-        except Exception as e:
-            print(f"Error checking receiver: {e}")
-            return jsonify({'success': False, 'error': 'Error validating recipient'}), 500
+            try:
+                receiver_check = supabase.table('users').select('id').eq('id', receiver_id).execute()
+                receiver_data = get_data(receiver_check)
+                if not receiver_data:
+                    return jsonify({'success': False, 'error': 'Recipient not found'}), 400
+                known_users.add([receiver_id])
+            except Exception as e:
+                logger.error("Error checking receiver: %s", e)
+                return jsonify({'success': False, 'error': 'Error validating recipient'}), 500
         
         file_url = None
         file_type = None
@@ -263,13 +388,16 @@ def send_message():
                 file_bytes,
                 {'content-type': file.content_type}
             )
+            uploaded = filename
             
             # Get public URL
             file_url = supabase.storage.from_('chat-files').get_public_url(filename)
             file_type = file.content_type
         
-        # Insert message into database
+        # Insert message into database. The id is ours (or the client's, so a retried
+        # send is recognised), which also keeps a queued replay from duplicating it
         message_data = {
+            'id': parse_client_message_id(request.form.get('message_id')) or new_message_id(),
             'sender_id': session['user_id'],
             'receiver_id': receiver_id,
             'content': content if content else None,
@@ -278,38 +406,90 @@ def send_message():
             'reply_to_id': reply_to_id if reply_to_id else None  # Include reply_to_id
         }
         
-        message_response = supabase.table('direct_messages').insert(message_data).execute()
-        message_data_result = get_data(message_response)
-        message = message_data_result[0] if message_data_result else None
+        try:
+            message, created = write_queue.insert('direct_messages', message_data)
+        except httpx.TransportError:
+            # Backend down, or still replaying earlier sends: hold the message and deliver it when the insert lands
+            if not queue_message('direct_messages', message_data, deliver_direct_message):
+                raise
+            pending = {**message_data, 'created_at': datetime.utcnow().isoformat(), 'pending': True}
+            return jsonify({'success': True, 'queued': True, 'message': pending}), 202
         
-        if message:
-            # Enrich message with replied_to data if present
-            if message.get('reply_to_id'):
-                replied_msg_response = supabase.table('direct_messages').select('content, sender_id').eq('id', message['reply_to_id']).execute()
-                replied_msg_data = get_data(replied_msg_response)
-                if replied_msg_data:
-                    replied_msg = replied_msg_data[0]
-                    sender_response = supabase.table('users').select('username').eq('id', replied_msg['sender_id']).execute()
-                    sender_data = get_data(sender_response)
-                    if sender_data:
-                        message['replied_to'] = {
-                            'content': replied_msg['content'],
-                            'sender': {'username': sender_data[0]['username']}
-                        }
-            
-            # Emit via SocketIO for real-time delivery
-            socketio.emit('new_message', {'message': message}, room=receiver_id)
-            socketio.emit('message_sent', {'message': message}, room=session['user_id'])
-            
-            return jsonify({'success': True, 'message': message}), 200
-        else:
-            return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+        if not created and uploaded:
+            # The existing row (if any) points at the first attempt's upload, not this one
+            discard_upload(uploaded)
+        
+        if message is None:
+            return jsonify({'success': False, 'error': 'Message id already in use'}), 409
+        
+        if not created:
+            # A retry of a send that already went through; it was delivered then
+            return jsonify({'success': True, 'message': attach_reply_preview(message)}), 200
+        
+        presence.typing(session['user_id'], receiver_id, active=False)
+        # The sending tab renders from the HTTP response, so only its other tabs get message_sent
+        deliver_direct_message(message, skip_sid=request.form.get('socket_id') or None)
+        
+        return jsonify({'success': True, 'message': message}), 200
             
     except Exception as e:
-        print(f"Send message error: {e}")
+        if uploaded:
+            # The message wasn't stored or queued, so nothing references the upload
+            discard_upload(uploaded)
+        if getattr(e, 'code', None) == '23503':
+            # Foreign key violation: a cached receiver id no longer exists
+            known_users.discard(receiver_id)
+            return jsonify({'success': False, 'error': 'Recipient not found'}), 400
+        logger.error("Send message error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def fetch_direct_messages(user_id, friend_id, since=None, before=None, since_seq=None, until_seq=None):
+    """
+    Read one page of a conversation from the database, oldest first.
+    
+    With since_seq the page is the oldest messages after it (a sync);
+    otherwise it is the newest messages matching since/before.
+    
+    Args:
+        user_id: Current user's id
+        friend_id: Other participant's id
+        since: Only messages created after this timestamp
+        before: Only messages created before this timestamp
+        since_seq: Only messages with a higher sequence number
+        until_seq: Only messages with a lower sequence number
+    
+    Returns:
+        (messages, has_more) where has_more means a sync page was cut short
+    """
+    syncing = since_seq is not None
+    
+    # One query per direction, merged here (avoids dependency on .or_)
+    pages = []
+    for sender_id, receiver_id in ((user_id, friend_id), (friend_id, user_id)):
+        query = supabase.table('direct_messages').select('*') \
+            .eq('sender_id', sender_id) \
+            .eq('receiver_id', receiver_id)
+        if since:
+            query = query.filter('created_at', 'gt', since)
+        if before:
+            query = query.filter('created_at', 'lt', before)
+        if syncing:
+            query = query.filter('seq', 'gt', since_seq)
+        if until_seq is not None:
+            query = query.filter('seq', 'lt', until_seq)
+        response = query.order('seq', desc=not syncing).limit(DM_PAGE_SIZE).execute()
+        pages.append(get_data(response) if response else [])
+    
+    merged = sorted([*pages[0], *pages[1]], key=message_order)
+    has_more = syncing and (len(merged) > DM_PAGE_SIZE or any(len(page) == DM_PAGE_SIZE for page in pages))
+    messages = merged[:DM_PAGE_SIZE] if syncing else merged[-DM_PAGE_SIZE:]
+    
+    # Reply previews are stored with each message, no extra lookups
+    for message in messages:
+        attach_reply_preview(message)
+    return messages, has_more
+
 @app.route('/api/messages', methods=['GET'])
 @login_required
 def get_messages():
@@ -319,123 +499,396 @@ def get_messages():
     if not friend_id:
         return jsonify({'success': False, 'error': 'Friend ID is required'}), 400
 
+    before = request.args.get('before')
     try:
-        # Fetch messages in both directions and merge (avoids dependency on .or_)
-        q1 = supabase.table('direct_messages').select('*') \
-            .eq('sender_id', session['user_id']) \
-            .eq('receiver_id', friend_id)
-        if since:
-            q1 = q1.filter('created_at', 'gt', since)
-        r1 = q1.execute()
+        since_seq, until_seq = parse_seq_range(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid sequence range'}), 400
+    cache_key = conversation_key(session['user_id'], friend_id)
 
-        q2 = supabase.table('direct_messages').select('*') \
-            .eq('sender_id', friend_id) \
-            .eq('receiver_id', session['user_id'])
-        if since:
-            q2 = q2.filter('created_at', 'gt', since)
-        r2 = q2.execute()
-
-        data1 = get_data(r1) if r1 else []
-        data2 = get_data(r2) if r2 else []
-        messages = sorted([*data1, *data2], key=lambda m: m.get('created_at') or '')
-        
-        # Enrich messages with replied_to data
-        for message in messages:
-            if message.get('reply_to_id'):
-                try:
-                    # Fetch the replied-to message
-                    replied_msg_response = supabase.table('direct_messages').select('id, content, sender_id').eq('id', message['reply_to_id']).execute()
-                    replied_msg_data = get_data(replied_msg_response)
-                    if replied_msg_data:
-                        replied_msg = replied_msg_data[0]
-                        # Fetch the sender of replied message
-                        sender_response = supabase.table('users').select('id, username').eq('id', replied_msg['sender_id']).execute()
-                        sender_data = get_data(sender_response)
-                        if sender_data:
-                            replied_msg['sender'] = sender_data[0]
-                        message['replied_to'] = replied_msg
-                except Exception as e:
-                    print(f"Error fetching replied message: {e}")
+    try:
+        if since_seq is not None:
+            # Sync: everything after the client's last sequence number, oldest first
+            messages = direct_message_buffer.after_seq(cache_key, since_seq, until_seq)
+            if messages is not None:
+                return jsonify({'success': True, 'messages': messages, 'has_more': False}), 200
+            messages, has_more = fetch_direct_messages(session['user_id'], friend_id,
+                                                       since_seq=since_seq, until_seq=until_seq)
+            return jsonify({'success': True, 'messages': messages, 'has_more': has_more}), 200
+
+        # Recent history of this conversation may already be in memory
+        cached = None if before else direct_message_buffer.get(cache_key)
+        if cached is not None and (not since or not cached or since >= (cached[0].get('created_at') or '')):
+            messages = [m for m in cached if not since or (m.get('created_at') or '') > since]
+            return jsonify({'success': True, 'messages': messages}), 200
+
+        messages, _ = fetch_direct_messages(session['user_id'], friend_id, since=since, before=before)
+
+        # A full read of the latest page warms the conversation cache
+        if not since and not before:
+            direct_message_buffer.seed(cache_key, messages)
 
         return jsonify({'success': True, 'messages': messages}), 200
     except Exception as e:
-        print(f"Get messages error: {e}")
+        logger.error("Get messages error: %s", e)
         return jsonify({'success': False, 'error': 'Failed to fetch messages'}), 500
 
 
+@app.route('/api/unread', methods=['GET'])
+@login_required
+def get_unread_counts():
+    """Unread counts for every DM and server channel, from one RPC call"""
+    try:
+        rows = get_data(supabase.rpc('get_unread_counts', {'uid': session['user_id']}).execute()) or []
+        counts = {'dm': {}, 'server': {}}
+        for row in rows:
+            counts[row['channel_type']][row['channel_id']] = row['unread']
+        return jsonify({'success': True, 'dms': counts['dm'], 'servers': counts['server']}), 200
+    except Exception as e:
+        logger.error("Get unread counts error: %s", e)
+        return jsonify({'success': False, 'error': 'Failed to fetch unread counts'}), 500
+
+@app.route('/api/read', methods=['POST'])
+@login_required
+def mark_read():
+    """Move the user's last-read marker for a DM partner or server to now"""
+    data = request.get_json(silent=True) or {}
+    channel_type = data.get('channel_type')
+    channel_id = data.get('channel_id')
+    
+    if channel_type not in ('dm', 'server') or not channel_id:
+        return jsonify({'success': False, 'error': 'channel_type (dm|server) and channel_id are required'}), 400
+    
+    try:
+        supabase.table('read_markers').upsert({
+            'user_id': session['user_id'],
+            'channel_type': channel_type,
+            'channel_id': channel_id,
+            # Stamped by the database, whose clock also sets message created_at
+            'last_read_at': 'now()'
+        }, on_conflict='user_id,channel_type,channel_id').execute()
+        return jsonify({'success': True}), 200
+    except Exception as e:
+        logger.error("Mark read error: %s", e)
+        return jsonify({'success': False, 'error': 'Failed to update read state'}), 500
+
+def find_users(search_query):
+    """Users whose username or tag contains the query (one extra row so the caller can drop itself)"""
+    # Run two separate searches and merge results (avoids .or_ incompatibility)
+    q_username = supabase.table('users').select('id, username, user_tag') \
+        .filter('username', 'ilike', f'%{search_query}%').limit(21).execute()
+    q_usertag = supabase.table('users').select('id, username, user_tag') \
+        .filter('user_tag', 'ilike', f'%{search_query}%').limit(21).execute()
+
+    users_map = {}
+    for resp in (q_username, q_usertag):
+        resp_data = get_data(resp)
+        if resp_data:
+            for u in resp_data:
+                users_map[u['id']] = u
+    return list(users_map.values())
+
 @app.route('/api/search_users', methods=['GET'])
 @login_required
+@rate_limited('search_users')
 def search_users():
     search_query = request.args.get('q', '').strip()
     
-    # DEBUG: Print session info
-    print("=" * 50)
-    print("SEARCH_USERS DEBUG")
-    print("Session:", dict(session))
-    print("User ID in session:", session.get('user_id'))
-    print("Search query:", search_query)
-    print("=" * 50)
+    logger.debug("search_users", extra={'fields': {'user_id': session.get('user_id'), 'query_length': len(search_query)}})
     
     if not search_query:
         return jsonify({'success': True, 'users': []}), 200
     
     try:
-        # Run two separate searches and merge results (avoids .or_ incompatibility)
-        base = supabase.table('users').select('id, username, user_tag').neq('id', session['user_id'])
-
-        q_username = base.filter('username', 'ilike', f'%{search_query}%').limit(20).execute()
-        q_usertag = base.filter('user_tag', 'ilike', f'%{search_query}%').limit(20).execute()
-
-        users_map = {}
-        for resp in (q_username, q_usertag):
-            resp_data = get_data(resp)
-            if resp_data:
-                for u in resp_data:
-                    users_map[u['id']] = u
-
-        users = list(users_map.values())[:20]
-        print(f"Found {len(users)} users")
+        # Identical searches within a short window share one pair of queries
+        matches = search_results.get(search_query.lower(), lambda: find_users(search_query))
+        known_users.add(u['id'] for u in matches)
+        users = [u for u in matches if u['id'] != session['user_id']][:20]
+        logger.debug("search_users results", extra={'fields': {'count': len(users)}})
         return jsonify({'success': True, 'users': users}), 200
     except Exception as e:
-        print(f"Search users error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Search users error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/profiles', methods=['GET'])
+@login_required
+def get_profiles():
+    """Batch lookup of public profiles, used by compact clients to resolve sender ids"""
+    ids = [uid for uid in request.args.get('ids', '').split(',') if uid][:PROFILES_BATCH_MAX]
+    
+    if not ids:
+        return jsonify({'success': True, 'profiles': []}), 200
+    
+    try:
+        profiles = get_users_by_ids(supabase, ids)
+        known_users.add(profiles)
+        return jsonify({'success': True, 'profiles': list(profiles.values())}), 200
+    except Exception as e:
+        logger.error("Get profiles error: %s", e)
+        return jsonify({'success': False, 'error': 'Failed to fetch profiles'}), 500
+
+@app.route('/api/presence', methods=['GET'])
+@login_required
+def get_presence():
+    """
+    Snapshot of who is online among the given ids (default: the user's friends).
+    Only friends and server co-members are reported, the same users whose
+    presence_update broadcasts this user receives.
+    """
+    user_id = session['user_id']
+    ids = [uid for uid in request.args.get('ids', '').split(',') if uid][:PROFILES_BATCH_MAX]
+    
+    try:
+        friends = friend_graph.friends(supabase, user_id)
+        if not ids:
+            ids = list(friends)
+        others = [uid for uid in ids if uid not in friends]
+        if others:
+            server_ids = get_server_ids(supabase, user_id)
+            co_members = set()
+            if server_ids:
+                rows = get_data(supabase.table('server_members').select('user_id')
+                                .in_('server_id', server_ids).in_('user_id', others).execute()) or []
+                co_members = {row['user_id'] for row in rows}
+            ids = [uid for uid in ids if uid in friends or uid in co_members]
+        return jsonify({'success': True, 'online': presence.online_among(ids)}), 200
+    except Exception as e:
+        logger.error("Get presence error: %s", e)
+        return jsonify({'success': False, 'error': 'Failed to fetch presence'}), 500
+
+def run_parallel(*calls):
+    """
+    Run independent zero-argument query functions concurrently.
+    
+    Each runs in a copy of the current request context; their Supabase calls
+    are added to this request's metrics.
+    
+    Returns:
+        List of results, in the order of calls
+    """
+    def counted(call):
+        g.supabase_calls = 0
+        return call(), g.supabase_calls
+    
+    futures = [query_pool.submit(copy_current_request_context(counted), call) for call in calls]
+    results = []
+    for future in futures:
+        result, calls_made = future.result()
+        if 'supabase_calls' in g:
+            g.supabase_calls += calls_made
+        results.append(result)
+    return results
+
+@app.route('/api/bootstrap', methods=['GET'])
+@login_required
+def bootstrap():
+    """Everything the chat page needs on load, in one response"""
+    user_id = session['user_id']
+    
+    def select(table, columns, **filters):
+        def run():
+            query = supabase.table(table).select(columns)
+            for column, value in filters.items():
+                query = query.eq(column, value)
+            return get_data(query.execute()) or []
+        return run
+    
+    try:
+        # Taken before reading, so friendships that change meanwhile aren't cached stale
+        graph_epoch = friend_graph.epoch()
+        # Round 1: everything keyed only by the current user
+        (friends_as_user1, friends_as_user2, memberships, incoming_requests,
+         outgoing_requests, invites, unread_rows) = run_parallel(
+            select('friendships', 'user2_id, created_at', user1_id=user_id),
+            select('friendships', 'user1_id, created_at', user2_id=user_id),
+            select('server_members', 'server_id, role, joined_at', user_id=user_id),
+            select('friend_requests', 'id, sender_id, created_at', receiver_id=user_id, status='pending'),
+            select('friend_requests', 'id, receiver_id, created_at', sender_id=user_id, status='pending'),
+            select('server_invites', 'id, server_id, inviter_id, created_at', invitee_id=user_id, status='pending'),
+            lambda: get_data(supabase.rpc('get_unread_counts', {'uid': user_id}).execute()) or []
+        )
+        
+        friendships = [(f['user2_id'], f['created_at']) for f in friends_as_user1] + \
+            [(f['user1_id'], f['created_at']) for f in friends_as_user2]
+        friend_graph.store(user_id, dict(friendships), epoch=graph_epoch)
+        member_server_ids = [m['server_id'] for m in memberships]
+        server_ids = list(set(member_server_ids) | {i['server_id'] for i in invites})
+        user_ids = [fid for fid, _ in friendships] + [r['sender_id'] for r in incoming_requests] + \
+            [r['receiver_id'] for r in outgoing_requests] + [i['inviter_id'] for i in invites]
+        
+        # Round 2: one batched lookup per table for everything round 1 referenced
+        users_by_id, servers, member_counts = run_parallel(
+            lambda: get_users_by_ids(supabase, user_ids),
+            lambda: get_data(supabase.table('servers').select(SERVER_COLUMNS).in_('id', server_ids).execute())
+            if server_ids else [],
+            lambda: get_member_counts(member_server_ids)
+        )
+        servers_by_id = {server['id']: server for server in servers or []}
+        known_users.add(users_by_id)
+        
+        friends = [{**users_by_id[fid], 'friendship_created_at': created_at}
+                   for fid, created_at in friendships if fid in users_by_id]
+        unread = {'dm': {}, 'server': {}}
+        for row in unread_rows:
+            unread[row['channel_type']][row['channel_id']] = row['unread']
+        
+        return jsonify({
+            'success': True,
+            'user': {'id': user_id, 'username': session.get('username'), 'user_tag': session.get('user_tag')},
+            'friends': friends,
+            'servers': build_server_list(memberships, servers_by_id, member_counts),
+            'friend_requests': {
+                'incoming': [{'id': r['id'], 'created_at': r['created_at'], 'sender': users_by_id[r['sender_id']]}
+                             for r in incoming_requests if r['sender_id'] in users_by_id],
+                'outgoing': [{'id': r['id'], 'created_at': r['created_at'], 'receiver': users_by_id[r['receiver_id']]}
+                             for r in outgoing_requests if r['receiver_id'] in users_by_id]
+            },
+            'server_invites': [
+                {'id': i['id'], 'created_at': i['created_at'],
+                 'server': servers_by_id[i['server_id']], 'inviter': users_by_id[i['inviter_id']]}
+                for i in invites if i['server_id'] in servers_by_id and i['inviter_id'] in users_by_id
+            ],
+            'unread': {'dms': unread['dm'], 'servers': unread['server']},
+            'online': presence.online_among([fid for fid, _ in friendships])
+        }), 200
+    except Exception:
+        logger.exception("Bootstrap error")
+        return jsonify({'success': False, 'error': 'Failed to load initial state'}), 500
+
 # SocketIO events
+def session_room(room):
+    """Room name for this connection, honouring its negotiated wire format"""
+    if session.get('wire_format') == 'compact':
+        return compact_room(room)
+    return room
+
 @socketio.on('connect')
-def handle_connect():
-    print(f"Client connected: {request.sid}")
+@track_event('connect')
+def handle_connect(auth=None):
+    user_id = session.get('user_id')
+    if not user_id:
+        # Rooms are derived from the login session, so anonymous sockets get nothing
+        return False
+    
+    # The Engine.IO handshake says which transport this connection started on
+    socket_connections_total.inc((('transport', request.args.get('transport', 'unknown')),))
+    
+    # Wire format is negotiated once per connection via the Socket.IO auth payload
+    if app.config['SOCKETIO_COMPACT_EVENTS'] and isinstance(auth, dict) and auth.get('wire') == 'compact':
+        session['wire_format'] = 'compact'
+    
+    # Join the user's own room and every server room from one membership query
+    try:
+        server_ids = get_server_ids(supabase, user_id)
+        snapshots.remember(('server_ids', user_id), server_ids, 64 * (len(server_ids) + 1))
+    except httpx.TransportError:
+        # Backend down: rejoin the rooms from the last good lookup rather than refuse the socket
+        snapshot = snapshots.recall(('server_ids', user_id))
+        server_ids = snapshot[1] if snapshot else []
+    join_room(session_room(user_id))
+    for server_id in server_ids:
+        join_room(session_room(f"server_{server_id}"))
+    
+    # Friends are looked up once per user, not once per tab
+    if presence.needs_audience(user_id):
+        try:
+            friend_ids = list(friend_graph.friends(supabase, user_id))
+        except httpx.TransportError:
+            presence.connect(user_id, request.sid)
+        else:
+            known_users.add(friend_ids)
+            presence.connect(user_id, request.sid, friend_ids, server_ids)
+    else:
+        presence.connect(user_id, request.sid)
+    logger.debug("Client connected", extra={'fields': {'servers': len(server_ids)}})
 
 @socketio.on('disconnect')
-def handle_disconnect():
-    print(f"Client disconnected: {request.sid}")
+@track_event('disconnect')
+def handle_disconnect(reason=None):
+    if session.get('user_id'):
+        presence.disconnect(session['user_id'], request.sid)
+    logger.debug("Client disconnected")
 
 @socketio.on('join')
+@track_event('join')
 def handle_join(data):
+    # The user room is joined on connect; kept for older clients, which may only name themselves
     user_id = data.get('user_id')
-    if user_id:
-        join_room(user_id)
-        print(f"User {user_id} joined their room")
+    if user_id and user_id != session.get('user_id'):
+        emit('error', {'message': 'Cannot join another user\'s room', 'event': 'join'})
 
 @socketio.on('join_server')
+@track_event('join_server')
 def handle_join_server(data):
+    """Join a server room after becoming a member mid-connection (create/accept invite)"""
     server_id = data.get('server_id')
-    if server_id:
-        join_room(f"server_{server_id}")
-        print(f"User joined server room: server_{server_id}")
+    user_id = session.get('user_id')
+    if not server_id or not user_id:
+        return
+    
+    # Membership is checked every time; joins only happen when a membership starts mid-connection
+    is_member = get_data(supabase.rpc('is_server_member', {'sid': server_id, 'uid': user_id}).execute())
+    if not is_member:
+        emit('error', {'message': 'Not a member of this server', 'event': 'join_server'})
+        return
+    presence.add_server(user_id, server_id)
+    
+    join_room(session_room(f"server_{server_id}"))
+    logger.debug("Joined server room", extra={'fields': {'server_id': server_id}})
 
 @socketio.on('leave_server')
+@track_event('leave_server')
 def handle_leave_server(data):
     server_id = data.get('server_id')
     if server_id:
-        from flask_socketio import leave_room
-        leave_room(f"server_{server_id}")
-        print(f"User left server room: server_{server_id}")
+        leave_room(session_room(f"server_{server_id}"))
+        logger.debug("Left server room", extra={'fields': {'server_id': server_id}})
+
+@socketio.on('typing')
+@track_event('typing')
+def handle_typing(data):
+    """Typing indicator for a server channel (server_id) or a direct chat (receiver_id)"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return
+    active = data.get('typing', True) is not False
+    server_id = data.get('server_id')
+    receiver_id = data.get('receiver_id')
+    
+    if server_id:
+        room = f"server_{server_id}"
+        # Only rooms this connection has joined; avoids a membership query per keystroke
+        if session_room(room) in rooms():
+            presence.typing(user_id, room, server_id=server_id, active=active)
+    elif receiver_id and friend_graph.are_friends(supabase, user_id, receiver_id):
+        presence.typing(user_id, receiver_id, active=active)
+
+def deliver_server_message(msg, sender):
+    """
+    Buffer a stored server message and broadcast it to the server room.
+    
+    Args:
+        msg: Inserted server_messages row
+        sender: Sender's id, username and user_tag
+    """
+    message_info = build_server_message(msg, sender, msg['server_id'])
+    server_message_buffer.append(msg['server_id'], message_info)
+    
+    # Broadcast to all members in the server room (batched with others sent in the same window)
+    batcher.emit('new_server_message', message_info, f"server_{msg['server_id']}",
+                 compact_message(message_info))
 
 @socketio.on('server_message')
+@track_event('server_message')
+@rate_limited_event('server_message')
 def handle_server_message(data):
-    """Handle server message via WebSocket"""
+    """
+    Handle server message via WebSocket.
+    
+    The client may send its own time-ordered message_id; the acknowledgement
+    carries the id actually used, so a client whose id was not accepted can
+    reconcile the copy it already rendered.
+    """
     server_id = data.get('server_id')
     content = data.get('content', '').strip()
     reply_to_id = data.get('reply_to_id')  # Get reply_to_id if present
@@ -450,67 +903,57 @@ def handle_server_message(data):
     
     try:
         user_id = session['user_id']
+        room = f"server_{server_id}"
         
         # Check if user is a member
-        is_member_response = supabase.rpc('is_server_member', {
-            'sid': server_id,
-            'uid': user_id
-        }).execute()
-        is_member_data = get_data(is_member_response)
+        try:
+            is_member_response = supabase.rpc('is_server_member', {
+                'sid': server_id,
+                'uid': user_id
+            }).execute()
+            is_member_data = get_data(is_member_response)
+        except httpx.TransportError:
+            # Backend down: this connection only holds server rooms it was a member of
+            is_member_data = session_room(room) in rooms()
         
         if not is_member_data:
             emit('error', {'message': 'Not a member of this server'})
             return
         
-        # Save message
+        # Save message; the id is assigned up front so a retry or queued replay can't duplicate it
         message_data = {
+            'id': parse_client_message_id(data.get('message_id')) or new_message_id(),
             'server_id': server_id,
             'sender_id': user_id,
             'content': content,
             'reply_to_id': reply_to_id if reply_to_id else None  # Include reply_to_id
         }
+        presence.typing(user_id, room, server_id=server_id, active=False)
+        sender = {'id': user_id, 'username': session.get('username'), 'user_tag': session.get('user_tag')}
         
-        result = supabase.table('server_messages').insert(message_data).execute()
-        result_data = get_data(result)
+        try:
+            msg, created = write_queue.insert('server_messages', message_data)
+        except httpx.TransportError:
+            # Backend down, or still replaying earlier sends: show it to the sender as pending and broadcast when the insert lands
+            if not queue_message('server_messages', message_data,
+                                 lambda msg: deliver_server_message(msg, sender)):
+                raise
+            pending = build_server_message(
+                {**message_data, 'created_at': datetime.utcnow().isoformat()}, sender, server_id)
+            emit('server_message_queued', {**pending, 'pending': True})
+            return {'id': message_data['id'], 'queued': True}
         
-        if result_data:
-            msg = result_data[0]
-            
-            # Get sender info
-            sender_response = supabase.table('users').select(
-                'id, username, user_tag'
-            ).eq('id', user_id).execute()
-            sender_data = get_data(sender_response)
-            
-            message_info = {
-                'id': msg['id'],
-                'content': msg['content'],
-                'created_at': msg['created_at'],
-                'sender': sender_data[0] if sender_data else None,
-                'server_id': server_id
-            }
-            
-            # Enrich message with replied_to data if present
-            if msg.get('reply_to_id'):
-                replied_msg_response = supabase.table('server_messages').select('content, sender_id').eq('id', msg['reply_to_id']).execute()
-                replied_msg_data = get_data(replied_msg_response)
-                if replied_msg_data:
-                    replied_msg = replied_msg_data[0]
-                    sender_response2 = supabase.table('users').select('username').eq('id', replied_msg['sender_id']).execute()
-                    sender_data2 = get_data(sender_response2)
-                    if sender_data2:
-                        message_info['replied_to'] = {
-                            'content': replied_msg['content'],
-                            'sender': {'username': sender_data2[0]['username']}
-                        }
-            
-            # Broadcast to all members in the server room
-            emit('new_server_message', message_info, room=f"server_{server_id}")
-        else:
-            emit('error', {'message': 'Failed to send message'})
+        if msg is None:
+            emit('error', {'message': 'Message id already in use'})
+            return None
+        
+        # A retry of a send that already went through was broadcast then
+        if created:
+            deliver_server_message(msg, sender)
+        return {'id': msg['id'], 'seq': msg.get('seq')}
             
     except Exception as e:
-        print(f"Server message error: {e}")
+        logger.error("Server message error: %s", e)
         emit('error', {'message': str(e)})
 
 if __name__ == '__main__':
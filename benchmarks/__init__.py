@@ -0,0 +1,3 @@
+"""
+Benchmark harness: fake Supabase backend and load runner
+"""
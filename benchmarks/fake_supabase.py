@@ -0,0 +1,431 @@
+"""
+Fake Supabase Backend
+A small in-memory stand-in for PostgREST (/rest/v1) and Storage (/storage/v1)
+that the app's Supabase clients can talk to over real HTTP, with injectable
+per-request latency. It implements the subset of PostgREST the app uses and
+emulates the triggers and RPC functions from migrations/.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+
+def now_iso():
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+
+def split_list(value):
+    """Split a PostgREST '(a,"b,c",d)' list into its items"""
+    value = value.strip()
+    if value.startswith('(') and value.endswith(')'):
+        value = value[1:-1]
+    items, current, quoted = [], '', False
+    for ch in value:
+        if ch == '"':
+            quoted = not quoted
+        elif ch == ',' and not quoted:
+            items.append(current)
+            current = ''
+        else:
+            current += ch
+    if current or items:
+        items.append(current)
+    return items
+
+
+def coerce(value, like):
+    """Convert a query-string value to the type of an existing column value"""
+    if isinstance(like, bool):
+        return value.lower() == 'true'
+    if isinstance(like, int):
+        try:
+            return int(value)
+        except ValueError:
+            return value
+    if isinstance(like, float):
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def like_to_regex(pattern):
+    regex = ''
+    for ch in pattern:
+        if ch in '%*':
+            regex += '.*'
+        elif ch == '_':
+            regex += '.'
+        else:
+            regex += re.escape(ch)
+    return regex
+
+
+def matches(row, column, expression):
+    negate = expression.startswith('not.')
+    if negate:
+        expression = expression[4:]
+    op, _, raw = expression.partition('.')
+    current = row.get(column)
+
+    if op == 'is':
+        result = current is None if raw == 'null' else current == (raw == 'true')
+    elif op == 'in':
+        result = current is not None and current in [coerce(v, current) for v in split_list(raw)]
+    elif op in ('like', 'ilike'):
+        flags = re.IGNORECASE if op == 'ilike' else 0
+        result = current is not None and re.fullmatch(like_to_regex(raw), str(current), flags) is not None
+    elif current is None:
+        result = False
+    else:
+        value = coerce(raw, current)
+        try:
+            result = {
+                'eq': current == value,
+                'neq': current != value,
+                'gt': current > value,
+                'gte': current >= value,
+                'lt': current < value,
+                'lte': current <= value,
+            }[op]
+        except (KeyError, TypeError):
+            result = False
+    return not result if negate else result
+
+
+class UniqueViolation(Exception):
+    """Insert of a primary key that already exists (Postgres error 23505)"""
+
+
+class FakeDatabase:
+    """In-memory tables plus the triggers and RPC functions the app relies on"""
+
+    TABLE_DEFAULTS = {
+        'friend_requests': {'status': 'pending'},
+        'server_invites': {'status': 'pending'},
+        'server_members': {'role': 'member'},
+    }
+
+    def __init__(self):
+        self.tables = {}
+        self.lock = threading.RLock()
+        self.calls = 0
+        self._discriminator = 0
+        self._sequences = {}
+
+    def table(self, name):
+        return self.tables.setdefault(name, [])
+
+    # ---------- writes ----------
+
+    def insert(self, name, rows):
+        inserted = []
+        with self.lock:
+            for row in rows:
+                row = {**self.TABLE_DEFAULTS.get(name, {}), **row}
+                row.setdefault('id', str(uuid.uuid4()))
+                if any(existing['id'] == row['id'] for existing in self.table(name)):
+                    raise UniqueViolation(f"duplicate key value violates unique constraint \"{name}_pkey\"")
+                row.setdefault('created_at', now_iso())
+                if name == 'server_members':
+                    row.setdefault('joined_at', row['created_at'])
+                self._before_insert(name, row)
+                self.table(name).append(row)
+                inserted.append(dict(row))
+                self._after_insert(name, row)
+        return inserted
+
+    def update(self, name, filters, changes):
+        with self.lock:
+            updated = []
+            for row in self.select_rows(name, filters):
+                before = dict(row)
+                row.update({k: (now_iso() if v == 'now()' else v) for k, v in changes.items()})
+                self._after_update(name, before, row)
+                updated.append(dict(row))
+            return updated
+
+    def delete(self, name, filters):
+        with self.lock:
+            doomed = self.select_rows(name, filters)
+            ids = {id(row) for row in doomed}
+            self.tables[name] = [row for row in self.table(name) if id(row) not in ids]
+            return [dict(row) for row in doomed]
+
+    def select_rows(self, name, filters):
+        rows = self.table(name)
+        for column, expression in filters:
+            rows = [row for row in rows if matches(row, column, expression)]
+        return rows
+
+    # ---------- triggers (see migrations/) ----------
+
+    def _before_insert(self, name, row):
+        if name == 'users' and not row.get('user_tag'):
+            self._discriminator += 1
+            row['user_tag'] = f"{row['username']}#{self._discriminator:04d}"
+        if name in ('server_messages', 'direct_messages') and row.get('reply_to_id'):
+            replied = next((m for m in self.table(name) if m['id'] == row['reply_to_id']), None)
+            if replied:
+                sender = next((u for u in self.table('users') if u['id'] == replied['sender_id']), {})
+                row['reply_preview_content'] = (replied.get('content') or '')[:200]
+                row['reply_preview_sender_id'] = replied['sender_id']
+                row['reply_preview_sender_username'] = sender.get('username')
+        if name == 'server_messages':
+            row['seq'] = self._next_seq(('server', row['server_id']))
+        if name == 'direct_messages':
+            row['seq'] = self._next_seq(('dm',) + tuple(sorted((row['sender_id'], row['receiver_id']))))
+
+    def _next_seq(self, channel):
+        self._sequences[channel] = self._sequences.get(channel, 0) + 1
+        return self._sequences[channel]
+
+    def _after_insert(self, name, row):
+        if name == 'servers':
+            self.insert('server_members', [{'server_id': row['id'], 'user_id': row['owner_id'], 'role': 'owner'}])
+
+    def _after_update(self, name, before, row):
+        if name == 'friend_requests' and before.get('status') != 'accepted' and row.get('status') == 'accepted':
+            user1, user2 = sorted((row['sender_id'], row['receiver_id']))
+            self.insert('friendships', [{'user1_id': user1, 'user2_id': user2}])
+        if name == 'server_invites' and before.get('status') != 'accepted' and row.get('status') == 'accepted':
+            self.insert('server_members', [{'server_id': row['server_id'], 'user_id': row['invitee_id']}])
+
+    # ---------- RPC ----------
+
+    def rpc(self, function, args):
+        with self.lock:
+            if function == 'are_friends':
+                user1, user2 = sorted((args['uid1'], args['uid2']))
+                return bool(self.select_rows('friendships', [('user1_id', f'eq.{user1}'), ('user2_id', f'eq.{user2}')]))
+            if function == 'is_server_member':
+                return bool(self._membership(args))
+            if function == 'get_user_server_role':
+                membership = self._membership(args)
+                return membership[0]['role'] if membership else None
+            if function == 'get_server_member_counts':
+                counts = {}
+                for member in self.table('server_members'):
+                    if member['server_id'] in args['sids']:
+                        counts[member['server_id']] = counts.get(member['server_id'], 0) + 1
+                return [{'server_id': sid, 'member_count': n} for sid, n in counts.items()]
+            if function == 'create_server_invite':
+                return self._create_server_invite(args['sid'], args['inviter'], args['invitee_tag'])
+            if function == 'create_friend_request':
+                return self._create_friend_request(args['sender'], args['receiver_tag'])
+            if function == 'get_unread_counts':
+                return self._unread_counts(args['uid'], args.get('cap_at', 100))
+        raise KeyError(function)
+
+    def _user_id_by_tag(self, tag):
+        users = self.select_rows('users', [('user_tag', f'eq.{tag}')])
+        return users[0]['id'] if users else None
+
+    def _create_server_invite(self, sid, inviter, invitee_tag):
+        if not self._membership({'sid': sid, 'uid': inviter}):
+            return {'error': 'not_member'}
+        invitee = self._user_id_by_tag(invitee_tag)
+        if invitee is None:
+            return {'error': 'user_not_found'}
+        if invitee == inviter:
+            return {'error': 'self_invite'}
+        if not self.rpc('are_friends', {'uid1': inviter, 'uid2': invitee}):
+            return {'error': 'not_friends'}
+        if self._membership({'sid': sid, 'uid': invitee}):
+            return {'error': 'already_member'}
+        existing = self.select_rows('server_invites', [('server_id', f'eq.{sid}'), ('invitee_id', f'eq.{invitee}')])
+        if existing and existing[0]['status'] == 'pending':
+            return {'error': 'invite_exists'}
+        if existing:
+            existing[0].update({'status': 'pending', 'inviter_id': inviter, 'updated_at': now_iso()})
+            return {'invite_id': existing[0]['id']}
+        row = self.insert('server_invites', [{'server_id': sid, 'inviter_id': inviter, 'invitee_id': invitee}])[0]
+        return {'invite_id': row['id']}
+
+    def _create_friend_request(self, sender, receiver_tag):
+        receiver = self._user_id_by_tag(receiver_tag)
+        if receiver is None:
+            return {'error': 'user_not_found'}
+        if receiver == sender:
+            return {'error': 'self_request'}
+        if self.rpc('are_friends', {'uid1': sender, 'uid2': receiver}):
+            return {'error': 'already_friends'}
+        if self.select_rows('friend_requests', [('sender_id', f'eq.{sender}'), ('receiver_id', f'eq.{receiver}')]) or \
+                self.select_rows('friend_requests', [('sender_id', f'eq.{receiver}'), ('receiver_id', f'eq.{sender}')]):
+            return {'error': 'request_exists'}
+        row = self.insert('friend_requests', [{'sender_id': sender, 'receiver_id': receiver}])[0]
+        return {'request_id': row['id']}
+
+    def _unread_counts(self, uid, cap_at):
+        markers = {(m['channel_type'], m['channel_id']): m['last_read_at']
+                   for m in self.select_rows('read_markers', [('user_id', f'eq.{uid}')])}
+        counts = []
+        for message in self.select_rows('direct_messages', [('receiver_id', f'eq.{uid}')]):
+            if message['created_at'] > markers.get(('dm', message['sender_id']), ''):
+                counts.append(('dm', message['sender_id']))
+        for member in self.select_rows('server_members', [('user_id', f'eq.{uid}')]):
+            since = markers.get(('server', member['server_id']), member['joined_at'])
+            for message in self.select_rows('server_messages', [('server_id', f"eq.{member['server_id']}")]):
+                if message['sender_id'] != uid and message['created_at'] > since:
+                    counts.append(('server', member['server_id']))
+        totals = {}
+        for key in counts:
+            totals[key] = min(cap_at, totals.get(key, 0) + 1)
+        return [{'channel_type': t, 'channel_id': c, 'unread': n} for (t, c), n in totals.items()]
+
+    def upsert(self, name, rows, conflict_columns):
+        with self.lock:
+            result = []
+            for row in rows:
+                row = {k: (now_iso() if v == 'now()' else v) for k, v in row.items()}
+                existing = self.select_rows(name, [(c, f'eq.{row[c]}') for c in conflict_columns])
+                if existing:
+                    existing[0].update(row)
+                    result.append(dict(existing[0]))
+                else:
+                    result.extend(self.insert(name, [row]))
+            return result
+
+    def _membership(self, args):
+        return self.select_rows('server_members', [('server_id', f"eq.{args['sid']}"), ('user_id', f"eq.{args['uid']}")])
+
+
+def project(row, select):
+    if not select or select.strip() == '*':
+        return dict(row)
+    columns = [c.strip() for c in select.split(',') if c.strip() and '(' not in c]
+    return {c: row.get(c) for c in columns}
+
+
+def sort_rows(rows, order):
+    for part in reversed(order.split(',')):
+        column, _, direction = part.partition('.')
+        descending = direction.startswith('desc')
+        present = [r for r in rows if r.get(column) is not None]
+        missing = [r for r in rows if r.get(column) is None]
+        rows = sorted(present, key=lambda r: r[column], reverse=descending) + missing
+    return rows
+
+
+class FakeSupabaseHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = b'' if body is None else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'null') if length else None
+
+    def _handle(self):
+        server = self.server
+        server.db.calls += 1
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+
+        if path.startswith('/storage/v1/'):
+            if self.command in ('POST', 'PUT'):
+                self._body_bytes()
+                return self._send(200, {'Key': path.rsplit('/', 1)[-1]})
+            return self._send(200, [])
+
+        if not path.startswith('/rest/v1/'):
+            return self._send(404, {'message': 'not found'})
+
+        resource = path[len('/rest/v1/'):]
+        params = parse_qsl(url.query, keep_blank_values=True)
+        prefer = self.headers.get('Prefer', '')
+        db = server.db
+
+        if resource.startswith('rpc/'):
+            try:
+                return self._send(200, db.rpc(resource[4:], self._body() or {}))
+            except KeyError:
+                return self._send(404, {'message': f'function {resource[4:]} not found'})
+
+        filters = [(k, v) for k, v in params if k not in RESERVED_PARAMS]
+        options = {k: v for k, v in params if k in RESERVED_PARAMS}
+
+        if self.command == 'GET' or self.command == 'HEAD':
+            with db.lock:
+                rows = db.select_rows(resource, filters)
+                total = len(rows)
+                if 'order' in options:
+                    rows = sort_rows(rows, options['order'])
+                offset = int(options.get('offset', 0))
+                rows = rows[offset:]
+                if 'limit' in options:
+                    rows = rows[:int(options['limit'])]
+                body = [project(r, options.get('select')) for r in rows]
+            headers = {}
+            if 'count=' in prefer:
+                headers['Content-Range'] = f'{offset}-{offset + len(body) - 1}/{total}' if body else f'*/{total}'
+            return self._send(200, body, headers)
+
+        if self.command == 'POST':
+            payload = self._body()
+            payload = payload if isinstance(payload, list) else [payload]
+            if 'merge-duplicates' in prefer and 'on_conflict' in options:
+                rows = db.upsert(resource, payload, options['on_conflict'].split(','))
+            else:
+                try:
+                    rows = db.insert(resource, payload)
+                except UniqueViolation as e:
+                    return self._send(409, {'code': '23505', 'message': str(e), 'details': None, 'hint': None})
+            return self._send(201, [project(r, options.get('select')) for r in rows])
+
+        if self.command == 'PATCH':
+            return self._send(200, db.update(resource, filters, self._body() or {}))
+
+        if self.command == 'DELETE':
+            return self._send(200, db.delete(resource, filters))
+
+        return self._send(405, {'message': 'method not allowed'})
+
+    def _body_bytes(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return self.rfile.read(length) if length else b''
+
+    do_GET = do_HEAD = do_POST = do_PATCH = do_DELETE = do_PUT = _handle
+
+
+class FakeSupabaseServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0):
+        super().__init__(('127.0.0.1', port), FakeSupabaseHandler)
+        self.db = FakeDatabase()
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
@@ -0,0 +1,268 @@
+"""
+Benchmark Runner
+Runs the Flask/SocketIO app in-process against the fake Supabase backend and
+reports throughput, fan-out latency and Supabase queries per operation.
+
+Usage:
+    python -m benchmarks.run_benchmark --users 50 --messages 20 --latency-ms 20
+
+Results are printed and written to bench_output.txt (or --output).
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_supabase import FakeSupabaseServer
+
+
+class TimedQueue(list):
+    """Socket test-client queue that records when each packet arrived"""
+
+    def __init__(self):
+        super().__init__()
+        self.arrivals = []
+
+    def append(self, item):
+        self.arrivals.append((time.perf_counter(), item))
+        super().append(item)
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples_ms):
+    return {
+        'n': len(samples_ms),
+        'p50_ms': percentile(samples_ms, 50),
+        'p99_ms': percentile(samples_ms, 99),
+        'mean_ms': statistics.fmean(samples_ms) if samples_ms else 0.0
+    }
+
+
+def metric_snapshot(metrics):
+    """Copy (sum, count) of Supabase calls per route/event label"""
+    with metrics.request_supabase_calls._lock:
+        return {labels: (s['sum'], s['count']) for labels, s in metrics.request_supabase_calls._series.items()}
+
+
+def queries_per_op(metrics, before, kind, name):
+    labels = (('kind', kind), ('name', name))
+    after = metric_snapshot(metrics).get(labels, (0, 0))
+    start = before.get(labels, (0, 0))
+    count = after[1] - start[1]
+    return (after[0] - start[0]) / count if count else 0.0
+
+
+def seed(db, user_count, history):
+    """Create users, a ring of friendships, one shared server and some history"""
+    from werkzeug.security import generate_password_hash
+
+    password = generate_password_hash('benchmark', method='pbkdf2:sha256:1000')
+    users = db.insert('users', [{'username': f'user{i}', 'password': password} for i in range(user_count)])
+    for i, user in enumerate(users):
+        friend = users[(i + 1) % user_count]
+        user1, user2 = sorted((user['id'], friend['id']))
+        if user1 != user2:
+            db.insert('friendships', [{'user1_id': user1, 'user2_id': user2}])
+
+    server = db.insert('servers', [{'name': 'bench', 'owner_id': users[0]['id']}])[0]
+    db.insert('server_members', [{'server_id': server['id'], 'user_id': u['id']} for u in users[1:]])
+
+    db.insert('server_messages', [
+        {'server_id': server['id'], 'sender_id': users[i % user_count]['id'], 'content': f'history {i}'}
+        for i in range(history)
+    ])
+    db.insert('direct_messages', [
+        {'sender_id': users[0]['id'], 'receiver_id': users[1 % user_count]['id'], 'content': f'dm history {i}'}
+        for i in range(history)
+    ])
+    return users, server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chat app load benchmark')
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--messages', type=int, default=10, help='messages each user sends per phase')
+    parser.add_argument('--route-iterations', type=int, default=20, help='requests per route')
+    parser.add_argument('--latency-ms', type=float, default=10.0, help='fake backend latency per call')
+    parser.add_argument('--jitter-ms', type=float, default=5.0, help='extra random latency per call')
+    parser.add_argument('--history', type=int, default=200, help='pre-seeded messages per channel')
+    parser.add_argument('--compact', action='store_true', help='negotiate the compact socket event schema')
+    parser.add_argument('--output', default='bench_output.txt')
+    args = parser.parse_args()
+
+    fake = FakeSupabaseServer(latency=args.latency_ms / 1000, jitter=args.jitter_ms / 1000).start()
+    os.environ.update({
+        'SUPABASE_URL': fake.url,
+        'SUPABASE_KEY': 'benchmark-anon-key',
+        'LOG_LEVEL': os.environ.get('LOG_LEVEL', 'WARNING'),
+        'RATE_LIMIT_ENABLED': os.environ.get('RATE_LIMIT_ENABLED', 'false'),
+    })
+
+    import app as chat_app
+    import metrics
+
+    app, socketio = chat_app.app, chat_app.socketio
+    app.config['SESSION_COOKIE_SECURE'] = False
+
+    users, server = seed(fake.db, args.users, args.history)
+    server_room_id = server['id']
+
+    # One HTTP client and one socket client per simulated user
+    http_clients, socket_clients = [], []
+    for user in users:
+        http = app.test_client()
+        with http.session_transaction() as session:
+            session.update({'user_id': user['id'], 'username': user['username'], 'user_tag': user['user_tag']})
+        sock = socketio.test_client(app, flask_test_client=http, auth={'wire': 'compact'} if args.compact else None)
+        sock.queue = TimedQueue()  # user and server rooms are joined on connect
+        http_clients.append(http)
+        socket_clients.append(sock)
+
+    report = {}
+
+    def delivery_latencies(sent, event):
+        """Per-receiver delivery latency (ms) and per-message fan-out completion (ms)"""
+        per_receiver, completion = [], {}
+        for sock in socket_clients:
+            for arrived, item in sock.queue.arrivals:
+                # Busy-room broadcasts may arrive coalesced into one 'batch' frame
+                if item['name'] == 'batch' and item['args'][0].get('event') == event:
+                    payloads = item['args'][0]['items']
+                elif item['name'] == event:
+                    payloads = [item['args'][0]]
+                else:
+                    continue
+                for payload in payloads:
+                    content = payload.get('content') or payload.get('c') or \
+                        (payload.get('message') or payload.get('m') or {}).get('content') or \
+                        (payload.get('message') or payload.get('m') or {}).get('c')
+                    if content in sent:
+                        latency = (arrived - sent[content]) * 1000
+                        per_receiver.append(latency)
+                        completion[content] = max(completion.get(content, 0), latency)
+            sock.queue.arrivals.clear()
+            sock.queue.clear()
+        return per_receiver, list(completion.values())
+
+    # ---------- server messages over sockets ----------
+    before = metric_snapshot(metrics)
+    sent, lock = {}, threading.Lock()
+
+    def send_server_messages(index):
+        for n in range(args.messages):
+            token = f'srv-{index}-{n}-{uuid.uuid4().hex[:6]}'
+            with lock:
+                sent[token] = time.perf_counter()
+            socket_clients[index].emit('server_message', {'server_id': server_room_id, 'content': token})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(send_server_messages, range(args.users)))
+    elapsed = time.perf_counter() - started
+    time.sleep(0.2)  # let any deferred emits flush
+    per_receiver, completion = delivery_latencies(sent, 'new_server_message')
+    report['server_message (socket)'] = {
+        'throughput_msg_s': len(sent) / elapsed,
+        'fanout_receiver': summarize(per_receiver),
+        'fanout_complete': summarize(completion),
+        'queries_per_op': queries_per_op(metrics, before, 'socket', 'server_message')
+    }
+
+    # ---------- direct messages over HTTP ----------
+    before = metric_snapshot(metrics)
+    sent, http_latency = {}, []
+
+    def send_direct_messages(index):
+        receiver = users[(index + 1) % len(users)]
+        for n in range(args.messages):
+            token = f'dm-{index}-{n}-{uuid.uuid4().hex[:6]}'
+            with lock:
+                sent[token] = time.perf_counter()
+            t0 = time.perf_counter()
+            http_clients[index].post('/api/send_message', data={'receiver_id': receiver['id'], 'content': token})
+            with lock:
+                http_latency.append((time.perf_counter() - t0) * 1000)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        list(pool.map(send_direct_messages, range(args.users)))
+    elapsed = time.perf_counter() - started
+    time.sleep(0.2)
+    per_receiver, _ = delivery_latencies(sent, 'new_message')
+    report['send_message (http)'] = {
+        'throughput_msg_s': len(sent) / elapsed,
+        'request': summarize(http_latency),
+        'fanout_receiver': summarize(per_receiver),
+        'queries_per_op': queries_per_op(metrics, before, 'http', '/api/send_message')
+    }
+
+    # ---------- read routes ----------
+    friend_id = users[1 % len(users)]['id']
+    routes = [
+        ('/api/bootstrap', '/api/bootstrap'),
+        ('/api/servers/', '/api/servers/'),
+        ('/api/servers/<server_id>', f'/api/servers/{server_room_id}'),
+        ('/api/servers/<server_id>/members', f'/api/servers/{server_room_id}/members'),
+        ('/api/servers/<server_id>/messages', f'/api/servers/{server_room_id}/messages'),
+        ('/api/friends/', '/api/friends/'),
+        ('/api/friends/requests/pending', '/api/friends/requests/pending'),
+        ('/api/servers/invites/pending', '/api/servers/invites/pending'),
+        ('/api/messages', f'/api/messages?friend_id={friend_id}'),
+        ('/api/search_users', '/api/search_users?q=user1'),
+    ]
+    for rule, url in routes:
+        before = metric_snapshot(metrics)
+        samples = []
+
+        def hit(i, url=url):
+            t0 = time.perf_counter()
+            http_clients[i % len(http_clients)].get(url)
+            return (time.perf_counter() - t0) * 1000
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=min(args.users, args.route_iterations)) as pool:
+            samples = list(pool.map(hit, range(args.route_iterations)))
+        elapsed = time.perf_counter() - started
+        report[f'GET {rule}'] = {
+            'throughput_req_s': len(samples) / elapsed,
+            'request': summarize(samples),
+            'queries_per_op': queries_per_op(metrics, before, 'http', rule)
+        }
+
+    lines = [
+        f'users={args.users} messages/user={args.messages} latency={args.latency_ms}ms '
+        f'jitter={args.jitter_ms}ms compact={args.compact} backend_calls={fake.db.calls}',
+        ''
+    ]
+    for name, result in report.items():
+        lines.append(name)
+        for key, value in result.items():
+            if isinstance(value, dict):
+                lines.append(f'  {key:<18} n={value["n"]:<6} p50={value["p50_ms"]:.1f}ms '
+                             f'p99={value["p99_ms"]:.1f}ms mean={value["mean_ms"]:.1f}ms')
+            else:
+                lines.append(f'  {key:<18} {value:.2f}')
+        lines.append('')
+
+    output = '\n'.join(lines)
+    print(output)
+    with open(args.output, 'w') as f:
+        f.write(output)
+
+
+if __name__ == '__main__':
+    main()
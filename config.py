@@ -8,4 +8,94 @@ class Config:
     SUPABASE_URL = os.getenv('SUPABASE_URL')
     SUPABASE_KEY = os.getenv('SUPABASE_KEY')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
-    UPLOAD_FOLDER = 'uploads'
\ No newline at end of file
+    UPLOAD_FOLDER = 'uploads'
+
+    # Hot-channel message ring buffer (recent server messages kept in memory)
+    SERVER_MESSAGE_BUFFER_SIZE = int(os.getenv('SERVER_MESSAGE_BUFFER_SIZE', 100))
+    SERVER_MESSAGE_BUFFER_MAX_CHANNELS = int(os.getenv('SERVER_MESSAGE_BUFFER_MAX_CHANNELS', 500))
+    SERVER_MESSAGE_BUFFER_MAX_BYTES = int(os.getenv('SERVER_MESSAGE_BUFFER_MAX_BYTES', 64 * 1024 * 1024))
+    SERVER_MESSAGE_BUFFER_IDLE_SECONDS = int(os.getenv('SERVER_MESSAGE_BUFFER_IDLE_SECONDS', 30 * 60))
+
+    # Recent direct message cache per conversation
+    DM_MESSAGE_CACHE_SIZE = int(os.getenv('DM_MESSAGE_CACHE_SIZE', 100))
+    DM_MESSAGE_CACHE_MAX_CONVERSATIONS = int(os.getenv('DM_MESSAGE_CACHE_MAX_CONVERSATIONS', 2000))
+    DM_MESSAGE_CACHE_MAX_BYTES = int(os.getenv('DM_MESSAGE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    DM_MESSAGE_CACHE_IDLE_SECONDS = int(os.getenv('DM_MESSAGE_CACHE_IDLE_SECONDS', 30 * 60))
+
+    # Let socket clients negotiate the compact message event schema
+    SOCKETIO_COMPACT_EVENTS = os.getenv('SOCKETIO_COMPACT_EVENTS', 'true').lower() == 'true'
+
+    # Socket.IO transports in the order clients try them: WebSocket first, long-polling
+    # only as a fallback (drop 'polling' to refuse it altogether)
+    SOCKETIO_TRANSPORTS = [t.strip() for t in os.getenv('SOCKETIO_TRANSPORTS', 'websocket,polling').split(',') if t.strip()]
+
+    # Heartbeat: the server pings every interval (under typical 55-60s proxy idle
+    # timeouts) and drops a client that hasn't answered within the timeout
+    SOCKETIO_PING_INTERVAL = int(os.getenv('SOCKETIO_PING_INTERVAL', 25))
+    SOCKETIO_PING_TIMEOUT = int(os.getenv('SOCKETIO_PING_TIMEOUT', 10))
+
+    # Response compression and static asset caching
+    COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+    COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+    STATIC_ASSET_MAX_AGE = int(os.getenv('STATIC_ASSET_MAX_AGE', 365 * 24 * 3600))
+
+    # Bearer token required to scrape /metrics; without one it is served to loopback only
+    METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+    # Logging
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+    LOG_DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.01))
+
+    # Per-user token-bucket rate limits, as 'count/seconds'
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+    RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL')  # shared across workers when set
+    RATE_LIMITS = {
+        'server_message': os.getenv('RATE_LIMIT_SERVER_MESSAGE', '10/5'),
+        'send_message': os.getenv('RATE_LIMIT_SEND_MESSAGE', '10/5'),
+        'search_users': os.getenv('RATE_LIMIT_SEARCH_USERS', '15/5'),
+    }
+    SEARCH_COALESCE_SECONDS = float(os.getenv('SEARCH_COALESCE_SECONDS', 2))
+
+    # Password hashing: full werkzeug method string, and hashes allowed to run at once.
+    # Changing the method rehashes each user's password on their next login.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+
+    # Threads for running one request's independent Supabase queries concurrently
+    QUERY_POOL_SIZE = int(os.getenv('QUERY_POOL_SIZE', 16))
+
+    # User ids known to exist, used to skip existence checks on DM send
+    KNOWN_USER_IDS_MAX = int(os.getenv('KNOWN_USER_IDS_MAX', 100000))
+
+    # In-process friendship graph: users kept loaded, and how long before reloading
+    FRIEND_GRAPH_MAX_USERS = int(os.getenv('FRIEND_GRAPH_MAX_USERS', 50000))
+    FRIEND_GRAPH_TTL_SECONDS = int(os.getenv('FRIEND_GRAPH_TTL_SECONDS', 300))
+
+    # Supabase call resilience: per-attempt timeout, retries for idempotent reads
+    # (backoff doubles per retry, with jitter), hedging (0 disables) and circuit breaker
+    SUPABASE_TIMEOUT_SECONDS = float(os.getenv('SUPABASE_TIMEOUT_SECONDS', 5))
+    SUPABASE_RETRIES = int(os.getenv('SUPABASE_RETRIES', 2))
+    SUPABASE_RETRY_BACKOFF_SECONDS = float(os.getenv('SUPABASE_RETRY_BACKOFF_SECONDS', 0.1))
+    SUPABASE_HEDGE_AFTER_SECONDS = float(os.getenv('SUPABASE_HEDGE_AFTER_SECONDS', 0))
+    SUPABASE_BREAKER_THRESHOLD = int(os.getenv('SUPABASE_BREAKER_THRESHOLD', 5))
+    SUPABASE_BREAKER_RESET_SECONDS = float(os.getenv('SUPABASE_BREAKER_RESET_SECONDS', 10))
+
+    # Degraded mode while Supabase is down: memory for last good responses,
+    # queued message inserts, and how often to retry them (seconds)
+    DEGRADED_SNAPSHOT_MAX_BYTES = int(os.getenv('DEGRADED_SNAPSHOT_MAX_BYTES', 32 * 1024 * 1024))
+    DEGRADED_QUEUE_MAX = int(os.getenv('DEGRADED_QUEUE_MAX', 10000))
+    DEGRADED_REPLAY_SECONDS = float(os.getenv('DEGRADED_REPLAY_SECONDS', 2))
+
+    # Client-generated message ids are accepted if their embedded time is within this many seconds of ours
+    MESSAGE_ID_MAX_SKEW_SECONDS = int(os.getenv('MESSAGE_ID_MAX_SKEW_SECONDS', 600))
+
+    # Busy-room broadcast batching: events following another within this many ms
+    # are held and sent together as one frame (0 disables), up to a max per frame
+    EMIT_BATCH_WINDOW_MS = int(os.getenv('EMIT_BATCH_WINDOW_MS', 30))
+    EMIT_BATCH_MAX = int(os.getenv('EMIT_BATCH_MAX', 100))
+
+    # Presence and typing indicators (seconds)
+    PRESENCE_FLUSH_SECONDS = float(os.getenv('PRESENCE_FLUSH_SECONDS', 0.5))
+    PRESENCE_OFFLINE_GRACE_SECONDS = float(os.getenv('PRESENCE_OFFLINE_GRACE_SECONDS', 5))
+    TYPING_THROTTLE_SECONDS = float(os.getenv('TYPING_THROTTLE_SECONDS', 2))
+    TYPING_TTL_SECONDS = float(os.getenv('TYPING_TTL_SECONDS', 6))
@@ -0,0 +1,262 @@
+"""
+Degraded Mode Module
+Keeps the app usable while Supabase is unreachable:
+
+- The last good response of the main reads (friends, servers, member lists,
+  recent messages, bootstrap) is remembered per user, and served again with a
+  staleness marker (a `stale_as_of` field and X-Data-Stale header) when the
+  same read fails because the backend is down.
+- Other writes fail with 503 and `read_only: true` instead of a bare 500.
+- Messages are queued in memory and inserted in order once Supabase answers
+  again; their ids are assigned up front, so a replay can't duplicate a
+  message whose first insert did land.
+
+Like the message caches this is per process, and the queue does not survive
+a restart.
+"""
+
+import json
+import logging
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+
+import httpx
+from flask import request, session
+
+from config import Config
+from message_helper import insert_message
+from metrics import degraded_queued_writes, degraded_stale_responses_total
+from resilience import RETRY_STATUSES, breaker
+
+logger = logging.getLogger(__name__)
+
+# GET routes whose last good response may be served stale
+STALE_READ_RULES = {
+    '/api/bootstrap',
+    '/api/friends/',
+    '/api/servers/',
+    '/api/servers/<server_id>',
+    '/api/servers/<server_id>/members',
+    '/api/servers/<server_id>/messages',
+    '/api/messages',
+}
+
+
+# Postgres error classes that mean "try again later" rather than "this row is wrong":
+# connection exceptions, transaction rollback (serialization, deadlock),
+# insufficient resources and operator intervention (shutdown, statement timeout)
+TRANSIENT_SQLSTATE_CLASSES = {'08', '40', '53', '57'}
+
+
+def is_transient_error(error):
+    """
+    True if a Supabase API error is a temporary server-side failure: a 5xx
+    without a JSON body, a PostgREST connection/schema-cache error (PGRST0xx,
+    e.g. PGRST002 while it reloads after a database restart), or a transient
+    Postgres error class.
+    """
+    code = getattr(error, 'code', None)
+    if isinstance(code, int):
+        # postgrest-py puts the HTTP status here when the body wasn't JSON
+        return code >= 500 or code in RETRY_STATUSES
+    if not isinstance(code, str):
+        return False
+    if code.startswith('PGRST'):
+        return code.startswith('PGRST0')
+    return code[:2] in TRANSIENT_SQLSTATE_CLASSES
+
+
+def backend_unavailable(error=None):
+    """
+    True if Supabase looks unreachable: the given error is a transport failure
+    (connection, timeout, open breaker) or a transient server-side error, or
+    (without an error) the breaker has seen recent failures.
+    """
+    if error is not None:
+        return isinstance(error, httpx.TransportError) or is_transient_error(error)
+    return not breaker.healthy()
+
+
+class Snapshots:
+    """Least-recently-used store of last known good values, bounded by estimated bytes"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (saved at, value, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def remember(self, key, value, size):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old:
+                self._bytes -= old[2]
+            self._entries[key] = (datetime.utcnow().isoformat(), value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+
+    def recall(self, key):
+        """(saved at ISO timestamp, value) or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0], entry[1]
+
+
+class QueueNotEmpty(httpx.TransportError):
+    """Raised instead of inserting while earlier messages are still queued"""
+
+
+class WriteQueue:
+    """FIFO of inserts waiting for Supabase, replayed by a background task"""
+
+    def __init__(self, max_items=10000, retry_interval=2.0):
+        self.max_items = max_items
+        self.retry_interval = retry_interval
+        self.socketio = None
+        self.client = None
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._replaying = threading.Lock()
+        self._started = False
+
+    def init_app(self, socketio, client):
+        self.socketio = socketio
+        self.client = client
+
+    def enqueue(self, table, row, on_result):
+        """
+        Queue an insert for replay.
+
+        Args:
+            table: Table to insert into
+            row: Row to insert (must carry its own id)
+            on_result: Called with the inserted row once it lands, or None if it was rejected
+
+        Returns:
+            False if the queue is full
+        """
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                return False
+            self._items.append((table, row, on_result))
+            degraded_queued_writes.set(len(self._items))
+        if not self._started and self.socketio is not None:
+            self._started = True
+            self.socketio.start_background_task(self._run)
+        return True
+
+    def insert(self, table, row):
+        """
+        Insert a message now, unless earlier ones are still waiting for replay:
+        inserting ahead of them would give it an earlier seq and created_at, so
+        it would show up before messages that were sent first.
+
+        Args:
+            table: Table to insert into
+            row: Row to insert (must carry its own id)
+
+        Returns:
+            Tuple of (row, created) as from insert_message
+
+        Raises:
+            QueueNotEmpty: Earlier messages are queued; queue this one behind them
+        """
+        if self._items:
+            raise QueueNotEmpty(f"{len(self._items)} queued writes pending")
+        return insert_message(self.client, table, row)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.retry_interval)
+            try:
+                self.replay()
+            except Exception:
+                logger.exception("Write replay failed")
+
+    def replay(self):
+        """Insert queued rows in order, stopping at the first sign the backend is still down"""
+        with self._replaying:
+            while True:
+                with self._lock:
+                    if not self._items:
+                        return
+                    table, row, on_result = self._items[0]
+                try:
+                    # Idempotent on the row's own id, so an attempt that did land isn't duplicated
+                    inserted, _ = insert_message(self.client, table, row)
+                except Exception as e:
+                    if backend_unavailable(e) or backend_unavailable():
+                        # Still recovering (e.g. a 503 while PostgREST reloads); keep it for the next pass
+                        return
+                    # A client or constraint error: this row will never be accepted
+                    logger.warning("Dropping queued %s insert: %s", table, e)
+                    inserted = None
+
+                with self._lock:
+                    self._items.popleft()
+                    degraded_queued_writes.set(len(self._items))
+                try:
+                    on_result(inserted)
+                except Exception:
+                    logger.exception("Queued write callback failed")
+
+
+snapshots = Snapshots(max_bytes=Config.DEGRADED_SNAPSHOT_MAX_BYTES)
+
+write_queue = WriteQueue(
+    max_items=Config.DEGRADED_QUEUE_MAX,
+    retry_interval=Config.DEGRADED_REPLAY_SECONDS
+)
+
+
+def init_app(app, socketio, client):
+    """
+    Serve stale reads and read-only errors while Supabase is down, and start
+    replaying queued writes once it is back.
+
+    Register after the compression hooks, so snapshots are taken (and stale
+    bodies built) from uncompressed JSON.
+
+    Args:
+        app: Flask application
+        socketio: SocketIO instance (runs the replay task)
+        client: Supabase client used for replays
+    """
+    write_queue.init_app(socketio, client)
+
+    @app.after_request
+    def degrade_response(response):
+        if request.url_rule is None or 'user_id' not in session:
+            return response
+        key = (session['user_id'], request.full_path)
+
+        if request.method == 'GET' and request.url_rule.rule in STALE_READ_RULES:
+            if response.status_code == 200 and response.mimetype == 'application/json':
+                data = response.get_data()
+                snapshots.remember(key, data, len(data))
+                return response
+            if response.status_code >= 500 and backend_unavailable():
+                snapshot = snapshots.recall(key)
+                if snapshot:
+                    saved_at, data = snapshot
+                    degraded_stale_responses_total.inc((('name', request.url_rule.rule),))
+                    stale = app.response_class(
+                        json.dumps({**json.loads(data), 'stale': True, 'stale_as_of': saved_at}),
+                        mimetype='application/json')
+                    stale.headers['X-Data-Stale'] = saved_at
+                    return stale
+
+        if response.status_code >= 500 and request.method != 'GET' and backend_unavailable():
+            read_only = app.response_class(
+                json.dumps({'success': False, 'read_only': True,
+                            'error': 'The server is temporarily read-only. Please try again shortly.'}),
+                status=503, mimetype='application/json')
+            read_only.headers['Retry-After'] = str(max(1, int(Config.SUPABASE_BREAKER_RESET_SECONDS)))
+            return read_only
+        return response
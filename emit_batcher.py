@@ -0,0 +1,129 @@
+"""
+Emit Batching Module
+Coalesces broadcasts to busy rooms. The first event in a quiet room is sent
+straight away; events that follow within the batch window are held and sent
+together as a single 'batch' frame ({'event': name, 'items': [payloads]})
+when the window closes. A busy room then costs its members one frame, one
+socket write and one client render per window instead of one per message,
+while a quiet room sees no added latency.
+
+Like presence flushing this is per process: with several workers each one
+batches the events it emits itself.
+"""
+
+import logging
+import threading
+import time
+
+from config import Config
+from message_helper import emit_to_room
+from metrics import socket_batched_events_total, socket_batches_total
+
+logger = logging.getLogger(__name__)
+
+BATCH_EVENT = 'batch'
+
+
+class RoomEmitBatcher:
+    """Per-room, per-event broadcast coalescing with a single flush task"""
+
+    def __init__(self, window=0.03, max_batch=100):
+        self.window = window
+        self.max_batch = max_batch
+        self.socketio = None
+        self._last_sent = {}  # (room, event) -> when its last frame went out
+        self._pending = {}    # (room, event) -> {'due': ..., 'items': [...], 'compact': [...]}
+        self._lock = threading.Lock()
+        self._running = False
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    def emit(self, event, payload, room, compact_payload=None):
+        """
+        Broadcast an event to a room (both wire formats), batching it if the
+        room has just been sent to.
+
+        Args:
+            event: Event name
+            payload: Payload for clients using the full JSON schema
+            room: Base room name
+            compact_payload: Payload for compact clients (defaults to payload)
+        """
+        if self.window <= 0:
+            emit_to_room(self.socketio, event, payload, room, compact_payload)
+            return
+
+        key = (room, event)
+        now = time.monotonic()
+        start_task = False
+        full = None
+        with self._lock:
+            batch = self._pending.get(key)
+            if batch is None and now - self._last_sent.get(key, float('-inf')) >= self.window:
+                self._last_sent[key] = now
+                batch = False
+            else:
+                if batch is None:
+                    batch = self._pending[key] = {'due': self._last_sent[key] + self.window,
+                                                  'items': [], 'compact': []}
+                batch['items'].append(payload)
+                batch['compact'].append(payload if compact_payload is None else compact_payload)
+                if len(batch['items']) >= self.max_batch:
+                    full = self._pending.pop(key)
+                    self._last_sent[key] = now
+                elif not self._running:
+                    self._running = True
+                    start_task = True
+
+        if batch is False:
+            emit_to_room(self.socketio, event, payload, room, compact_payload)
+        elif full is not None:
+            self._send(key, full)
+        if start_task:
+            self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        # Runs only while batches are waiting, so idle rooms cost nothing
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running = False
+                    now = time.monotonic()
+                    for key in [k for k, sent in self._last_sent.items() if now - sent >= self.window]:
+                        del self._last_sent[key]
+                    return
+                now = time.monotonic()
+                next_due = min(batch['due'] for batch in self._pending.values())
+                due = []
+                if next_due <= now:
+                    for key in [k for k, batch in self._pending.items() if batch['due'] <= now]:
+                        due.append((key, self._pending.pop(key)))
+                        self._last_sent[key] = now
+
+            if not due:
+                # Capped so a batch opened while sleeping isn't held much past its own due time
+                self.socketio.sleep(min(next_due - now, self.window / 4))
+                continue
+            for key, batch in due:
+                try:
+                    self._send(key, batch)
+                except Exception:
+                    logger.exception("Batched emit failed")
+
+    def _send(self, key, batch):
+        room, event = key
+        if len(batch['items']) == 1:
+            emit_to_room(self.socketio, event, batch['items'][0], room, batch['compact'][0])
+            return
+        labels = (('event', event),)
+        socket_batches_total.inc(labels)
+        socket_batched_events_total.inc(labels, len(batch['items']))
+        emit_to_room(self.socketio, BATCH_EVENT, {'event': event, 'items': batch['items']}, room,
+                     {'event': event, 'items': batch['compact']})
+
+
+batcher = RoomEmitBatcher(
+    window=Config.EMIT_BATCH_WINDOW_MS / 1000,
+    max_batch=Config.EMIT_BATCH_MAX
+)
@@ -0,0 +1,166 @@
+"""
+Friend Graph Module
+In-process adjacency sets of the friendship graph, loaded lazily per user and
+kept fresh by invalidating both users whenever a friendship is created or
+removed. Answers are-friends, friend lists, mutual-friend counts and
+friend-of-friend suggestions without a database call once the users involved
+are loaded.
+
+Like the message caches this is per process: entries also expire after a TTL
+so friendships changed through another worker are picked up eventually, but
+are still used if reloading fails because Supabase is unreachable.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+
+from config import Config
+from supabase_helper import get_friendships
+
+
+class FriendGraph:
+    """Bounded, least-recently-used map of user id -> {friend id: friends since}"""
+
+    def __init__(self, max_users=50000, ttl=300):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._friends = OrderedDict()  # user_id -> (loaded at, {friend_id: created_at})
+        self._epoch = 0                # bumped on every invalidation
+        self._lock = threading.Lock()
+
+    def _get(self, user_id):
+        # Caller holds the lock
+        entry = self._friends.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            # Kept (until evicted) as a fallback while the database is unreachable
+            return None
+        self._friends.move_to_end(user_id)
+        return entry[1]
+
+    def _put(self, user_id, friendships):
+        # Caller holds the lock
+        self._friends[user_id] = (time.monotonic(), friendships)
+        self._friends.move_to_end(user_id)
+        while len(self._friends) > self.max_users:
+            self._friends.popitem(last=False)
+
+    def epoch(self):
+        """Invalidation counter; take it before reading rows to pass to store()"""
+        with self._lock:
+            return self._epoch
+
+    def store(self, user_id, friendships, epoch=None):
+        """
+        Seed a user's adjacency set from friendship rows that were already read.
+
+        Args:
+            user_id: User the rows belong to
+            friendships: Dict of friend id -> friendship created_at
+            epoch: epoch() from before the rows were read; if a friendship has
+                changed since, the rows may be stale and are not cached
+        """
+        with self._lock:
+            if epoch is not None and self._epoch != epoch:
+                return
+            self._put(user_id, dict(friendships))
+
+    def load(self, client, user_ids):
+        """
+        Make sure every given user is loaded, fetching all missing ones together.
+
+        Args:
+            client: Supabase client to query with
+            user_ids: Iterable of user ids
+
+        Returns:
+            Dict of user id -> {friend id: created_at} for every requested user
+        """
+        result = {}
+        with self._lock:
+            for user_id in set(user_ids):
+                friendships = self._get(user_id)
+                if friendships is not None:
+                    result[user_id] = friendships
+            missing = [uid for uid in set(user_ids) if uid not in result]
+            epoch = self._epoch
+        if not missing:
+            return result
+
+        try:
+            loaded = get_friendships(client, missing)
+        except httpx.TransportError:
+            # Backend down: expired entries are better than nothing, if we have them all
+            with self._lock:
+                stale = {uid: self._friends[uid][1] for uid in missing if uid in self._friends}
+            if len(stale) < len(missing):
+                raise
+            result.update(stale)
+            return result
+        with self._lock:
+            # A friendship changed while we were reading; use the rows but don't cache them
+            if self._epoch == epoch:
+                for user_id, friendships in loaded.items():
+                    self._put(user_id, friendships)
+        result.update(loaded)
+        return result
+
+    def friends(self, client, user_id):
+        """Dict of friend id -> friendship created_at for one user"""
+        return dict(self.load(client, [user_id])[user_id])
+
+    def are_friends(self, client, user_id, other_id):
+        """True if the two users are friends; only loads a user when neither is cached"""
+        with self._lock:
+            for a, b in ((user_id, other_id), (other_id, user_id)):
+                friendships = self._get(a)
+                if friendships is not None:
+                    return b in friendships
+        return other_id in self.load(client, [user_id])[user_id]
+
+    def mutual_count(self, client, user_id, other_id):
+        """Number of friends the two users have in common"""
+        graph = self.load(client, [user_id, other_id])
+        smaller, larger = sorted((graph[user_id], graph[other_id]), key=len)
+        return sum(1 for friend_id in smaller if friend_id in larger)
+
+    def suggestions(self, client, user_id, exclude=(), limit=10):
+        """
+        Friends of friends ranked by how many mutual friends they share with the user.
+
+        Args:
+            client: Supabase client to query with
+            user_id: User to suggest friends for
+            exclude: User ids to leave out (e.g. pending requests)
+            limit: Maximum number of suggestions
+
+        Returns:
+            List of (user id, mutual friend count), best first
+        """
+        friends = self.load(client, [user_id])[user_id]
+        graph = self.load(client, friends)
+        skip = set(friends) | set(exclude) | {user_id}
+
+        scores = {}
+        for friend_id in friends:
+            for candidate in graph.get(friend_id, ()):
+                if candidate not in skip:
+                    scores[candidate] = scores.get(candidate, 0) + 1
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+    def invalidate(self, *user_ids):
+        """Forget users whose friendships just changed"""
+        with self._lock:
+            self._epoch += 1
+            for user_id in user_ids:
+                self._friends.pop(user_id, None)
+
+
+friend_graph = FriendGraph(
+    max_users=Config.FRIEND_GRAPH_MAX_USERS,
+    ttl=Config.FRIEND_GRAPH_TTL_SECONDS
+)
@@ -0,0 +1,110 @@
+"""
+Logging Helper Module
+Structured JSON logging with levels, sampled debug logs, a non-blocking queue
+handler, per-request correlation ids and secret redaction
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+
+from flask import g, has_request_context, request
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach the current request's correlation id (or socket sid) to each record"""
+
+    def filter(self, record):
+        request_id = None
+        if has_request_context():
+            request_id = g.get('request_id') or getattr(request, 'sid', None)
+        record.request_id = request_id
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of DEBUG records.
+
+    A call site can override the default rate with extra={'sample_rate': ...}.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        return random.random() < getattr(record, 'sample_rate', self.rate)
+
+
+class JsonFormatter(logging.Formatter):
+    """Render records as one JSON object per line, with secret values masked"""
+
+    def __init__(self, secrets=()):
+        super().__init__()
+        self.secrets = [s for s in secrets if s and len(s) >= 8]
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None)
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+
+        line = json.dumps(entry, default=str)
+        for secret in self.secrets:
+            line = line.replace(secret, '[REDACTED]')
+        return line
+
+
+def init_logging(app):
+    """
+    Configure root logging for the app and assign request correlation ids.
+
+    Records are formatted in the calling greenlet/thread and written to stdout
+    by a background QueueListener, so handlers never block on I/O.
+
+    Args:
+        app: Flask application
+    """
+    secrets = [app.config.get('SUPABASE_KEY'), app.config.get('SECRET_KEY'), app.config.get('METRICS_TOKEN')]
+
+    queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    queue_handler.setFormatter(JsonFormatter(secrets))
+    queue_handler.addFilter(RequestContextFilter())
+    queue_handler.addFilter(SamplingFilter(app.config['LOG_DEBUG_SAMPLE_RATE']))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+    listener = logging.handlers.QueueListener(queue_handler.queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(app.config['LOG_LEVEL'])
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = (request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex[:16])[:64]
+
+    @app.after_request
+    def return_request_id(response):
+        if 'request_id' in g:
+            response.headers[REQUEST_ID_HEADER] = g.request_id
+        return response
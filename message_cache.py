@@ -0,0 +1,230 @@
+"""
+Message Cache Module
+In-process caches of recent, fully-enriched messages so hot conversations
+can be served without a Supabase round trip.
+
+All caches are per process: with several workers each keeps its own copy,
+and a miss simply falls back to the database.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from config import Config
+
+# Rough per-message overhead (dict, keys, ids, timestamps) on top of content
+MESSAGE_OVERHEAD_BYTES = 512
+
+
+def estimate_message_size(message):
+    """
+    Estimate the memory held by a cached message.
+
+    Args:
+        message: Message dict
+
+    Returns:
+        Approximate size in bytes
+    """
+    size = MESSAGE_OVERHEAD_BYTES + len(message.get('content') or '')
+    replied_to = message.get('replied_to')
+    if replied_to:
+        size += len(replied_to.get('content') or '')
+    return size
+
+
+def message_order(message):
+    """Sort key for messages of one channel: sequence number, then creation time"""
+    return (message.get('seq') or 0, message.get('created_at') or '')
+
+
+def conversation_key(user_a, user_b):
+    """
+    Canonical cache key for a direct message conversation.
+
+    Args:
+        user_a: One participant's user id
+        user_b: The other participant's user id
+
+    Returns:
+        Key that is the same regardless of argument order
+    """
+    return tuple(sorted((str(user_a), str(user_b))))
+
+
+class ChannelMessageBuffer:
+    """
+    Bounded ring buffer of the most recent messages per channel.
+
+    A channel is only served from memory once it is known to hold the full
+    recent window: either it was seeded from the database, or enough messages
+    have been appended to fill the ring. Idle channels are evicted after
+    `idle_seconds`, and least recently used channels are evicted whenever the
+    channel count or estimated byte budget is exceeded.
+    """
+
+    def __init__(self, per_channel, max_channels, max_bytes, idle_seconds):
+        self.per_channel = per_channel
+        self.max_channels = max_channels
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._channels = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def get(self, key):
+        """
+        Return the buffered messages (oldest first) for a channel.
+
+        Args:
+            key: Channel key (e.g. server id)
+
+        Returns:
+            List of message dicts, or None if the channel is not warm
+        """
+        with self._lock:
+            self._sweep_idle()
+            channel = self._channels.get(key)
+            if not channel or not (channel['complete'] or len(channel['messages']) == self.per_channel):
+                return None
+            channel['last_used'] = time.monotonic()
+            self._channels.move_to_end(key)
+            return list(channel['messages'])
+
+    def after_seq(self, key, since_seq, until_seq=None):
+        """
+        Return the buffered messages with since_seq < seq < until_seq, if the
+        buffer provably holds all of them.
+
+        Args:
+            key: Channel key
+            since_seq: Last sequence number the caller already has
+            until_seq: Exclusive upper bound (None for everything newer)
+
+        Returns:
+            List of message dicts in sequence order, or None if the range
+            reaches back past the buffer or has a hole in it
+        """
+        messages = self.get(key)
+        if messages is None:
+            return None
+        if not messages:
+            return []
+        messages.sort(key=message_order)
+        # Messages still being inserted elsewhere can't be seen; a hole means "ask the database"
+        if (messages[0].get('seq') or 0) > since_seq + 1:
+            return None
+        wanted = [m for m in messages if (m.get('seq') or 0) > since_seq
+                  and (until_seq is None or m['seq'] < until_seq)]
+        for expected, message in enumerate(wanted, since_seq + 1):
+            if message['seq'] != expected:
+                return None
+        if until_seq is not None and since_seq + len(wanted) < until_seq - 1:
+            return None
+        return wanted
+
+    def seed(self, key, messages):
+        """
+        Fill a channel from a database read of its most recent messages.
+
+        Messages appended while the read was in flight are kept.
+
+        Args:
+            key: Channel key
+            messages: Message dicts, oldest first
+        """
+        with self._lock:
+            existing = self._channels.get(key)
+            merged = list(messages)
+            if existing:
+                seen = {m['id'] for m in merged}
+                merged.extend(m for m in existing['messages'] if m['id'] not in seen)
+                merged.sort(key=message_order)
+            channel = self._replace(key, merged)
+            channel['complete'] = True
+            self._enforce_budget()
+
+    def append(self, key, message):
+        """
+        Add a newly sent message to a channel, creating it if needed.
+
+        Args:
+            key: Channel key
+            message: Message dict
+        """
+        with self._lock:
+            channel = self._channels.get(key)
+            if channel is None:
+                channel = self._replace(key, [])
+            messages = channel['messages']
+            if len(messages) == messages.maxlen:
+                evicted_size = estimate_message_size(messages.popleft())
+                channel['bytes'] -= evicted_size
+                self._bytes -= evicted_size
+            # Concurrent sends can finish out of order; keep the ring in sequence order
+            position = len(messages)
+            while position and message_order(messages[position - 1]) > message_order(message):
+                position -= 1
+            messages.insert(position, message)
+            size = estimate_message_size(message)
+            channel['bytes'] += size
+            self._bytes += size
+            channel['last_used'] = time.monotonic()
+            self._channels.move_to_end(key)
+            self._enforce_budget()
+
+    def discard(self, key):
+        """Drop a channel from the buffer"""
+        with self._lock:
+            self._drop(key)
+
+    def _replace(self, key, messages):
+        self._drop(key)
+        ring = deque(messages[-self.per_channel:], maxlen=self.per_channel)
+        channel = {
+            'messages': ring,
+            'complete': False,
+            'bytes': sum(estimate_message_size(m) for m in ring),
+            'last_used': time.monotonic()
+        }
+        self._channels[key] = channel
+        self._bytes += channel['bytes']
+        return channel
+
+    def _drop(self, key):
+        channel = self._channels.pop(key, None)
+        if channel:
+            self._bytes -= channel['bytes']
+
+    def _enforce_budget(self):
+        while self._channels and (len(self._channels) > self.max_channels or self._bytes > self.max_bytes):
+            oldest_key = next(iter(self._channels))
+            self._drop(oldest_key)
+
+    def _sweep_idle(self):
+        now = time.monotonic()
+        if now - self._last_sweep < min(self.idle_seconds, 60):
+            return
+        self._last_sweep = now
+        cutoff = now - self.idle_seconds
+        for key in [k for k, c in self._channels.items() if c['last_used'] < cutoff]:
+            self._drop(key)
+
+
+# Recent server channel messages, shared by the REST routes and socket handlers
+server_message_buffer = ChannelMessageBuffer(
+    per_channel=Config.SERVER_MESSAGE_BUFFER_SIZE,
+    max_channels=Config.SERVER_MESSAGE_BUFFER_MAX_CHANNELS,
+    max_bytes=Config.SERVER_MESSAGE_BUFFER_MAX_BYTES,
+    idle_seconds=Config.SERVER_MESSAGE_BUFFER_IDLE_SECONDS
+)
+
+# Recent direct messages per conversation, keyed by conversation_key()
+direct_message_buffer = ChannelMessageBuffer(
+    per_channel=Config.DM_MESSAGE_CACHE_SIZE,
+    max_channels=Config.DM_MESSAGE_CACHE_MAX_CONVERSATIONS,
+    max_bytes=Config.DM_MESSAGE_CACHE_MAX_BYTES,
+    idle_seconds=Config.DM_MESSAGE_CACHE_IDLE_SECONDS
+)
@@ -0,0 +1,147 @@
+"""
+Message Helper Module
+Shared shaping of direct and server message rows before they are returned or emitted
+"""
+
+# Denormalized reply preview columns (see migrations/005_reply_previews.sql)
+REPLY_PREVIEW_COLUMNS = 'reply_preview_content, reply_preview_sender_id, reply_preview_sender_username'
+
+
+def attach_reply_preview(message):
+    """
+    Replace the stored reply preview columns with a nested 'replied_to' dict.
+    
+    Args:
+        message: Message row (dict) as returned by Supabase; modified in place
+    
+    Returns:
+        The same message dict
+    """
+    content = message.pop('reply_preview_content', None)
+    sender_id = message.pop('reply_preview_sender_id', None)
+    username = message.pop('reply_preview_sender_username', None)
+    
+    if message.get('reply_to_id') and sender_id:
+        message['replied_to'] = {
+            'id': message['reply_to_id'],
+            'content': content,
+            'sender_id': sender_id,
+            'sender': {'id': sender_id, 'username': username}
+        }
+    
+    return message
+
+
+def insert_message(client, table, row):
+    """
+    Insert a message whose id was assigned up front, idempotently.
+    
+    If a row with that id already exists (a retried send, or a replay of an
+    insert that did land) the stored row is returned instead of an error.
+    
+    Args:
+        client: Supabase client
+        table: 'direct_messages' or 'server_messages'
+        row: Row to insert, including its id
+    
+    Returns:
+        (stored row, True if this call inserted it); the row is None if the
+        id is already taken by another user's message
+    """
+    try:
+        result = client.table(table).insert(row).execute()
+        return (result.data or [row])[0], True
+    except Exception as e:
+        # Unique violation on the primary key: the message is already stored
+        if getattr(e, 'code', None) != '23505':
+            raise
+    existing = client.table(table).select('*').eq('id', row['id']).execute().data
+    if existing and existing[0]['sender_id'] == row['sender_id']:
+        return existing[0], False
+    return None, False
+
+
+def parse_seq_range(args):
+    """
+    Read the since_seq / until_seq sync parameters of a message history request.
+    
+    Args:
+        args: Request query arguments
+    
+    Returns:
+        (since_seq, until_seq); since_seq is None for an ordinary page read,
+        until_seq is None when the range is open-ended
+    
+    Raises:
+        ValueError: If either value is not a non-negative integer
+    """
+    since_seq = args.get('since_seq')
+    until_seq = args.get('until_seq')
+    since_seq = int(since_seq) if since_seq not in (None, '') else None
+    until_seq = int(until_seq) if until_seq not in (None, '') else None
+    if (since_seq is not None and since_seq < 0) or (until_seq is not None and since_seq is None):
+        raise ValueError('until_seq requires a non-negative since_seq')
+    return since_seq, until_seq
+
+
+# Clients that negotiate the compact event schema join "<room>:compact" instead of "<room>"
+COMPACT_ROOM_SUFFIX = ':compact'
+
+
+def compact_room(room):
+    """Name of the compact-format variant of a socket room"""
+    return f"{room}{COMPACT_ROOM_SUFFIX}"
+
+
+def compact_message(message):
+    """
+    Build the compact wire form of a direct or server message.
+    
+    Keys are shortened and the nested sender object is replaced by its id;
+    clients resolve ids against their own profile table.
+    
+    Args:
+        message: Direct message row or server message dict
+    
+    Returns:
+        Compact dict with None fields dropped
+    """
+    fields = {
+        'i': message.get('id'),
+        'q': message.get('seq'),
+        's': message.get('sender_id') or (message.get('sender') or {}).get('id'),
+        'r': message.get('receiver_id'),
+        'sv': message.get('server_id'),
+        'c': message.get('content'),
+        't': message.get('created_at'),
+        'f': message.get('file_url'),
+        'ft': message.get('file_type')
+    }
+    compact = {key: value for key, value in fields.items() if value is not None}
+    
+    replied_to = message.get('replied_to')
+    if replied_to:
+        compact['rp'] = {
+            'i': replied_to.get('id'),
+            'c': replied_to.get('content'),
+            's': replied_to.get('sender_id')
+        }
+    
+    return compact
+
+
+def emit_to_room(socketio, event, payload, room, compact_payload=None, **kwargs):
+    """
+    Emit an event to both the full and compact variants of a room.
+    
+    Args:
+        socketio: SocketIO instance
+        event: Event name
+        payload: Payload for clients using the full JSON schema
+        room: Base room name
+        compact_payload: Payload for compact clients (defaults to payload)
+        **kwargs: Extra emit arguments (e.g. skip_sid)
+    """
+    socketio.emit(event, payload, room=room, **kwargs)
+    socketio.emit(event, payload if compact_payload is None else compact_payload,
+                  room=compact_room(room), **kwargs)
@@ -0,0 +1,105 @@
+"""
+Message ID Module
+Time-ordered message ids generated by the app instead of the database.
+
+Ids are UUIDv7 (RFC 9562), the ULID layout in UUID form, so they fit the
+existing UUID columns and foreign keys: a 48-bit Unix millisecond timestamp,
+a 12-bit counter that keeps ids from one process strictly increasing within
+a millisecond, and 62 random bits. The random tail keeps ids from different
+worker processes (or clients) from colliding without any coordination.
+
+Because a message has its id before it is stored, it can be referenced and
+rendered straight away, and a retried send reuses the same id instead of
+creating a duplicate.
+"""
+
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from config import Config
+
+COUNTER_MAX = 0xFFF
+
+
+class MessageIdGenerator:
+    """Monotonic UUIDv7 generator; one per process"""
+
+    def __init__(self):
+        self._last_ms = 0
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def new_id(self):
+        """
+        Generate a new message id.
+
+        Returns:
+            UUIDv7 string, greater than any id this generator returned before
+        """
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                # Start low in the counter range so a burst has room to count up
+                self._last_ms = now_ms
+                self._counter = int.from_bytes(os.urandom(2), 'big') & 0x3FF
+            else:
+                # Same millisecond (or the clock stepped back): count on from the last id
+                self._counter += 1
+                if self._counter > COUNTER_MAX:
+                    self._last_ms += 1
+                    self._counter = 0
+            unix_ms, counter = self._last_ms, self._counter
+
+        rand_b = int.from_bytes(os.urandom(8), 'big') & ((1 << 62) - 1)
+        value = (unix_ms << 80) | (0x7 << 76) | (counter << 64) | (0b10 << 62) | rand_b
+        return str(uuid.UUID(int=value))
+
+
+_generator = MessageIdGenerator()
+
+
+def new_message_id():
+    """New time-ordered message id (UUIDv7 string)"""
+    return _generator.new_id()
+
+
+def message_id_time(message_id):
+    """
+    Creation time embedded in a UUIDv7 message id.
+
+    Args:
+        message_id: UUIDv7 string
+
+    Returns:
+        Aware UTC datetime
+    """
+    unix_ms = uuid.UUID(message_id).int >> 80
+    return datetime.fromtimestamp(unix_ms / 1000, tz=timezone.utc)
+
+
+def parse_client_message_id(value):
+    """
+    Validate a message id supplied by a client for an idempotent send.
+
+    Args:
+        value: Id from the request, or None
+
+    Returns:
+        The id in canonical form, or None if none was supplied or it is not
+        a UUIDv7 with a plausible timestamp (the caller then generates one)
+    """
+    if not value:
+        return None
+    try:
+        parsed = uuid.UUID(str(value))
+    except ValueError:
+        return None
+    if parsed.version != 7:
+        return None
+    skew = abs(time.time() - (parsed.int >> 80) / 1000)
+    if skew > Config.MESSAGE_ID_MAX_SKEW_SECONDS:
+        return None
+    return str(parsed)
@@ -0,0 +1,245 @@
+"""
+Metrics Module
+Per-route and per-socket-event latency, Supabase call counts and payload sizes,
+exposed in Prometheus text format at /metrics
+"""
+
+import json
+import threading
+import time
+from functools import wraps
+
+from flask import Response, g, has_app_context, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# Clients allowed to scrape /metrics when no METRICS_TOKEN is set
+LOOPBACK_ADDRS = ('127.0.0.1', '::1')
+
+
+def _format_labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{key}="{escape(value)}"' for key, value in labels)
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of (label, value) pairs"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = f'{{{_format_labels(labels)}}}' if labels else ''
+                lines.append(f'{self.name}{label_text} {value}')
+        return lines
+
+
+class Gauge:
+    """Single value that can go up and down"""
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def render(self):
+        return [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge',
+                f'{self.name} {self._value}']
+
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of (label, value) pairs"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, labels=()):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f'{self.name}_bucket{{{_format_labels(labels + (("le", bound),))}}} {count}')
+                lines.append(f'{self.name}_bucket{{{_format_labels(labels + (("le", "+Inf"),))}}} {series["count"]}')
+                lines.append(f'{self.name}_sum{{{_format_labels(labels)}}} {series["sum"]}')
+                lines.append(f'{self.name}_count{{{_format_labels(labels)}}} {series["count"]}')
+        return lines
+
+
+# Registry
+request_duration = Histogram(
+    'chatapp_request_duration_seconds', 'Wall time per HTTP route or socket event', LATENCY_BUCKETS)
+request_supabase_calls = Histogram(
+    'chatapp_request_supabase_calls', 'Supabase HTTP calls made while handling one route or event', QUERY_COUNT_BUCKETS)
+request_bytes_in = Histogram(
+    'chatapp_request_bytes_in', 'Request payload size per route or event', BYTES_BUCKETS)
+request_bytes_out = Histogram(
+    'chatapp_request_bytes_out', 'Response payload size per HTTP route', BYTES_BUCKETS)
+requests_total = Counter(
+    'chatapp_requests_total', 'Handled HTTP requests and socket events by status')
+supabase_calls_total = Counter(
+    'chatapp_supabase_calls_total', 'Supabase HTTP calls by service and method')
+supabase_retries_total = Counter(
+    'chatapp_supabase_retries_total', 'Supabase calls retried after a failure, by method')
+supabase_hedges_total = Counter(
+    'chatapp_supabase_hedges_total', 'Slow Supabase reads sent a second time')
+supabase_breaker_rejections_total = Counter(
+    'chatapp_supabase_breaker_rejections_total', 'Supabase calls failed fast by the open circuit breaker')
+supabase_breaker_state = Gauge(
+    'chatapp_supabase_breaker_state', 'Supabase circuit breaker state (0 closed, 1 half-open, 2 open)')
+degraded_stale_responses_total = Counter(
+    'chatapp_degraded_stale_responses_total', 'Reads answered from a stale snapshot while Supabase was down')
+degraded_queued_writes = Gauge(
+    'chatapp_degraded_queued_writes', 'Writes waiting to be replayed to Supabase')
+socket_connections_total = Counter(
+    'chatapp_socket_connections_total', 'Authenticated socket connections by initial transport')
+socket_batches_total = Counter(
+    'chatapp_socket_batches_total', 'Batched socket frames sent, by event')
+socket_batched_events_total = Counter(
+    'chatapp_socket_batched_events_total', 'Socket events delivered inside a batched frame, by event')
+
+REGISTRY = [request_duration, request_supabase_calls, request_bytes_in, request_bytes_out,
+            requests_total, supabase_calls_total, supabase_retries_total, supabase_hedges_total,
+            supabase_breaker_rejections_total, supabase_breaker_state, degraded_stale_responses_total,
+            degraded_queued_writes, socket_connections_total, socket_batches_total,
+            socket_batched_events_total]
+
+
+def render_metrics():
+    """Render every registered metric in Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def instrument_client(client):
+    """
+    Count every HTTP call a Supabase client makes (PostgREST and storage).
+
+    Calls are attributed to the route or socket event currently being handled.
+
+    Args:
+        client: Supabase client
+
+    Returns:
+        The same client
+    """
+    for service in ('postgrest', 'storage'):
+        session = getattr(getattr(client, service, None), 'session', None)
+        if session is None:
+            continue
+
+        def on_request(http_request, service=service):
+            supabase_calls_total.inc((('service', service), ('method', http_request.method)))
+            if has_app_context() and 'supabase_calls' in g:
+                g.supabase_calls += 1
+
+        session.event_hooks['request'].append(on_request)
+    return client
+
+
+def _start():
+    g.metrics_start = time.perf_counter()
+    g.supabase_calls = 0
+
+
+def _record(kind, name, status, bytes_in, bytes_out=None):
+    labels = (('kind', kind), ('name', name))
+    request_duration.observe(time.perf_counter() - g.metrics_start, labels)
+    request_supabase_calls.observe(g.supabase_calls, labels)
+    if bytes_in is not None:
+        request_bytes_in.observe(bytes_in, labels)
+    if bytes_out is not None:
+        request_bytes_out.observe(bytes_out, labels)
+    requests_total.inc(labels + (('status', status),))
+
+
+def track_event(event):
+    """
+    Decorator recording latency, Supabase calls and payload size for a socket handler.
+
+    Args:
+        event: Socket event name used as the metric label
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            _start()
+            bytes_in = len(json.dumps(args[0], default=str)) if args else 0
+            status = 'ok'
+            try:
+                return f(*args, **kwargs)
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                _record('socket', event, status, bytes_in)
+        return decorated_function
+    return decorator
+
+
+def init_app(app):
+    """
+    Time every HTTP route and register the /metrics endpoint.
+
+    Call before other after_request hooks (e.g. compression) are registered,
+    so the recorded response size is what actually goes on the wire.
+
+    Args:
+        app: Flask application
+    """
+    token = app.config.get('METRICS_TOKEN')
+
+    @app.before_request
+    def start_request_metrics():
+        _start()
+
+    @app.after_request
+    def record_request_metrics(response):
+        if request.endpoint == 'metrics' or 'metrics_start' not in g:
+            return response
+        name = request.url_rule.rule if request.url_rule else 'unmatched'
+        _record('http', name, str(response.status_code), request.content_length or 0,
+                None if response.direct_passthrough else response.calculate_content_length())
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        elif request.remote_addr not in LOOPBACK_ADDRS or 'X-Forwarded-For' in request.headers:
+            # No token configured: only a scraper on this host may read it (not via a local proxy)
+            return Response('Not Found\n', status=404, mimetype='text/plain')
+        return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,95 @@
+-- Migration 005: Denormalized reply previews
+-- Stores a truncated preview of the replied-to message on the reply itself,
+-- so reads never have to look up reply_to_id.
+-- Run this in Supabase SQL Editor after 004_add_message_replies.sql
+
+-- ============================================
+-- 1. PREVIEW COLUMNS
+-- ============================================
+ALTER TABLE server_messages
+ADD COLUMN IF NOT EXISTS reply_preview_content TEXT,
+ADD COLUMN IF NOT EXISTS reply_preview_sender_id UUID,
+ADD COLUMN IF NOT EXISTS reply_preview_sender_username TEXT;
+
+ALTER TABLE direct_messages
+ADD COLUMN IF NOT EXISTS reply_preview_content TEXT,
+ADD COLUMN IF NOT EXISTS reply_preview_sender_id UUID,
+ADD COLUMN IF NOT EXISTS reply_preview_sender_username TEXT;
+
+-- ============================================
+-- 2. CAPTURE PREVIEW AT WRITE TIME
+-- ============================================
+-- BEFORE INSERT, so the row returned by the insert already carries the preview
+CREATE OR REPLACE FUNCTION fill_reply_preview()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF NEW.reply_to_id IS NOT NULL THEN
+        EXECUTE format(
+            'SELECT left(m.content, 200), m.sender_id, u.username
+             FROM %I m LEFT JOIN users u ON u.id = m.sender_id
+             WHERE m.id = $1',
+            TG_TABLE_NAME
+        )
+        INTO NEW.reply_preview_content, NEW.reply_preview_sender_id, NEW.reply_preview_sender_username
+        USING NEW.reply_to_id;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_server_messages_reply_preview ON server_messages;
+CREATE TRIGGER trigger_server_messages_reply_preview
+BEFORE INSERT ON server_messages
+FOR EACH ROW
+EXECUTE FUNCTION fill_reply_preview();
+
+DROP TRIGGER IF EXISTS trigger_direct_messages_reply_preview ON direct_messages;
+CREATE TRIGGER trigger_direct_messages_reply_preview
+BEFORE INSERT ON direct_messages
+FOR EACH ROW
+EXECUTE FUNCTION fill_reply_preview();
+
+-- ============================================
+-- 3. BACKFILL EXISTING REPLIES (in batches)
+-- ============================================
+DO $$
+DECLARE
+    batch_size CONSTANT INT := 1000;
+    updated INT;
+BEGIN
+    LOOP
+        UPDATE server_messages m
+        SET reply_preview_content = left(r.content, 200),
+            reply_preview_sender_id = r.sender_id,
+            reply_preview_sender_username = u.username
+        FROM server_messages r
+        LEFT JOIN users u ON u.id = r.sender_id
+        WHERE r.id = m.reply_to_id
+          AND m.id IN (
+              SELECT id FROM server_messages
+              WHERE reply_to_id IS NOT NULL AND reply_preview_sender_id IS NULL
+                AND reply_to_id IN (SELECT id FROM server_messages)
+              LIMIT batch_size
+          );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+    END LOOP;
+
+    LOOP
+        UPDATE direct_messages m
+        SET reply_preview_content = left(r.content, 200),
+            reply_preview_sender_id = r.sender_id,
+            reply_preview_sender_username = u.username
+        FROM direct_messages r
+        LEFT JOIN users u ON u.id = r.sender_id
+        WHERE r.id = m.reply_to_id
+          AND m.id IN (
+              SELECT id FROM direct_messages
+              WHERE reply_to_id IS NOT NULL AND reply_preview_sender_id IS NULL
+                AND reply_to_id IN (SELECT id FROM direct_messages)
+              LIMIT batch_size
+          );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+    END LOOP;
+END $$;
@@ -0,0 +1,73 @@
+-- Migration 006: Read state and unread counts
+-- One last-read marker per user per conversation (DM partner or server), and
+-- an RPC that returns every unread count for a user in a single call.
+-- Run this in Supabase SQL Editor after 005_reply_previews.sql
+
+-- ============================================
+-- 1. READ MARKERS
+-- ============================================
+CREATE TABLE IF NOT EXISTS read_markers (
+    user_id UUID NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    channel_type TEXT NOT NULL CHECK (channel_type IN ('dm', 'server')),
+    channel_id UUID NOT NULL,  -- the other user for 'dm', the server for 'server'
+    last_read_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (user_id, channel_type, channel_id)
+);
+
+-- Unread DMs are counted per (receiver, sender) after a timestamp
+CREATE INDEX IF NOT EXISTS idx_direct_messages_receiver_sender
+ON direct_messages(receiver_id, sender_id, created_at DESC);
+
+-- ============================================
+-- 2. UNREAD COUNTS
+-- ============================================
+-- Counts stop at cap_at per channel (the UI shows "99+"), so a channel that
+-- was never read costs at most cap_at index entries, not its whole history.
+-- DM partners come from friendships; server channels with no marker count
+-- from when the user joined.
+CREATE OR REPLACE FUNCTION get_unread_counts(uid UUID, cap_at INT DEFAULT 100)
+RETURNS TABLE (channel_type TEXT, channel_id UUID, unread INT) AS $$
+    SELECT 'dm', partners.friend_id, counted.n
+    FROM (
+        SELECT user2_id AS friend_id FROM friendships WHERE user1_id = uid
+        UNION ALL
+        SELECT user1_id FROM friendships WHERE user2_id = uid
+    ) partners
+    LEFT JOIN read_markers rm
+        ON rm.user_id = uid AND rm.channel_type = 'dm' AND rm.channel_id = partners.friend_id
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*)::INT AS n FROM (
+            SELECT 1 FROM direct_messages dm
+            WHERE dm.receiver_id = uid
+              AND dm.sender_id = partners.friend_id
+              AND dm.created_at > COALESCE(rm.last_read_at, '-infinity')
+            LIMIT cap_at
+        ) capped
+    ) counted
+    WHERE counted.n > 0
+
+    UNION ALL
+
+    SELECT 'server', sm.server_id, counted.n
+    FROM server_members sm
+    LEFT JOIN read_markers rm
+        ON rm.user_id = uid AND rm.channel_type = 'server' AND rm.channel_id = sm.server_id
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*)::INT AS n FROM (
+            SELECT 1 FROM server_messages msg
+            WHERE msg.server_id = sm.server_id
+              AND msg.created_at > COALESCE(rm.last_read_at, sm.joined_at)
+              AND msg.sender_id <> uid
+            LIMIT cap_at
+        ) capped
+    ) counted
+    WHERE sm.user_id = uid AND counted.n > 0;
+$$ LANGUAGE sql STABLE;
+
+-- ============================================
+-- 3. ROW LEVEL SECURITY
+-- ============================================
+ALTER TABLE read_markers ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow service role all" ON read_markers;
+CREATE POLICY "Allow service role all" ON read_markers FOR ALL USING (true);
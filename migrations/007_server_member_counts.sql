@@ -0,0 +1,12 @@
+-- Migration 007: Batched server member counts
+-- Returns the member count of many servers in one call, replacing one
+-- count query per server when listing a user's servers.
+-- Run this in Supabase SQL Editor after 006_read_state.sql
+
+CREATE OR REPLACE FUNCTION get_server_member_counts(sids UUID[])
+RETURNS TABLE (server_id UUID, member_count INT) AS $$
+    SELECT sm.server_id, COUNT(*)::INT
+    FROM server_members sm
+    WHERE sm.server_id = ANY(sids)
+    GROUP BY sm.server_id;
+$$ LANGUAGE sql STABLE;
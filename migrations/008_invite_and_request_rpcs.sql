@@ -0,0 +1,94 @@
+-- Migration 008: Single-call server invites and friend requests
+-- Validates and inserts in one database round trip, returning a typed
+-- error code instead of making the app check each rule with its own query.
+-- Run this in Supabase SQL Editor after 007_server_member_counts.sql
+
+-- ============================================
+-- 1. SERVER INVITES
+-- ============================================
+-- Returns {"invite_id": ...} on success or {"error": code} where code is one of
+-- not_member, user_not_found, self_invite, not_friends, already_member, invite_exists
+CREATE OR REPLACE FUNCTION create_server_invite(sid UUID, inviter UUID, invitee_tag TEXT)
+RETURNS JSONB AS $$
+DECLARE
+    invitee UUID;
+    new_invite_id UUID;
+BEGIN
+    IF NOT is_server_member(sid, inviter) THEN
+        RETURN jsonb_build_object('error', 'not_member');
+    END IF;
+
+    SELECT id INTO invitee FROM users WHERE user_tag = invitee_tag;
+    IF invitee IS NULL THEN
+        RETURN jsonb_build_object('error', 'user_not_found');
+    END IF;
+    IF invitee = inviter THEN
+        RETURN jsonb_build_object('error', 'self_invite');
+    END IF;
+
+    IF NOT are_friends(inviter, invitee) THEN
+        RETURN jsonb_build_object('error', 'not_friends');
+    END IF;
+
+    IF is_server_member(sid, invitee) THEN
+        RETURN jsonb_build_object('error', 'already_member');
+    END IF;
+
+    -- One row per (server, invitee): a rejected or stale invite is reopened,
+    -- a pending one is left alone (no row returned)
+    INSERT INTO server_invites (server_id, inviter_id, invitee_id, status)
+    VALUES (sid, inviter, invitee, 'pending')
+    ON CONFLICT (server_id, invitee_id) DO UPDATE
+        SET status = 'pending', inviter_id = EXCLUDED.inviter_id, updated_at = NOW()
+        WHERE server_invites.status <> 'pending'
+    RETURNING id INTO new_invite_id;
+
+    IF new_invite_id IS NULL THEN
+        RETURN jsonb_build_object('error', 'invite_exists');
+    END IF;
+
+    RETURN jsonb_build_object('invite_id', new_invite_id);
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============================================
+-- 2. FRIEND REQUESTS
+-- ============================================
+-- Returns {"request_id": ...} on success or {"error": code} where code is one of
+-- user_not_found, self_request, already_friends, request_exists
+CREATE OR REPLACE FUNCTION create_friend_request(sender UUID, receiver_tag TEXT)
+RETURNS JSONB AS $$
+DECLARE
+    receiver UUID;
+    new_request_id UUID;
+BEGIN
+    SELECT id INTO receiver FROM users WHERE user_tag = receiver_tag;
+    IF receiver IS NULL THEN
+        RETURN jsonb_build_object('error', 'user_not_found');
+    END IF;
+    IF receiver = sender THEN
+        RETURN jsonb_build_object('error', 'self_request');
+    END IF;
+
+    IF are_friends(sender, receiver) THEN
+        RETURN jsonb_build_object('error', 'already_friends');
+    END IF;
+
+    -- Serialize requests between the same pair, in either direction
+    PERFORM pg_advisory_xact_lock(hashtext(LEAST(sender, receiver)::TEXT || GREATEST(sender, receiver)::TEXT));
+
+    IF EXISTS (
+        SELECT 1 FROM friend_requests
+        WHERE (sender_id = sender AND receiver_id = receiver)
+           OR (sender_id = receiver AND receiver_id = sender)
+    ) THEN
+        RETURN jsonb_build_object('error', 'request_exists');
+    END IF;
+
+    INSERT INTO friend_requests (sender_id, receiver_id, status)
+    VALUES (sender, receiver, 'pending')
+    RETURNING id INTO new_request_id;
+
+    RETURN jsonb_build_object('request_id', new_request_id);
+END;
+$$ LANGUAGE plpgsql;
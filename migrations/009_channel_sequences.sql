@@ -0,0 +1,115 @@
+-- Migration 009: Per-channel message sequence numbers
+-- Every message gets a gapless, strictly increasing number within its
+-- conversation (DM pair) or server, assigned on insert. Clients use it to
+-- order messages, spot missed events and fetch exactly the missing range.
+-- Run this in Supabase SQL Editor after 008_invite_and_request_rpcs.sql
+
+-- ============================================
+-- 1. COUNTERS AND COLUMNS
+-- ============================================
+-- One row per channel: ('server', server id) or ('dm', 'smaller_id:larger_id')
+CREATE TABLE IF NOT EXISTS channel_sequences (
+    channel_type TEXT NOT NULL CHECK (channel_type IN ('dm', 'server')),
+    channel_key TEXT NOT NULL,
+    last_seq BIGINT NOT NULL,
+    PRIMARY KEY (channel_type, channel_key)
+);
+
+ALTER TABLE server_messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+ALTER TABLE direct_messages ADD COLUMN IF NOT EXISTS seq BIGINT;
+
+-- ============================================
+-- 2. ASSIGN ON INSERT
+-- ============================================
+-- BEFORE INSERT, so the row returned by the insert already carries its seq.
+-- The counter row lock serializes inserts within one channel only.
+CREATE OR REPLACE FUNCTION assign_message_seq()
+RETURNS TRIGGER AS $$
+DECLARE
+    ctype TEXT;
+    ckey TEXT;
+BEGIN
+    IF TG_TABLE_NAME = 'server_messages' THEN
+        ctype := 'server';
+        ckey := NEW.server_id::TEXT;
+    ELSE
+        ctype := 'dm';
+        ckey := LEAST(NEW.sender_id, NEW.receiver_id)::TEXT || ':' || GREATEST(NEW.sender_id, NEW.receiver_id)::TEXT;
+    END IF;
+
+    INSERT INTO channel_sequences (channel_type, channel_key, last_seq)
+    VALUES (ctype, ckey, 1)
+    ON CONFLICT (channel_type, channel_key) DO UPDATE
+        SET last_seq = channel_sequences.last_seq + 1
+    RETURNING last_seq INTO NEW.seq;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_server_messages_seq ON server_messages;
+CREATE TRIGGER trigger_server_messages_seq
+BEFORE INSERT ON server_messages
+FOR EACH ROW
+EXECUTE FUNCTION assign_message_seq();
+
+DROP TRIGGER IF EXISTS trigger_direct_messages_seq ON direct_messages;
+CREATE TRIGGER trigger_direct_messages_seq
+BEFORE INSERT ON direct_messages
+FOR EACH ROW
+EXECUTE FUNCTION assign_message_seq();
+
+-- ============================================
+-- 3. BACKFILL EXISTING MESSAGES
+-- ============================================
+-- Number existing history in created_at order, then start each counter after it
+UPDATE server_messages m
+SET seq = numbered.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (PARTITION BY server_id ORDER BY created_at, id) AS seq
+    FROM server_messages
+) numbered
+WHERE numbered.id = m.id AND m.seq IS NULL;
+
+UPDATE direct_messages m
+SET seq = numbered.seq
+FROM (
+    SELECT id, ROW_NUMBER() OVER (
+        PARTITION BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id)
+        ORDER BY created_at, id
+    ) AS seq
+    FROM direct_messages
+) numbered
+WHERE numbered.id = m.id AND m.seq IS NULL;
+
+INSERT INTO channel_sequences (channel_type, channel_key, last_seq)
+SELECT 'server', server_id::TEXT, MAX(seq) FROM server_messages GROUP BY server_id
+ON CONFLICT (channel_type, channel_key) DO UPDATE SET last_seq = GREATEST(channel_sequences.last_seq, EXCLUDED.last_seq);
+
+INSERT INTO channel_sequences (channel_type, channel_key, last_seq)
+SELECT 'dm', LEAST(sender_id, receiver_id)::TEXT || ':' || GREATEST(sender_id, receiver_id)::TEXT, MAX(seq)
+FROM direct_messages
+GROUP BY LEAST(sender_id, receiver_id), GREATEST(sender_id, receiver_id)
+ON CONFLICT (channel_type, channel_key) DO UPDATE SET last_seq = GREATEST(channel_sequences.last_seq, EXCLUDED.last_seq);
+
+ALTER TABLE server_messages ALTER COLUMN seq SET NOT NULL;
+ALTER TABLE direct_messages ALTER COLUMN seq SET NOT NULL;
+
+-- ============================================
+-- 4. INDEXES
+-- ============================================
+-- Ranged sync (seq > since_seq) and newest-page reads, per channel
+CREATE UNIQUE INDEX IF NOT EXISTS idx_server_messages_server_seq
+ON server_messages(server_id, seq);
+
+-- Per direction, matching how the app reads a conversation (one query each way)
+CREATE INDEX IF NOT EXISTS idx_direct_messages_sender_receiver_seq
+ON direct_messages(sender_id, receiver_id, seq);
+
+-- ============================================
+-- 5. ROW LEVEL SECURITY
+-- ============================================
+ALTER TABLE channel_sequences ENABLE ROW LEVEL SECURITY;
+
+DROP POLICY IF EXISTS "Allow service role all" ON channel_sequences;
+CREATE POLICY "Allow service role all" ON channel_sequences FOR ALL USING (true);
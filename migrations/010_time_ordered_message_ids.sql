@@ -0,0 +1,33 @@
+-- Migration 010: Time-ordered message ids
+-- The app now assigns message ids itself (UUIDv7, see message_ids.py) so a
+-- message can be referenced before it is stored and a retried send can't be
+-- inserted twice. This makes the database default match, so rows written by
+-- anything else are time-ordered too, and new ids always land at the right
+-- edge of the primary key index instead of at random pages.
+-- Run this in Supabase SQL Editor after 009_channel_sequences.sql
+
+-- ============================================
+-- 1. UUIDv7 GENERATOR
+-- ============================================
+-- 48-bit Unix millisecond timestamp over a random v4 UUID, then flip the
+-- version nibble from 4 (0100) to 7 (0111); the variant bits are already set
+CREATE OR REPLACE FUNCTION uuid_generate_v7()
+RETURNS UUID AS $$
+BEGIN
+    RETURN encode(
+        set_bit(
+            set_bit(
+                overlay(uuid_send(gen_random_uuid())
+                        PLACING substring(int8send(FLOOR(EXTRACT(EPOCH FROM clock_timestamp()) * 1000)::BIGINT) FROM 3)
+                        FROM 1 FOR 6),
+                52, 1),
+            53, 1),
+        'hex')::UUID;
+END;
+$$ LANGUAGE plpgsql VOLATILE;
+
+-- ============================================
+-- 2. MESSAGE ID DEFAULTS
+-- ============================================
+ALTER TABLE direct_messages ALTER COLUMN id SET DEFAULT uuid_generate_v7();
+ALTER TABLE server_messages ALTER COLUMN id SET DEFAULT uuid_generate_v7();
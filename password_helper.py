@@ -0,0 +1,83 @@
+"""
+Password Helper Module
+Password hashing and verification on a small bounded pool of OS threads, so
+CPU-heavy hashes never run on (and stall) the worker serving sockets and
+requests. hashlib's scrypt and pbkdf2 release the GIL while they run.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import Config
+
+_pool = None
+_pool_lock = threading.Lock()
+_async_mode = 'threading'
+
+# The configured method as werkzeug writes it into hashes: it fills in default
+# parameters ('scrypt' -> 'scrypt:32768:8:1', 'pbkdf2:sha256' -> 'pbkdf2:sha256:600000'),
+# so comparing stored hashes with the raw setting would rehash on every login
+_HASH_PREFIX = generate_password_hash('', Config.PASSWORD_HASH_METHOD).split('$', 1)[0]
+
+
+def init_app(socketio):
+    """
+    Pick the pool flavour matching the server's async mode.
+
+    Under gevent the request greenlet waits on gevent's native thread pool, so
+    other greenlets keep running while a hash is computed.
+
+    Args:
+        socketio: SocketIO instance
+    """
+    global _async_mode
+    _async_mode = socketio.async_mode
+
+
+def _run(fn, *args):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            if _async_mode == 'gevent':
+                from gevent.threadpool import ThreadPool
+                _pool = ThreadPool(Config.PASSWORD_HASH_WORKERS)
+            else:
+                _pool = ThreadPoolExecutor(max_workers=Config.PASSWORD_HASH_WORKERS,
+                                           thread_name_prefix='password-hash')
+    if _async_mode == 'gevent':
+        return _pool.apply(fn, args)
+    return _pool.submit(fn, *args).result()
+
+
+def hash_password(password):
+    """
+    Hash a password with the configured method (PASSWORD_HASH_METHOD).
+
+    Args:
+        password: Plain-text password
+
+    Returns:
+        Werkzeug password hash string
+    """
+    return _run(generate_password_hash, password, Config.PASSWORD_HASH_METHOD)
+
+
+def needs_rehash(password_hash):
+    """True if a stored hash was made with different parameters than configured"""
+    return password_hash.split('$', 1)[0] != _HASH_PREFIX
+
+
+def verify_password(password_hash, password):
+    """
+    Check a password against a stored hash.
+
+    Args:
+        password_hash: Stored werkzeug hash
+        password: Plain-text password to check
+
+    Returns:
+        True if the password matches
+    """
+    return _run(check_password_hash, password_hash, password)
@@ -0,0 +1,229 @@
+"""
+Presence Module
+Tracks which users are online (counting connections across tabs) and who is
+typing where, and fans both out in aggregated, debounced batches: at most one
+presence_update and one typing event per room per flush interval
+"""
+
+import logging
+import threading
+import time
+
+from config import Config
+from message_helper import compact_room, emit_to_room
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """In-process presence and typing state with a periodic flush"""
+
+    def __init__(self, flush_interval=0.5, offline_grace=5.0, typing_throttle=2.0, typing_ttl=6.0):
+        self.flush_interval = flush_interval
+        self.offline_grace = offline_grace
+        self.typing_throttle = typing_throttle
+        self.typing_ttl = typing_ttl
+        self.socketio = None
+        self._connections = {}   # user_id -> set of sids
+        self._audience = {}      # user_id -> rooms that see this user's presence
+        self._announced = set()  # users whose 'online' has been broadcast
+        self._pending = {}       # user_id -> ('online' | 'offline', due time)
+        self._typing = {}        # room -> {'server_id': ..., 'users': {user_id: expires}}
+        self._typing_sent = {}   # (user_id, room) -> last accepted typing time
+        self._dirty_rooms = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def init_app(self, socketio):
+        self.socketio = socketio
+
+    def _ensure_started(self):
+        # Started lazily so forked workers each get their own flush task
+        if not self._started and self.socketio is not None:
+            self._started = True
+            self.socketio.start_background_task(self._run)
+
+    # ---------- connections ----------
+
+    def needs_audience(self, user_id):
+        """True if the caller should look up friends/servers before connect()"""
+        with self._lock:
+            return user_id not in self._audience
+
+    def connect(self, user_id, sid, friend_ids=None, server_ids=None):
+        """
+        Register a connection.
+
+        Args:
+            user_id: Connecting user
+            sid: Socket id of the connection
+            friend_ids: The user's friends (only needed on first connection)
+            server_ids: Servers the user belongs to (only needed on first connection)
+        """
+        with self._lock:
+            if friend_ids is not None or server_ids is not None:
+                self._audience[user_id] = set(friend_ids or ()) | {f"server_{s}" for s in server_ids or ()}
+            sids = self._connections.setdefault(user_id, set())
+            first = not sids
+            sids.add(sid)
+            if first:
+                if user_id in self._announced:
+                    # Reconnected within the grace period; nobody saw them leave
+                    self._pending.pop(user_id, None)
+                else:
+                    self._pending[user_id] = ('online', 0)
+        self._ensure_started()
+
+    def disconnect(self, user_id, sid):
+        """Drop a connection; the user goes offline after the grace period if it was their last"""
+        with self._lock:
+            sids = self._connections.get(user_id)
+            if not sids:
+                return
+            sids.discard(sid)
+            if not sids:
+                del self._connections[user_id]
+                if user_id in self._announced:
+                    self._pending[user_id] = ('offline', time.monotonic() + self.offline_grace)
+                else:
+                    self._pending.pop(user_id, None)
+                    self._audience.pop(user_id, None)
+                for room, state in self._typing.items():
+                    if state['users'].pop(user_id, None):
+                        self._dirty_rooms.add(room)
+
+    def add_friend(self, user_id, friend_id):
+        """Make two new friends part of each other's presence audience"""
+        with self._lock:
+            for a, b in ((user_id, friend_id), (friend_id, user_id)):
+                if a in self._audience:
+                    self._audience[a].add(b)
+
+    def remove_friend(self, user_id, friend_id):
+        """Stop sending presence between two users who are no longer friends"""
+        with self._lock:
+            for a, b in ((user_id, friend_id), (friend_id, user_id)):
+                self._audience.get(a, set()).discard(b)
+
+    def add_server(self, user_id, server_id):
+        """Include a newly joined server room in the user's presence audience"""
+        with self._lock:
+            if user_id in self._audience:
+                self._audience[user_id].add(f"server_{server_id}")
+
+    def remove_from_room(self, user_id, room):
+        """
+        Take all of a user's connections out of a room (e.g. after leaving a server).
+
+        Args:
+            user_id: User to remove
+            room: Base room name; its compact variant is left too
+        """
+        with self._lock:
+            sids = list(self._connections.get(user_id, ()))
+            self._audience.get(user_id, set()).discard(room)
+        if self.socketio is None:
+            return
+        for sid in sids:
+            for name in (room, compact_room(room)):
+                self.socketio.server.leave_room(sid, name, namespace='/')
+
+    def is_online(self, user_id):
+        with self._lock:
+            return user_id in self._connections
+
+    def online_among(self, user_ids):
+        """Subset of user_ids that currently have at least one connection"""
+        with self._lock:
+            return [uid for uid in user_ids if uid in self._connections]
+
+    # ---------- typing ----------
+
+    def typing(self, user_id, room, server_id=None, active=True):
+        """
+        Record a typing signal for a room.
+
+        Repeated 'still typing' signals inside the throttle window are dropped,
+        so a keystroke stream costs at most one state change per window.
+
+        Args:
+            user_id: Typing user
+            room: Room that should see the indicator (server room or recipient's user room)
+            server_id: Server id for server rooms, None for direct messages
+            active: False when the user stopped typing or sent the message
+        """
+        now = time.monotonic()
+        key = (user_id, room)
+        with self._lock:
+            state = self._typing.setdefault(room, {'server_id': server_id, 'users': {}})
+            if not active:
+                self._typing_sent.pop(key, None)
+                if state['users'].pop(user_id, None):
+                    self._dirty_rooms.add(room)
+                return
+            if now - self._typing_sent.get(key, 0) < self.typing_throttle:
+                return
+            self._typing_sent[key] = now
+            if user_id not in state['users']:
+                self._dirty_rooms.add(room)
+            state['users'][user_id] = now + self.typing_ttl
+        self._ensure_started()
+
+    # ---------- flushing ----------
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Presence flush failed")
+
+    def flush(self):
+        """Emit one aggregated presence_update and typing event per affected room"""
+        now = time.monotonic()
+        presence_batches = {}
+        typing_batches = []
+        with self._lock:
+            for user_id, (status, due) in list(self._pending.items()):
+                if due > now:
+                    continue
+                del self._pending[user_id]
+                if status == 'online':
+                    self._announced.add(user_id)
+                else:
+                    self._announced.discard(user_id)
+                for room in self._audience.get(user_id, ()):
+                    presence_batches.setdefault(room, {'online': [], 'offline': []})[status].append(user_id)
+                if status == 'offline':
+                    self._audience.pop(user_id, None)
+
+            for room, state in list(self._typing.items()):
+                expired = [uid for uid, expires in state['users'].items() if expires <= now]
+                for uid in expired:
+                    del state['users'][uid]
+                if expired:
+                    self._dirty_rooms.add(room)
+                if room in self._dirty_rooms:
+                    typing_batches.append((room, {'server_id': state['server_id'], 'users': list(state['users'])}))
+                if not state['users']:
+                    del self._typing[room]
+            self._dirty_rooms.clear()
+
+            for key in [k for k, sent in self._typing_sent.items() if now - sent > self.typing_ttl]:
+                del self._typing_sent[key]
+
+        if self.socketio is None:
+            return
+        for room, payload in presence_batches.items():
+            emit_to_room(self.socketio, 'presence_update', payload, room)
+        for room, payload in typing_batches:
+            emit_to_room(self.socketio, 'typing', payload, room)
+
+
+tracker = PresenceTracker(
+    flush_interval=Config.PRESENCE_FLUSH_SECONDS,
+    offline_grace=Config.PRESENCE_OFFLINE_GRACE_SECONDS,
+    typing_throttle=Config.TYPING_THROTTLE_SECONDS,
+    typing_ttl=Config.TYPING_TTL_SECONDS
+)
@@ -0,0 +1,227 @@
+"""
+Rate Limiting Module
+Per-user token buckets for message and search endpoints, with an in-process
+backend and an optional shared (Redis) backend, plus short-lived coalescing
+of identical searches
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+
+from flask import jsonify, request, session
+from flask_socketio import emit
+
+from config import Config
+
+try:
+    import redis
+except ImportError:  # redis is optional; only needed for a shared backend
+    redis = None
+
+
+def parse_limit(spec):
+    """
+    Parse a 'count/seconds' limit, e.g. '20/10' = 20 requests per 10 seconds.
+
+    Args:
+        spec: Limit string
+
+    Returns:
+        (capacity, refill rate in tokens per second)
+    """
+    count, _, seconds = spec.partition('/')
+    capacity = float(count)
+    return capacity, capacity / float(seconds or 1)
+
+
+class MemoryBackend:
+    """Token buckets held in this process"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, rate, cost=1):
+        """
+        Try to take `cost` tokens from a bucket.
+
+        Returns:
+            (allowed, seconds until enough tokens are available)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+        return allowed, 0.0 if allowed else (cost - tokens) / rate
+
+    def _prune(self, now):
+        # Drop buckets that have been idle long enough to be full again
+        for key in [k for k, (_, updated) in self._buckets.items() if now - updated > 300]:
+            del self._buckets[key]
+
+
+class RedisBackend:
+    """Token buckets shared by all workers through Redis"""
+
+    SCRIPT = """
+    local capacity = tonumber(ARGV[1])
+    local rate = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local cost = tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + (now - updated) * rate)
+    local allowed = 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return {allowed, tostring(tokens)}
+    """
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    def take(self, key, capacity, rate, cost=1):
+        allowed, tokens = self.script(keys=[f'ratelimit:{key}'], args=[capacity, rate, time.time(), cost])
+        tokens = float(tokens)
+        return bool(allowed), 0.0 if allowed else (cost - tokens) / rate
+
+
+def create_backend():
+    if Config.RATE_LIMIT_REDIS_URL and redis:
+        return RedisBackend(Config.RATE_LIMIT_REDIS_URL)
+    return MemoryBackend()
+
+
+backend = create_backend()
+
+
+def check_limit(name):
+    """
+    Take one token for the current user (or client address) under a named limit.
+
+    Args:
+        name: Key in Config.RATE_LIMITS
+
+    Returns:
+        (allowed, retry_after_seconds); always allowed if the limit is not configured
+    """
+    spec = Config.RATE_LIMITS.get(name)
+    if not Config.RATE_LIMIT_ENABLED or not spec:
+        return True, 0.0
+    capacity, rate = parse_limit(spec)
+    identity = session.get('user_id') or request.remote_addr
+    return backend.take(f'{name}:{identity}', capacity, rate)
+
+
+def rate_limited(name):
+    """Decorator for HTTP routes: respond 429 with Retry-After when over the limit"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            allowed, retry_after = check_limit(name)
+            if not allowed:
+                response = jsonify({
+                    'success': False,
+                    'error': 'Too many requests, slow down',
+                    'retry_after': round(retry_after, 2)
+                })
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response, 429
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def rate_limited_event(name):
+    """Decorator for socket handlers: emit an 'error' event and drop the event when over the limit"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            allowed, retry_after = check_limit(name)
+            if not allowed:
+                emit('error', {
+                    'message': 'Rate limit exceeded',
+                    'event': name,
+                    'retry_after': round(retry_after, 2)
+                })
+                return None
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+class CoalescedResults:
+    """
+    Share results of identical lookups made within a short window.
+
+    Concurrent callers for the same key wait for the first one's result
+    instead of issuing their own query; the result is then reused for
+    `ttl` seconds. With ttl=0 only in-flight lookups are shared
+    (single-flight) and nothing is kept afterwards.
+    """
+
+    def __init__(self, ttl, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._results = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """
+        Return the cached or in-flight result for key, or run loader() once.
+
+        Args:
+            key: Hashable lookup key
+            loader: Zero-argument function producing the result
+
+        Returns:
+            The loader's result
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+            waiter = self._inflight.get(key)
+            leader = waiter is None
+            if leader:
+                waiter = self._inflight[key] = {'done': threading.Event(), 'result': None, 'error': None}
+
+        if not leader:
+            waiter['done'].wait()
+            if waiter['error']:
+                raise waiter['error']
+            return waiter['result']
+
+        try:
+            waiter['result'] = loader()
+            if self.ttl <= 0:
+                return waiter['result']
+            with self._lock:
+                if len(self._results) >= self.max_entries:
+                    self._results.clear()
+                self._results[key] = (time.monotonic(), waiter['result'])
+            return waiter['result']
+        except Exception as e:
+            waiter['error'] = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            waiter['done'].set()
@@ -0,0 +1,214 @@
+"""
+Resilience Module
+Deadlines, retries, hedging and a circuit breaker for Supabase (PostgREST)
+calls, installed as an httpx transport so every .execute() gets them.
+
+- Every attempt has a timeout (SUPABASE_TIMEOUT_SECONDS) instead of httpx's
+  two-minute default.
+- Idempotent reads (GET/HEAD and read-only RPCs) are retried on connection
+  errors, timeouts and 502/503/504, with exponential backoff and full jitter.
+- Optionally, a read that hasn't answered after SUPABASE_HEDGE_AFTER_SECONDS
+  is sent a second time and whichever response arrives first is used.
+- After SUPABASE_BREAKER_THRESHOLD consecutive failures the breaker opens and
+  calls fail immediately with BackendUnavailable, so a brownout doesn't tie up
+  every worker; after SUPABASE_BREAKER_RESET_SECONDS one probe is let through.
+"""
+
+import logging
+import queue
+import random
+import threading
+import time
+
+import httpx
+
+from config import Config
+from metrics import (supabase_breaker_state, supabase_breaker_rejections_total, supabase_hedges_total,
+                     supabase_retries_total)
+
+logger = logging.getLogger(__name__)
+
+# RPCs that only read, and so are safe to retry or hedge
+IDEMPOTENT_RPCS = {'are_friends', 'is_server_member', 'get_user_server_role',
+                   'get_unread_counts', 'get_server_member_counts'}
+
+RETRY_STATUSES = {502, 503, 504}
+
+BREAKER_STATES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+
+class BackendUnavailable(httpx.TransportError):
+    """Raised without contacting Supabase while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        supabase_breaker_state.set(0)
+
+    def _transition(self, state):
+        # Caller holds the lock
+        if state != self.state:
+            logger.warning("Supabase circuit breaker %s -> %s", self.state, state)
+            self.state = state
+            supabase_breaker_state.set(BREAKER_STATES[state])
+
+    def allow(self):
+        """True if a call may go out now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._transition('half_open')
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def healthy(self):
+        """True if the breaker is closed and the last call didn't fail"""
+        with self._lock:
+            return self.state == 'closed' and self._failures == 0
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._probing = False
+            self._transition('closed')
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition('open')
+
+
+def is_idempotent(request):
+    """True for requests that can be sent more than once without side effects"""
+    if request.method in ('GET', 'HEAD'):
+        return True
+    path = request.url.path
+    return request.method == 'POST' and '/rpc/' in path and path.rsplit('/', 1)[-1] in IDEMPOTENT_RPCS
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """httpx transport wrapper adding deadlines, retries, hedging and the breaker"""
+
+    def __init__(self, transport, breaker, timeout=5.0, retries=2, backoff=0.1, hedge_after=0.0):
+        self.transport = transport
+        self.breaker = breaker
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+
+    def handle_request(self, request):
+        request.extensions['timeout'] = httpx.Timeout(self.timeout).as_dict()
+        idempotent = is_idempotent(request)
+        attempts = 1 + (self.retries if idempotent else 0)
+
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                supabase_breaker_rejections_total.inc()
+                raise BackendUnavailable('Supabase circuit breaker is open', request=request)
+            try:
+                if idempotent and self.hedge_after > 0:
+                    response = self._send_hedged(request)
+                else:
+                    response = self.transport.handle_request(request)
+            except httpx.TransportError:
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts:
+                    raise
+            else:
+                if response.status_code < 500:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if attempt + 1 >= attempts or response.status_code not in RETRY_STATUSES:
+                    return response
+                response.close()
+
+            supabase_retries_total.inc((('method', request.method),))
+            # Full jitter: anywhere up to the doubled backoff, so retries don't arrive in waves
+            time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    def _send_hedged(self, request):
+        """Send the request, and again if it's slow; return the first response"""
+        results = queue.Queue()
+
+        def send():
+            try:
+                results.put((self.transport.handle_request(request), None))
+            except Exception as e:
+                results.put((None, e))
+
+        threading.Thread(target=send, daemon=True).start()
+        try:
+            response, error = results.get(timeout=self.hedge_after)
+            outstanding = 0
+        except queue.Empty:
+            supabase_hedges_total.inc()
+            threading.Thread(target=send, daemon=True).start()
+            response, error = results.get()
+            outstanding = 1
+
+        if error is not None and outstanding:
+            # The first attempt failed; the hedge may still succeed
+            response, error = results.get()
+            outstanding = 0
+        if outstanding:
+            threading.Thread(target=self._discard, args=(results,), daemon=True).start()
+        if error is not None:
+            raise error
+        return response
+
+    @staticmethod
+    def _discard(results):
+        response, _ = results.get()
+        if response is not None:
+            response.close()
+
+    def close(self):
+        self.transport.close()
+
+
+breaker = CircuitBreaker(
+    failure_threshold=Config.SUPABASE_BREAKER_THRESHOLD,
+    reset_timeout=Config.SUPABASE_BREAKER_RESET_SECONDS
+)
+
+
+def protect_client(client):
+    """
+    Route a Supabase client's PostgREST calls through the resilient transport.
+
+    Storage keeps its own session (uploads need longer than a query deadline).
+
+    Args:
+        client: Supabase client
+
+    Returns:
+        The same client
+    """
+    session = getattr(getattr(client, 'postgrest', None), 'session', None)
+    if session is not None:
+        session._transport = ResilientTransport(
+            session._transport,
+            breaker,
+            timeout=Config.SUPABASE_TIMEOUT_SECONDS,
+            retries=Config.SUPABASE_RETRIES,
+            backoff=Config.SUPABASE_RETRY_BACKOFF_SECONDS,
+            hedge_after=Config.SUPABASE_HEDGE_AFTER_SECONDS
+        )
+    return client
@@ -0,0 +1,195 @@
+"""
+Response Helper Module
+Compression and HTTP caching for JSON API responses and static assets
+"""
+
+import gzip
+import hashlib
+import os
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Static file types worth precompressing
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.html', '.svg', '.json', '.txt')
+
+# Response mimetypes compressed on the fly
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/plain')
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an Accept-Encoding header.
+
+    Args:
+        header: Header value, e.g. 'br;q=0, gzip;q=0.8, *'
+
+    Returns:
+        Dict of lowercased coding (or '*') -> q-value
+    """
+    qualities = {}
+    for item in header.lower().split(','):
+        coding, _, params = item.partition(';')
+        coding = coding.strip()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding] = q
+    return qualities
+
+
+def accepted_encoding(available):
+    """
+    Pick the best content encoding the client accepts.
+
+    Args:
+        available: Encodings we can serve, in preference order
+
+    Returns:
+        'br', 'gzip' or None. Highest q-value wins, ties go to our
+        preference order, and anything with q=0 is never picked.
+    """
+    qualities = parse_accept_encoding(request.headers.get('Accept-Encoding', ''))
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = qualities.get(encoding, qualities.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, level):
+    """
+    Compress bytes with the given encoding.
+
+    Args:
+        data: Raw bytes
+        encoding: 'br' or 'gzip'
+        level: gzip compression level (brotli uses its own quality scale)
+
+    Returns:
+        Compressed bytes
+    """
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=level)
+
+
+def build_asset_manifest(static_folder, level):
+    """
+    Hash and precompress every compressible static asset.
+
+    Args:
+        static_folder: Absolute path of the app's static folder
+        level: gzip compression level
+
+    Returns:
+        Dict mapping filename (relative, '/'-separated) to
+        {'hash': str, 'encoded': {encoding: bytes}}
+    """
+    manifest = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as f:
+                data = f.read()
+
+            entry = {'hash': hashlib.md5(data).hexdigest()[:12], 'encoded': {}}
+            if name.endswith(COMPRESSIBLE_EXTENSIONS):
+                entry['encoded']['gzip'] = gzip.compress(data, compresslevel=9)
+                if brotli:
+                    entry['encoded']['br'] = brotli.compress(data, quality=11)
+            manifest[filename] = entry
+    return manifest
+
+
+def init_app(app):
+    """
+    Install content-hashed static URLs, precompressed static serving and
+    compression/conditional caching of JSON responses.
+
+    Args:
+        app: Flask application
+    """
+    min_size = app.config['COMPRESS_MIN_SIZE']
+    level = app.config['COMPRESS_LEVEL']
+    static_max_age = app.config['STATIC_ASSET_MAX_AGE']
+    encodings = ('br', 'gzip') if brotli else ('gzip',)
+
+    # Precompress once at startup rather than per request
+    manifest = build_asset_manifest(app.static_folder, level)
+
+    @app.url_defaults
+    def add_asset_version(endpoint, values):
+        # url_for('static', filename=...) gets ?v=<content hash>
+        if endpoint == 'static' and 'v' not in values:
+            entry = manifest.get(values.get('filename'))
+            if entry:
+                values['v'] = entry['hash']
+
+    def serve_static(filename):
+        entry = manifest.get(filename)
+        versioned = entry is not None and request.args.get('v') == entry['hash']
+        encoding = accepted_encoding([e for e in encodings if entry and e in entry['encoded']])
+
+        response = send_from_directory(app.static_folder, filename, max_age=static_max_age if versioned else 0)
+        if encoding and response.status_code == 200:
+            response.direct_passthrough = False
+            response.set_data(entry['encoded'][encoding])
+            response.headers['Content-Encoding'] = encoding
+            response.vary.add('Accept-Encoding')
+            if response.headers.get('ETag'):
+                # Weak tag: same file, different encoding
+                response.set_etag(response.get_etag()[0], weak=True)
+        if versioned:
+            # The URL changes whenever the content does
+            response.cache_control.public = True
+            response.cache_control.max_age = static_max_age
+            response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = serve_static
+
+    @app.after_request
+    def compress_response(response):
+        if request.endpoint == 'static':
+            return response
+
+        if response.mimetype == 'application/json' and request.method == 'GET' and response.status_code == 200:
+            # Per-user data: always revalidate, but let unchanged payloads return 304
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.add_etag()
+            response.make_conditional(request)
+
+        if (response.direct_passthrough
+                or response.status_code < 200 or response.status_code >= 300
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = accepted_encoding(encodings)
+        if encoding:
+            response.set_data(compress(data, encoding, level))
+            response.headers['Content-Encoding'] = encoding
+            if response.headers.get('ETag'):
+                # Weak tag: same representation, different encoding
+                response.set_etag(response.get_etag()[0], weak=True)
+        return response
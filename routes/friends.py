@@ -5,6 +5,7 @@ Handles friend requests, accepting/rejecting, and managing friendships
 
 from flask import Blueprint, request, jsonify, session
 from functools import wraps
+import logging
 import os
 import sys
 
@@ -12,10 +13,28 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
 from supabase import create_client, Client
-from supabase_helper import get_data
+from metrics import instrument_client
+from resilience import protect_client
+from supabase_helper import get_data, get_users_by_ids
+from user_cache import known_users
+from friend_graph import friend_graph
+from presence import tracker as presence
+
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
-supabase: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+supabase: Client = protect_client(instrument_client(create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)))
+
+# create_friend_request error codes -> (message, HTTP status)
+FRIEND_REQUEST_ERRORS = {
+    'user_not_found': ('User not found', 404),
+    'self_request': ('Cannot send friend request to yourself', 400),
+    'already_friends': ('Already friends', 400),
+    'request_exists': ('Friend request already exists', 400),
+}
+
+# Most friend suggestions returned per request
+SUGGESTIONS_MAX = 50
 
 # Create blueprint
 friends_bp = Blueprint('friends', __name__, url_prefix='/api/friends')
@@ -41,58 +60,24 @@ def send_friend_request():
         if not receiver_user_tag:
             return jsonify({'success': False, 'error': 'User tag is required'}), 400
         
-        sender_id = session['user_id']
-        
-        # Find receiver by user_tag
-        receiver_response = supabase.table('users').select('id').eq('user_tag', receiver_user_tag).execute()
-        receiver_data = get_data(receiver_response)
-        
-        if not receiver_data:
-            return jsonify({'success': False, 'error': 'User not found'}), 404
-        
-        receiver_id = receiver_data[0]['id']
-        
-        # Check if trying to send request to self
-        if sender_id == receiver_id:
-            return jsonify({'success': False, 'error': 'Cannot send friend request to yourself'}), 400
-        
-        # Check if already friends
-        friends_check = supabase.rpc('are_friends', {'uid1': sender_id, 'uid2': receiver_id}).execute()
-        if get_data(friends_check):
-            return jsonify({'success': False, 'error': 'Already friends'}), 400
-        
-        # Check if request already exists
-        # Check if an existing request in either direction without using .or_
-        req1 = supabase.table('friend_requests').select('*') \
-            .eq('sender_id', sender_id).eq('receiver_id', receiver_id).execute()
-        req2 = supabase.table('friend_requests').select('*') \
-            .eq('sender_id', receiver_id).eq('receiver_id', sender_id).execute()
-        existing_request = {'data': (get_data(req1) or []) + (get_data(req2) or [])}
-        
-        if existing_request['data']:
-            return jsonify({'success': False, 'error': 'Friend request already exists'}), 400
-        
-        # Create friend request
-        request_data = {
-            'sender_id': sender_id,
-            'receiver_id': receiver_id,
-            'status': 'pending'
-        }
-        
-        result = supabase.table('friend_requests').insert(request_data).execute()
-        result_data = get_data(result)
-        
-        if result_data:
-            return jsonify({
-                'success': True,
-                'request_id': result_data[0]['id'],
-                'message': 'Friend request sent successfully'
-            }), 200
-        else:
-            return jsonify({'success': False, 'error': 'Failed to send friend request'}), 500
+        # Lookup, duplicate checks and insert happen in one database call
+        result = get_data(supabase.rpc('create_friend_request', {
+            'sender': session['user_id'],
+            'receiver_tag': receiver_user_tag
+        }).execute()) or {}
+        
+        if result.get('error'):
+            message, status = FRIEND_REQUEST_ERRORS.get(result['error'], ('Failed to send friend request', 500))
+            return jsonify({'success': False, 'error': message, 'code': result['error']}), status
+        
+        return jsonify({
+            'success': True,
+            'request_id': result['request_id'],
+            'message': 'Friend request sent successfully'
+        }), 200
             
     except Exception as e:
-        print(f"Send friend request error: {e}")
+        logger.error("Send friend request error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -148,9 +133,7 @@ def get_pending_requests():
         }), 200
         
     except Exception as e:
-        print(f"Get pending requests error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get pending requests error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -181,6 +164,8 @@ def accept_friend_request(request_id):
         }).eq('id', request_id).execute()
         
         # Friendship is automatically created by trigger
+        friend_graph.invalidate(user_id, request_data['sender_id'])
+        presence.add_friend(user_id, request_data['sender_id'])
         
         return jsonify({
             'success': True,
@@ -188,7 +173,7 @@ def accept_friend_request(request_id):
         }), 200
         
     except Exception as e:
-        print(f"Accept friend request error: {e}")
+        logger.error("Accept friend request error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -224,7 +209,7 @@ def reject_friend_request(request_id):
         }), 200
         
     except Exception as e:
-        print(f"Reject friend request error: {e}")
+        logger.error("Reject friend request error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -235,41 +220,18 @@ def get_friends():
     try:
         user_id = session['user_id']
         
-        # DEBUG: Print session info
-        print("=" * 50)
-        print("GET_FRIENDS DEBUG")
-        print("Session:", dict(session))
-        print("User ID:", user_id)
-        print("=" * 50)
-        
-        # Query both directions (user as user1 or user2) and merge results
-        f1 = supabase.table('friendships').select('*').eq('user1_id', user_id).execute()
-        f2 = supabase.table('friendships').select('*').eq('user2_id', user_id).execute()
-        merged_friendships = (get_data(f1) or []) + (get_data(f2) or [])
-
-        print(f"Found {len(merged_friendships)} friendships")
-
-        friends_list = []
-        for friendship in merged_friendships:
-            # Determine which ID is the friend's ID
-            friend_id = friendship['user2_id'] if friendship['user1_id'] == user_id else friendship['user1_id']
+        # Friend ids come from the friendship graph, profiles from one batched query
+        friendships = friend_graph.friends(supabase, user_id)
+        users_by_id = get_users_by_ids(supabase, friendships)
+        friends_list = [{**users_by_id[friend_id], 'friendship_created_at': created_at}
+                        for friend_id, created_at in friendships.items() if friend_id in users_by_id]
 
-            # Get friend's details
-            friend_data = supabase.table('users').select('id, username, user_tag').eq('id', friend_id).execute()
-            friend_list = get_data(friend_data)
-            if friend_list:
-                friends_list.append({
-                    **friend_list[0],
-                    'friendship_created_at': friendship['created_at']
-                })
-
-        print(f"Returning {len(friends_list)} friends")
+        known_users.add(friend['id'] for friend in friends_list)
+        logger.debug("get_friends", extra={'fields': {'user_id': user_id, 'count': len(friends_list)}})
         return jsonify({'success': True, 'friends': friends_list}), 200
         
     except Exception as e:
-        print(f"Get friends error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get friends error")
         return jsonify({'success': False, 'error': str(e), 'friends': []}), 500
 
 
@@ -284,6 +246,8 @@ def remove_friend(user_id):
         # Delete friendship regardless of ordering by performing two deletes
         supabase.table('friendships').delete().eq('user1_id', current_user_id).eq('user2_id', user_id).execute()
         supabase.table('friendships').delete().eq('user1_id', user_id).eq('user2_id', current_user_id).execute()
+        friend_graph.invalidate(current_user_id, user_id)
+        presence.remove_friend(current_user_id, user_id)
         
         return jsonify({
             'success': True,
@@ -291,7 +255,7 @@ def remove_friend(user_id):
         }), 200
         
     except Exception as e:
-        print(f"Remove friend error: {e}")
+        logger.error("Remove friend error: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -302,44 +266,71 @@ def check_friendship(user_id):
     try:
         current_user_id = session['user_id']
         
-        # Check if they are friends using the are_friends RPC
-        result = supabase.rpc('are_friends', {
-            'uid1': current_user_id,
-            'uid2': user_id
-        }).execute()
-        
-        is_friend = get_data(result) if get_data(result) else False
+        # Loads both users' friend sets together (if not cached), then answers from memory
+        mutual_friends = friend_graph.mutual_count(supabase, current_user_id, user_id)
+        is_friend = friend_graph.are_friends(supabase, current_user_id, user_id)
         
-        # Check for pending friend requests
+        # Check for pending friend requests (friends have none between them)
         request_status = 'none'
         request_id = None
         
-        # Check if current user sent a request
-        sent_request = supabase.table('friend_requests').select('id').eq(
-            'sender_id', current_user_id
-        ).eq('receiver_id', user_id).eq('status', 'pending').execute()
-        
-        sent_data = get_data(sent_request)
-        if sent_data:
-            request_status = 'pending_sent'
-            request_id = sent_data[0]['id']
-        else:
-            # Check if current user received a request
-            received_request = supabase.table('friend_requests').select('id').eq(
-                'sender_id', user_id
-            ).eq('receiver_id', current_user_id).eq('status', 'pending').execute()
+        if not is_friend:
+            # Check if current user sent a request
+            sent_request = supabase.table('friend_requests').select('id').eq(
+                'sender_id', current_user_id
+            ).eq('receiver_id', user_id).eq('status', 'pending').execute()
             
-            received_data = get_data(received_request)
-            if received_data:
-                request_status = 'pending_received'
-                request_id = received_data[0]['id']
+            sent_data = get_data(sent_request)
+            if sent_data:
+                request_status = 'pending_sent'
+                request_id = sent_data[0]['id']
+            else:
+                # Check if current user received a request
+                received_request = supabase.table('friend_requests').select('id').eq(
+                    'sender_id', user_id
+                ).eq('receiver_id', current_user_id).eq('status', 'pending').execute()
+                
+                received_data = get_data(received_request)
+                if received_data:
+                    request_status = 'pending_received'
+                    request_id = received_data[0]['id']
         
         return jsonify({
             'success': True,
             'is_friend': is_friend,
             'request_status': request_status,
-            'request_id': request_id
+            'request_id': request_id,
+            'mutual_friends': mutual_friends
         }), 200
     except Exception as e:
-        print(f"Error checking friendship: {e}")
+        logger.error("Error checking friendship: %s", e)
         return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@friends_bp.route('/suggestions', methods=['GET'])
+@login_required
+def get_friend_suggestions():
+    """Suggest friends of friends, ranked by mutual friend count"""
+    try:
+        user_id = session['user_id']
+        limit = min(max(request.args.get('limit', 10, type=int), 1), SUGGESTIONS_MAX)
+        
+        # People with a pending request either way are already being handled
+        incoming = supabase.table('friend_requests').select('sender_id').eq(
+            'receiver_id', user_id).eq('status', 'pending').execute()
+        outgoing = supabase.table('friend_requests').select('receiver_id').eq(
+            'sender_id', user_id).eq('status', 'pending').execute()
+        pending = [r['sender_id'] for r in get_data(incoming) or []] + \
+            [r['receiver_id'] for r in get_data(outgoing) or []]
+        
+        ranked = friend_graph.suggestions(supabase, user_id, exclude=pending, limit=limit)
+        users_by_id = get_users_by_ids(supabase, [uid for uid, _ in ranked])
+        known_users.add(users_by_id)
+        
+        suggestions = [{**users_by_id[uid], 'mutual_friends': count}
+                       for uid, count in ranked if uid in users_by_id]
+        return jsonify({'success': True, 'suggestions': suggestions}), 200
+    
+    except Exception as e:
+        logger.exception("Get friend suggestions error")
+        return jsonify({'success': False, 'error': str(e), 'suggestions': []}), 500
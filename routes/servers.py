@@ -3,8 +3,9 @@ Server/Group System Routes
 Handles server creation, invites, and member management
 """
 
-from flask import Blueprint, request, jsonify, session
+from flask import Blueprint, request, jsonify, session, current_app
 from functools import wraps
+import logging
 import os
 import sys
 
@@ -12,14 +13,49 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from config import Config
 from supabase import create_client, Client
-from supabase_helper import get_data, get_count
+from metrics import instrument_client
+from resilience import protect_client
+from rate_limit import rate_limited, CoalescedResults
+from presence import tracker as presence
+from supabase_helper import get_data, get_count, get_users_by_ids
+from message_helper import attach_reply_preview, emit_to_room, parse_seq_range, REPLY_PREVIEW_COLUMNS
+from message_ids import new_message_id, parse_client_message_id
+from message_cache import server_message_buffer
+from degraded import QueueNotEmpty, write_queue
+
+logger = logging.getLogger(__name__)
 
 # Initialize Supabase client
-supabase: Client = create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)
+supabase: Client = protect_client(instrument_client(create_client(Config.SUPABASE_URL, Config.SUPABASE_KEY)))
 
 # Create blueprint
 servers_bp = Blueprint('servers', __name__, url_prefix='/api/servers')
 
+# Member list paging
+MEMBER_ROLES = ['owner', 'admin', 'member']
+MEMBERS_PAGE_SIZE = 50
+MEMBERS_PAGE_MAX = 100
+
+# Server message history page size
+MESSAGES_PAGE_SIZE = 100
+
+# create_server_invite error codes -> (message, HTTP status)
+INVITE_ERRORS = {
+    'not_member': ('You are not a member of this server', 403),
+    'user_not_found': ('User not found', 404),
+    'self_invite': ('You cannot invite yourself', 400),
+    'not_friends': ('You can only invite friends to servers', 403),
+    'already_member': ('User is already a member', 400),
+    'invite_exists': ('Invite already sent', 400),
+}
+
+# Columns returned for a server in lists
+SERVER_COLUMNS = 'id, name, description, icon_url, owner_id, created_at'
+
+# Identical reads already in flight (e.g. a whole server reloading after a
+# broadcast or a reconnect storm) share one set of Supabase queries
+shared_reads = CoalescedResults(ttl=0)
+
 # Login required decorator
 def login_required(f):
     @wraps(f)
@@ -30,6 +66,38 @@ def login_required(f):
     return decorated_function
 
 
+def emit_member_update(server_id, action, member):
+    """Push a member list delta ('join' or 'leave') to the server room"""
+    socketio = current_app.extensions.get('socketio')
+    if socketio:
+        emit_to_room(socketio, 'server_member_update', {
+            'server_id': server_id,
+            'action': action,
+            'member': member
+        }, f"server_{server_id}")
+    if action == 'leave':
+        # Former members stop receiving the room's broadcasts right away
+        presence.remove_from_room(member['id'], f"server_{server_id}")
+
+
+def build_server_message(msg, sender, server_id):
+    """Shape a server_messages row the way it is returned, cached and broadcast"""
+    attach_reply_preview(msg)
+    message_info = {
+        'id': msg['id'],
+        'seq': msg.get('seq'),
+        'content': msg['content'],
+        'file_url': msg.get('file_url'),
+        'file_type': msg.get('file_type'),
+        'created_at': msg['created_at'],
+        'sender': sender,
+        'server_id': server_id
+    }
+    if msg.get('replied_to'):
+        message_info['replied_to'] = msg['replied_to']
+    return message_info
+
+
 @servers_bp.route('/create', methods=['POST'])
 @login_required
 def create_server():
@@ -57,6 +125,8 @@ def create_server():
         result = supabase.table('servers').insert(server_data).execute()
         
         if result.data:
+            # Owner is added as a member by trigger
+            presence.add_server(owner_id, result.data[0]['id'])
             return jsonify({
                 'success': True,
                 'server': result.data[0],
@@ -66,12 +136,33 @@ def create_server():
             return jsonify({'success': False, 'error': 'Failed to create server'}), 500
             
     except Exception as e:
-        print(f"Create server error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Create server error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def get_member_counts(server_ids):
+    """Member count per server id, from one RPC call"""
+    if not server_ids:
+        return {}
+    rows = get_data(supabase.rpc('get_server_member_counts', {'sids': list(server_ids)}).execute()) or []
+    return {row['server_id']: row['member_count'] for row in rows}
+
+
+def build_server_list(memberships, servers_by_id, member_counts):
+    """Combine a user's memberships with server rows and member counts, in membership order"""
+    servers_list = []
+    for membership in memberships:
+        server_info = servers_by_id.get(membership['server_id'])
+        if server_info:
+            servers_list.append({
+                **server_info,
+                'user_role': membership['role'],
+                'joined_at': membership['joined_at'],
+                'member_count': member_counts.get(membership['server_id'], 0)
+            })
+    return servers_list
+
+
 @servers_bp.route('/', methods=['GET'])
 @login_required
 def get_user_servers():
@@ -80,178 +171,254 @@ def get_user_servers():
         user_id = session['user_id']
         
         # Get all server memberships
-        memberships = supabase.table('server_members').select(
+        memberships = get_data(supabase.table('server_members').select(
             'server_id, role, joined_at'
-        ).eq('user_id', user_id).execute()
+        ).eq('user_id', user_id).execute()) or []
         
-        servers_list = []
-        if memberships.data:
-            for membership in memberships.data:
-                # Get server details
-                server = supabase.table('servers').select(
-                    'id, name, description, icon_url, owner_id, created_at'
-                ).eq('id', membership['server_id']).execute()
-                
-                if server.data:
-                    server_info = server.data[0]
-                    server_info['user_role'] = membership['role']
-                    server_info['joined_at'] = membership['joined_at']
-                    
-                    # Get member count
-                    member_count = supabase.table('server_members').select(
-                        'id', count='exact'
-                    ).eq('server_id', membership['server_id']).execute()
-                    
-                    server_info['member_count'] = member_count.count if member_count.count else 0
-                    servers_list.append(server_info)
+        server_ids = [m['server_id'] for m in memberships]
+        servers_by_id = {}
+        if server_ids:
+            servers = supabase.table('servers').select(SERVER_COLUMNS).in_('id', server_ids).execute()
+            servers_by_id = {server['id']: server for server in (get_data(servers) or [])}
         
         return jsonify({
             'success': True,
-            'servers': servers_list
+            'servers': build_server_list(memberships, servers_by_id, get_member_counts(server_ids))
         }), 200
         
     except Exception as e:
-        print(f"Get user servers error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get user servers error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def load_server_summary(server_id):
+    """
+    Server row with member and role counts (everything but the caller's own role).
+    
+    Args:
+        server_id: Server to load
+    
+    Returns:
+        Server dict with member_count and role_counts, or None if it doesn't exist
+    """
+    server = supabase.table('servers').select('*').eq('id', server_id).execute()
+    if not server.data:
+        return None
+    
+    # Total member count (no rows transferred)
+    member_count = supabase.table('server_members').select(
+        'id', count='exact'
+    ).eq('server_id', server_id).limit(0).execute()
+    total = get_count(member_count) or 0
+    
+    # Owners/admins are few, so count them from their rows
+    staff = supabase.table('server_members').select('role').eq(
+        'server_id', server_id
+    ).in_('role', ['owner', 'admin']).execute()
+    
+    role_counts = {role: 0 for role in MEMBER_ROLES}
+    for member in staff.data or []:
+        role_counts[member['role']] += 1
+    role_counts['member'] = max(total - role_counts['owner'] - role_counts['admin'], 0)
+    
+    return {**server.data[0], 'member_count': total, 'role_counts': role_counts}
+
+
+def load_server_messages(server_id, before=None, since_seq=None, until_seq=None):
+    """
+    One page of enriched server messages from the database, oldest first.
+    
+    The newest page also seeds the channel's message buffer.
+    
+    Args:
+        server_id: Server whose messages to load
+        before: Only messages created before this timestamp (None for the newest page)
+        since_seq: Sync instead: the oldest messages with a higher sequence number
+        until_seq: With since_seq, only messages with a lower sequence number
+    
+    Returns:
+        List of message dicts as built by build_server_message
+    """
+    syncing = since_seq is not None
+    query = supabase.table('server_messages').select(
+        f'id, seq, content, file_url, file_type, created_at, sender_id, reply_to_id, {REPLY_PREVIEW_COLUMNS}'
+    ).eq('server_id', server_id)
+    if before:
+        query = query.lt('created_at', before)
+    if syncing:
+        query = query.gt('seq', since_seq)
+    if until_seq is not None:
+        query = query.lt('seq', until_seq)
+    # Newest page first, then flip to oldest-first for display; a sync reads forwards
+    messages = query.order('seq', desc=not syncing).limit(MESSAGES_PAGE_SIZE).execute()
+    rows = messages.data or []
+    if not syncing:
+        rows.reverse()
+    
+    # One batched sender lookup for the whole page
+    senders = get_users_by_ids(supabase, (msg['sender_id'] for msg in rows))
+    messages_list = [build_server_message(msg, senders.get(msg['sender_id']), server_id) for msg in rows]
+    
+    if not before and not syncing:
+        server_message_buffer.seed(server_id, messages_list)
+    return messages_list
+
 
 @servers_bp.route('/<server_id>', methods=['GET'])
 @login_required
 def get_server_details(server_id):
-    """Get detailed information about a server"""
+    """Get server details with a compact member summary (members are paged separately)"""
     try:
         user_id = session['user_id']
         
-        # Check if user is a member
-        is_member = supabase.rpc('is_server_member', {
+        # Membership check and role lookup in one call
+        user_role = supabase.rpc('get_user_server_role', {
             'sid': server_id,
             'uid': user_id
         }).execute()
         
-        if not is_member.data:
+        if not user_role.data:
             return jsonify({'success': False, 'error': 'Not a member of this server'}), 403
         
-        # Get server details
-        server = supabase.table('servers').select('*').eq('id', server_id).execute()
+        # The rest is the same for every member, so concurrent callers share it
+        summary = shared_reads.get(('server_details', server_id), lambda: load_server_summary(server_id))
         
-        if not server.data:
+        if summary is None:
             return jsonify({'success': False, 'error': 'Server not found'}), 404
         
-        server_info = server.data[0]
-        
-        # Get members
-        members = supabase.table('server_members').select(
-            'user_id, role, joined_at'
-        ).eq('server_id', server_id).execute()
-        
-        members_list = []
-        if members.data:
-            for member in members.data:
-                user = supabase.table('users').select(
-                    'id, username, user_tag'
-                ).eq('id', member['user_id']).execute()
-                
-                if user.data:
-                    member_info = user.data[0]
-                    member_info['role'] = member['role']
-                    member_info['joined_at'] = member['joined_at']
-                    members_list.append(member_info)
-        
-        server_info['members'] = members_list
-        
         return jsonify({
             'success': True,
-            'server': server_info
+            'server': {**summary, 'user_role': user_role.data}
         }), 200
         
     except Exception as e:
-        print(f"Get server details error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get server details error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@servers_bp.route('/<server_id>/invite', methods=['POST'])
+@servers_bp.route('/<server_id>/members', methods=['GET'])
 @login_required
-def invite_to_server(server_id):
-    """Invite a friend to the server (friends only)"""
+def get_server_members(server_id):
+    """
+    Get one page of server members, grouped by role.
+    
+    Query params:
+        limit: page size (default 50, max 100)
+        cursor: opaque 'joined_at|user_id' cursor from the previous page
+        role: optional role filter (owner, admin, member)
+    """
     try:
-        data = request.get_json()
-        invitee_user_tag = data.get('user_tag', '').strip()
+        user_id = session['user_id']
         
-        if not invitee_user_tag:
-            return jsonify({'success': False, 'error': 'User tag is required'}), 400
+        try:
+            limit = min(max(int(request.args.get('limit', MEMBERS_PAGE_SIZE)), 1), MEMBERS_PAGE_MAX)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid limit'}), 400
         
-        inviter_id = session['user_id']
+        role = request.args.get('role')
+        if role and role not in MEMBER_ROLES:
+            return jsonify({'success': False, 'error': 'Invalid role'}), 400
         
-        # Check if inviter is a member of the server
+        cursor = request.args.get('cursor')
+        cursor_joined_at = cursor_user_id = None
+        if cursor:
+            cursor_joined_at, _, cursor_user_id = cursor.partition('|')
+            if not cursor_joined_at or not cursor_user_id:
+                return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+        
+        # Check if user is a member
         is_member = supabase.rpc('is_server_member', {
             'sid': server_id,
-            'uid': inviter_id
+            'uid': user_id
         }).execute()
         
         if not is_member.data:
-            return jsonify({'success': False, 'error': 'You are not a member of this server'}), 403
-        
-        # Find invitee by user_tag
-        invitee = supabase.table('users').select('id').eq('user_tag', invitee_user_tag).execute()
+            return jsonify({'success': False, 'error': 'Not a member of this server'}), 403
         
-        if not invitee.data:
-            return jsonify({'success': False, 'error': 'User not found'}), 404
+        def members_query():
+            query = supabase.table('server_members').select(
+                'user_id, role, joined_at'
+            ).eq('server_id', server_id)
+            if role:
+                query = query.eq('role', role)
+            return query
+        
+        # Keyset pagination on (joined_at, user_id) without .or_:
+        # first finish the cursor's joined_at tie, then move past it
+        rows = []
+        if cursor:
+            ties = members_query().eq('joined_at', cursor_joined_at).gt(
+                'user_id', cursor_user_id
+            ).order('user_id').limit(limit + 1).execute()
+            rows = ties.data or []
+        
+        if len(rows) <= limit:
+            query = members_query()
+            if cursor:
+                query = query.gt('joined_at', cursor_joined_at)
+            rest = query.order('joined_at').order('user_id').limit(limit + 1 - len(rows)).execute()
+            rows += rest.data or []
+        
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        # One batched profile lookup for the whole page
+        users = get_users_by_ids(supabase, (row['user_id'] for row in rows))
+        
+        groups = {r: [] for r in MEMBER_ROLES}
+        for row in rows:
+            user = users.get(row['user_id'])
+            if user:
+                groups.setdefault(row['role'], []).append({
+                    **user,
+                    'role': row['role'],
+                    'joined_at': row['joined_at']
+                })
+        
+        next_cursor = None
+        if has_more and rows:
+            next_cursor = f"{rows[-1]['joined_at']}|{rows[-1]['user_id']}"
         
-        invitee_id = invitee.data[0]['id']
+        return jsonify({
+            'success': True,
+            'groups': [{'role': r, 'members': groups[r]} for r in groups if groups[r]],
+            'next_cursor': next_cursor
+        }), 200
         
-        # Check if they are friends
-        are_friends = supabase.rpc('are_friends', {
-            'uid1': inviter_id,
-            'uid2': invitee_id
-        }).execute()
+    except Exception as e:
+        logger.exception("Get server members error")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@servers_bp.route('/<server_id>/invite', methods=['POST'])
+@login_required
+def invite_to_server(server_id):
+    """Invite a friend to the server (friends only)"""
+    try:
+        data = request.get_json()
+        invitee_user_tag = data.get('user_tag', '').strip()
         
-        if not are_friends.data:
-            return jsonify({'success': False, 'error': 'You can only invite friends to servers'}), 403
+        if not invitee_user_tag:
+            return jsonify({'success': False, 'error': 'User tag is required'}), 400
         
-        # Check if already a member
-        already_member = supabase.rpc('is_server_member', {
+        # Every rule is checked by the database function in the same call as the insert
+        result = get_data(supabase.rpc('create_server_invite', {
             'sid': server_id,
-            'uid': invitee_id
-        }).execute()
-        
-        if already_member.data:
-            return jsonify({'success': False, 'error': 'User is already a member'}), 400
-        
-        # Check if invite already exists
-        existing_invite = supabase.table('server_invites').select('*').eq(
-            'server_id', server_id
-        ).eq('invitee_id', invitee_id).eq('status', 'pending').execute()
-        
-        if existing_invite.data:
-            return jsonify({'success': False, 'error': 'Invite already sent'}), 400
-        
-        # Create invite
-        invite_data = {
-            'server_id': server_id,
-            'inviter_id': inviter_id,
-            'invitee_id': invitee_id,
-            'status': 'pending'
-        }
+            'inviter': session['user_id'],
+            'invitee_tag': invitee_user_tag
+        }).execute()) or {}
         
-        result = supabase.table('server_invites').insert(invite_data).execute()
+        if result.get('error'):
+            message, status = INVITE_ERRORS.get(result['error'], ('Failed to send invite', 500))
+            return jsonify({'success': False, 'error': message, 'code': result['error']}), status
         
-        if result.data:
-            return jsonify({
-                'success': True,
-                'invite_id': result.data[0]['id'],
-                'message': 'Invite sent successfully'
-            }), 201
-        else:
-            return jsonify({'success': False, 'error': 'Failed to send invite'}), 500
+        return jsonify({
+            'success': True,
+            'invite_id': result['invite_id'],
+            'message': 'Invite sent successfully'
+        }), 201
             
     except Exception as e:
-        print(f"Invite to server error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Invite to server error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -294,9 +461,7 @@ def get_pending_invites():
         }), 200
         
     except Exception as e:
-        print(f"Get pending invites error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get pending invites error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -326,16 +491,22 @@ def accept_invite(invite_id):
         }).eq('id', invite_id).execute()
         
         # Member is automatically added by trigger
+        emit_member_update(invite_data['server_id'], 'join', {
+            'id': user_id,
+            'username': session.get('username'),
+            'user_tag': session.get('user_tag'),
+            'role': 'member'
+        })
+        presence.add_server(user_id, invite_data['server_id'])
         
         return jsonify({
             'success': True,
+            'server_id': invite_data['server_id'],
             'message': 'Invite accepted'
         }), 200
         
     except Exception as e:
-        print(f"Accept invite error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Accept invite error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -370,9 +541,7 @@ def reject_invite(invite_id):
         }), 200
         
     except Exception as e:
-        print(f"Reject invite error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Reject invite error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -400,15 +569,15 @@ def leave_server(server_id):
             'server_id', server_id
         ).eq('user_id', user_id).execute()
         
+        emit_member_update(server_id, 'leave', {'id': user_id})
+        
         return jsonify({
             'success': True,
             'message': 'Left server successfully'
         }), 200
         
     except Exception as e:
-        print(f"Leave server error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Leave server error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -428,59 +597,43 @@ def get_server_messages(server_id):
         if not is_member.data:
             return jsonify({'success': False, 'error': 'Not a member of this server'}), 403
         
-        # Get messages
-        messages = supabase.table('server_messages').select(
-            'id, content, file_url, file_type, created_at, sender_id, reply_to_id'
-        ).eq('server_id', server_id).order('created_at', desc=False).limit(100).execute()
+        before = request.args.get('before')
+        try:
+            since_seq, until_seq = parse_seq_range(request.args)
+        except ValueError:
+            return jsonify({'success': False, 'error': 'Invalid sequence range'}), 400
         
-        messages_list = []
-        if messages.data:
-            for msg in messages.data:
-                # Get sender info
-                sender = supabase.table('users').select(
-                    'id, username, user_tag'
-                ).eq('id', msg['sender_id']).execute()
-                
-                message_info = {
-                    'id': msg['id'],
-                    'content': msg['content'],
-                    'file_url': msg.get('file_url'),
-                    'file_type': msg.get('file_type'),
-                    'created_at': msg['created_at'],
-                    'sender': sender.data[0] if sender.data else None,
-                    'is_own_message': msg['sender_id'] == user_id
-                }
-                
-                # Fetch replied_to message if exists
-                if msg.get('reply_to_id'):
-                    try:
-                        replied_msg_response = supabase.table('server_messages').select('id, content, sender_id').eq('id', msg['reply_to_id']).execute()
-                        if replied_msg_response.data:
-                            replied_msg = replied_msg_response.data[0]
-                            # Fetch the sender of replied message
-                            replied_sender_response = supabase.table('users').select('id, username').eq('id', replied_msg['sender_id']).execute()
-                            if replied_sender_response.data:
-                                replied_msg['sender'] = replied_sender_response.data[0]
-                            message_info['replied_to'] = replied_msg
-                    except Exception as e:
-                        print(f"Error fetching replied message: {e}")
-                
-                messages_list.append(message_info)
+        # Recent history of a hot channel is served from memory
+        if since_seq is not None:
+            messages_list = server_message_buffer.after_seq(server_id, since_seq, until_seq)
+        else:
+            messages_list = None if before else server_message_buffer.get(server_id)
+        
+        has_more = False
+        if messages_list is None:
+            # Members loading the same cold page at once share one load
+            messages_list = shared_reads.get(('server_messages', server_id, before, since_seq, until_seq),
+                                             lambda: load_server_messages(server_id, before, since_seq, until_seq))
+            # A sync page that came back full may have more after it
+            has_more = since_seq is not None and len(messages_list) >= MESSAGES_PAGE_SIZE
         
         return jsonify({
             'success': True,
-            'messages': messages_list
+            'messages': [
+                {**msg, 'is_own_message': (msg.get('sender') or {}).get('id') == user_id}
+                for msg in messages_list
+            ],
+            'has_more': has_more
         }), 200
         
     except Exception as e:
-        print(f"Get server messages error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Get server messages error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 @servers_bp.route('/<server_id>/messages', methods=['POST'])
 @login_required
+@rate_limited('server_message')
 def send_server_message(server_id):
     """Send a message to a server"""
     try:
@@ -501,43 +654,41 @@ def send_server_message(server_id):
         if not is_member.data:
             return jsonify({'success': False, 'error': 'Not a member of this server'}), 403
         
-        # Save message
+        # Save message; a client-supplied id makes a retried send return the original
         message_data = {
+            'id': parse_client_message_id(data.get('message_id')) or new_message_id(),
             'server_id': server_id,
             'sender_id': user_id,
             'content': content,
             'reply_to_id': reply_to_id if reply_to_id else None  # Include reply_to_id
         }
         
-        result = supabase.table('server_messages').insert(message_data).execute()
+        try:
+            msg, created = write_queue.insert('server_messages', message_data)
+        except QueueNotEmpty:
+            # Earlier socket sends are still being replayed; this one mustn't jump ahead of them
+            return jsonify({'success': False, 'read_only': True,
+                            'error': 'Messages are still being delivered. Please try again shortly.'}), 503
         
-        if result.data:
-            msg = result.data[0]
-            
-            # Get sender info
-            sender = supabase.table('users').select(
-                'id, username, user_tag'
-            ).eq('id', user_id).execute()
-            
-            message_info = {
-                'id': msg['id'],
-                'content': msg['content'],
-                'created_at': msg['created_at'],
-                'sender': sender.data[0] if sender.data else None,
-                'server_id': server_id
-            }
-            
-            return jsonify({
-                'success': True,
-                'message': message_info
-            }), 201
-        else:
-            return jsonify({'success': False, 'error': 'Failed to send message'}), 500
+        if msg is None:
+            return jsonify({'success': False, 'error': 'Message id already in use'}), 409
+        
+        # Get sender info
+        sender = supabase.table('users').select(
+            'id, username, user_tag'
+        ).eq('id', user_id).execute()
+        
+        message_info = build_server_message(msg, sender.data[0] if sender.data else None, server_id)
+        if created:
+            server_message_buffer.append(server_id, message_info)
+        
+        return jsonify({
+            'success': True,
+            'message': message_info
+        }), 201 if created else 200
             
     except Exception as e:
-        print(f"Send server message error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Send server message error")
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
@@ -571,13 +722,13 @@ def remove_member(server_id, member_id):
             'server_id', server_id
         ).eq('user_id', member_id).execute()
         
+        emit_member_update(server_id, 'leave', {'id': member_id})
+        
         return jsonify({
             'success': True,
             'message': 'Member removed successfully'
         }), 200
         
     except Exception as e:
-        print(f"Remove member error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Remove member error")
         return jsonify({'success': False, 'error': str(e)}), 500
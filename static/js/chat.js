@@ -4,6 +4,7 @@ let currentChatUserId = null;
 let currentChatUserTag = null;
 let displayedMessageIds = new Set();
 let lastTimestamp = '';
+const lastSeq = {}; // 'dm:<user id>' / 'server:<server id>' -> last sequence number shown
 let selectedFile = null;
 let conversations = {}; // Store messages per user
 let unreadCounts = {}; // Track unread messages per user
@@ -13,23 +14,166 @@ let currentServerId = null;
 let currentServerName = null;
 let isServerChat = false; // Flag to track if we're in server chat or DM
 
+// Unread messages per server (DM counts live in unreadCounts)
+let serverUnreadCounts = {};
+
+// Presence and typing state
+const onlineUsers = new Set();
+const typingByRoom = {}; // server id or 'dm' -> user ids currently typing
+const TYPING_EMIT_INTERVAL = 2000; // ms between 'still typing' signals
+let lastTypingEmit = 0;
+
+// While the server can't reach its database it serves reads from its last good
+// copy (X-Data-Stale) and refuses other writes with 503; say so instead of failing silently
+const nativeFetch = window.fetch.bind(window);
+window.fetch = async (input, init) => {
+    const response = await nativeFetch(input, init);
+    const url = typeof input === 'string' ? input : input.url;
+    if (url.startsWith('/api/')) {
+        const staleAsOf = response.headers.get('X-Data-Stale');
+        if (staleAsOf) {
+            showDegradedBanner(`Can't reach the server right now. Showing data from ${formatToISTTime(staleAsOf + 'Z')}.`);
+        } else if (response.status === 503) {
+            showDegradedBanner('The server is temporarily read-only. Messages you send will be delivered once it recovers.');
+        } else if (response.ok) {
+            hideDegradedBanner();
+        }
+    }
+    return response;
+};
+
+function showDegradedBanner(text) {
+    const banner = document.getElementById('degradedBanner');
+    banner.textContent = text;
+    banner.style.display = 'block';
+}
+
+function hideDegradedBanner() {
+    document.getElementById('degradedBanner').style.display = 'none';
+}
+
+// A queued message was stored and broadcast: drop its pending style
+// A message shown while pending is removed when its confirmed copy arrives, which is then rendered in its place
+function takePendingMessage(messageId) {
+    const pending = document.querySelector(`.message.pending[data-message-id="${messageId}"]`);
+    if (pending) pending.remove();
+    return pending !== null;
+}
+
+function markFailed(messageId) {
+    document.querySelectorAll(`[data-message-id="${messageId}"]`).forEach(el => {
+        el.classList.remove('pending');
+        el.classList.add('failed');
+    });
+}
+
+// Time-ordered message id (UUIDv7), so a message can be shown before the server
+// stores it and a retried send is recognised instead of stored twice
+function newMessageId() {
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    let time = Date.now();
+    for (let i = 5; i >= 0; i--) {
+        bytes[i] = time % 256;
+        time = Math.floor(time / 256);
+    }
+    bytes[6] = (bytes[6] & 0x0f) | 0x70; // version 7
+    bytes[8] = (bytes[8] & 0x3f) | 0x80; // RFC 4122 variant
+    const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
+// Profile table used to resolve sender ids in compact socket events
+const profiles = {
+    [CURRENT_USER_ID]: { id: CURRENT_USER_ID, username: CURRENT_USERNAME, user_tag: CURRENT_USER_TAG }
+};
+
+function rememberProfiles(users) {
+    users.forEach(user => {
+        if (user && user.id) {
+            profiles[user.id] = { id: user.id, username: user.username, user_tag: user.user_tag };
+        }
+    });
+}
+
+// Fetch any profiles we have not seen yet in one batched request
+async function ensureProfiles(ids) {
+    const missing = [...new Set(ids)].filter(id => id && !profiles[id]);
+    if (missing.length === 0) {
+        return;
+    }
+    try {
+        const response = await fetch(`/api/profiles?ids=${encodeURIComponent(missing.join(','))}`);
+        const data = await response.json();
+        if (data.success) {
+            rememberProfiles(data.profiles);
+        }
+    } catch (error) {
+        console.error('Error loading profiles:', error);
+    }
+}
+
+// Expand a compact event message back into the full message shape
+async function expandCompactMessage(c) {
+    await ensureProfiles([c.s, c.rp?.s]);
+    const message = {
+        id: c.i,
+        seq: c.q,
+        sender_id: c.s,
+        receiver_id: c.r,
+        server_id: c.sv,
+        content: c.c ?? null,
+        created_at: c.t,
+        file_url: c.f ?? null,
+        file_type: c.ft ?? null,
+        sender: profiles[c.s] || { id: c.s }
+    };
+    if (c.rp) {
+        message.reply_to_id = c.rp.i;
+        message.replied_to = {
+            id: c.rp.i,
+            content: c.rp.c,
+            sender_id: c.rp.s,
+            sender: profiles[c.rp.s] || { id: c.rp.s }
+        };
+    }
+    return message;
+}
+
 // Initialize Socket.IO
 function initSocket() {
     socket = io({
-        transports: ['websocket', 'polling']
+        // WebSocket straight away; long-polling only if the WebSocket can't be opened
+        // (e.g. a proxy that blocks upgrades), and then upgraded again when possible
+        transports: SOCKET_TRANSPORTS,
+        tryAllTransports: true,
+        rememberUpgrade: true,
+        auth: SOCKET_COMPACT_EVENTS ? { wire: 'compact' } : {}
     });
 
+    // The server joins our user room and all our server rooms on connect;
+    // after a reconnect, fetch whatever the open channel missed meanwhile
     socket.on('connect', () => {
         console.log('Connected to server');
-        socket.emit('join', { user_id: CURRENT_USER_ID });
+        if (isServerChat && currentServerId && lastSeq[`server:${currentServerId}`] !== undefined) {
+            syncMessages('server', currentServerId, lastSeq[`server:${currentServerId}`]);
+        } else if (!isServerChat && currentChatUserId && lastSeq[`dm:${currentChatUserId}`] !== undefined) {
+            syncMessages('dm', currentChatUserId, lastSeq[`dm:${currentChatUserId}`]);
+        }
     });
 
     socket.on('disconnect', () => {
         console.log('Disconnected from server');
     });
+    
+    socket.on('error', (data) => {
+        console.warn('Server error:', data.message);
+        if (data.retry_after !== undefined) {
+            alert(`You're sending messages too quickly. Try again in ${Math.ceil(data.retry_after)}s.`);
+        }
+    });
 
-    socket.on('new_message', (data) => {
-        const message = data.message;
+    socket.on('new_message', async (data) => {
+        const message = data.m ? await expandCompactMessage(data.m) : data.message;
         
         // Determine the other user ID
         const otherUserId = message.sender_id === CURRENT_USER_ID ? message.receiver_id : message.sender_id;
@@ -39,7 +183,9 @@ function initSocket() {
             (message.sender_id === currentChatUserId || message.receiver_id === currentChatUserId)) {
             displayMessage(message);
             scrollToBottom();
-        } else if (message.sender_id !== CURRENT_USER_ID) {
+            markRead('dm', currentChatUserId);
+        } else if ((message.sender_id ?? message.sender?.id) !== CURRENT_USER_ID) {
+            // Compact payloads carry sender_id, full ones the sender object
             // Increment unread count for this user
             if (!unreadCounts[otherUserId]) {
                 unreadCounts[otherUserId] = 0;
@@ -55,20 +201,194 @@ function initSocket() {
         conversations[otherUserId].push(message);
     });
 
-    socket.on('message_sent', (data) => {
-        const message = data.message;
+    socket.on('message_sent', async (data) => {
+        const message = data.m ? await expandCompactMessage(data.m) : data.message;
         if (currentChatUserId && message.receiver_id === currentChatUserId) {
             displayMessage(message);
             scrollToBottom();
         }
     });
     
-    socket.on('new_server_message', (message) => {
+    socket.on('new_server_message', async (data) => {
+        const message = data.i ? await expandCompactMessage(data) : data;
+        receiveServerMessages([message]);
+    });
+    
+    // Events the server coalesced for a busy room arrive as one frame: {event, items}
+    socket.on('batch', async (batch) => {
+        if (batch.event === 'new_server_message') {
+            // One profile lookup and one render pass for the whole batch
+            await ensureProfiles(batch.items.flatMap(item => [item.s, item.rp?.s]));
+            const messages = await Promise.all(batch.items.map(item => item.i ? expandCompactMessage(item) : item));
+            receiveServerMessages(messages);
+        } else {
+            batch.items.forEach(item => socket.listeners(batch.event).forEach(listener => listener(item)));
+        }
+    });
+    
+    // Sent while the server's database was unreachable: shown as pending until broadcast
+    socket.on('server_message_queued', (message) => {
         if (isServerChat && currentServerId === message.server_id) {
             displayServerMessage(message);
             scrollToBottom();
         }
     });
+    
+    socket.on('message_failed', (data) => {
+        markFailed(data.id);
+    });
+    
+    socket.on('server_member_update', (update) => {
+        applyServerMemberUpdate(update);
+    });
+    
+    socket.on('presence_update', (update) => {
+        update.online.forEach(id => onlineUsers.add(id));
+        update.offline.forEach(id => onlineUsers.delete(id));
+        renderPresence();
+    });
+    
+    socket.on('typing', async (update) => {
+        const users = update.users.filter(id => id !== CURRENT_USER_ID);
+        await ensureProfiles(users);
+        typingByRoom[update.server_id || 'dm'] = users;
+        renderTypingIndicator();
+    });
+}
+
+// All unread counts in one request, so channels with nothing new need not be loaded
+async function loadUnreadCounts() {
+    try {
+        const response = await fetch('/api/unread');
+        const data = await response.json();
+        if (data.success) {
+            applyUnreadCounts(data);
+        }
+    } catch (error) {
+        console.error('Error loading unread counts:', error);
+    }
+}
+
+function applyUnreadCounts(unread) {
+    Object.entries(unread.dms).forEach(([userId, count]) => {
+        unreadCounts[userId] = count;
+        updateContactBadge(userId, count);
+    });
+    Object.entries(unread.servers).forEach(([serverId, count]) => {
+        serverUnreadCounts[serverId] = count;
+        updateServerBadge(serverId, count);
+    });
+}
+
+// Move the read marker for a channel; bursts of messages collapse into one request
+const pendingReads = {};
+function markRead(channelType, channelId) {
+    const key = `${channelType}:${channelId}`;
+    if (pendingReads[key]) {
+        return;
+    }
+    pendingReads[key] = setTimeout(async () => {
+        delete pendingReads[key];
+        try {
+            await fetch('/api/read', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ channel_type: channelType, channel_id: channelId })
+            });
+        } catch (error) {
+            console.error('Error updating read state:', error);
+        }
+    }, 1000);
+}
+
+// Initial page state (friends, servers, pending requests/invites, unread, presence) in one request
+async function loadBootstrap() {
+    try {
+        const response = await fetch('/api/bootstrap');
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error);
+        }
+        data.online.forEach(id => onlineUsers.add(id));
+        renderFriendsSidebar(data.friends);
+        renderServersSidebar(data.servers);
+        applyUnreadCounts(data.unread);
+        renderFriendRequestBadge(data.friend_requests.incoming.length);
+        renderServerInvitesBadge(data.server_invites);
+    } catch (error) {
+        console.error('Error loading initial state, falling back to separate requests:', error);
+        loadFriendsToSidebar().then(loadPresence);
+        loadUnreadCounts();
+        loadServersToSidebar();
+        updateNotificationBadge();
+        updateServerInvitesBadge();
+    }
+}
+
+// Initial presence snapshot; later changes arrive as presence_update events
+async function loadPresence() {
+    try {
+        const response = await fetch('/api/presence');
+        const data = await response.json();
+        if (data.success) {
+            data.online.forEach(id => onlineUsers.add(id));
+            renderPresence();
+        }
+    } catch (error) {
+        console.error('Error loading presence:', error);
+    }
+}
+
+function renderPresence() {
+    document.querySelectorAll('.contact[data-user-id]').forEach(contact => {
+        setStatus(contact.querySelector('.status'), onlineUsers.has(contact.dataset.userId));
+    });
+    if (!isServerChat && currentChatUserId) {
+        setStatus(document.querySelector('#chatHeader .status'), onlineUsers.has(currentChatUserId));
+    }
+}
+
+function setStatus(element, online) {
+    if (!element) {
+        return;
+    }
+    element.textContent = online ? 'Online' : 'Offline';
+    element.classList.toggle('offline', !online);
+}
+
+function renderTypingIndicator() {
+    const indicator = document.getElementById('typingIndicator');
+    let typers = [];
+    if (isServerChat && currentServerId) {
+        typers = typingByRoom[currentServerId] || [];
+    } else if (currentChatUserId) {
+        typers = (typingByRoom.dm || []).filter(id => id === currentChatUserId);
+    }
+    const names = typers.map(id => profiles[id]?.username || 'Someone');
+    if (names.length === 0) {
+        indicator.textContent = '';
+    } else if (names.length <= 3) {
+        indicator.textContent = `${names.join(', ')} ${names.length === 1 ? 'is' : 'are'} typing...`;
+    } else {
+        indicator.textContent = 'Several people are typing...';
+    }
+}
+
+// Tell the current room we are typing, at most once per TYPING_EMIT_INTERVAL
+function emitTyping(active) {
+    if (!socket) {
+        return;
+    }
+    const now = Date.now();
+    if (active && now - lastTypingEmit < TYPING_EMIT_INTERVAL) {
+        return;
+    }
+    lastTypingEmit = active ? now : 0;
+    if (isServerChat && currentServerId) {
+        socket.emit('typing', { server_id: currentServerId, typing: active });
+    } else if (currentChatUserId) {
+        socket.emit('typing', { receiver_id: currentChatUserId, typing: active });
+    }
 }
 
 // Search functionality
@@ -92,6 +412,13 @@ searchInput.addEventListener('input', (e) => {
     }, 300);
 });
 
+// With an empty search box, offer friends of friends instead
+searchInput.addEventListener('focus', () => {
+    if (searchInput.value.trim().length === 0) {
+        loadFriendSuggestions();
+    }
+});
+
 // Close search results when clicking outside
 document.addEventListener('click', (e) => {
     if (!searchInput.contains(e.target) && !searchResults.contains(e.target)) {
@@ -134,6 +461,7 @@ async function searchUsers(query) {
                     <div class="search-result-info">
                         <span class="user-tag">${user.user_tag}</span>
                         <span class="username">${user.username}</span>
+                        ${mutualFriendsLabel(friendStatus.mutual_friends)}
                     </div>
                     <div class="search-result-actions">
                         ${actionButton}
@@ -152,6 +480,43 @@ async function searchUsers(query) {
     }
 }
 
+function mutualFriendsLabel(count) {
+    if (!count) return '';
+    return `<span class="mutual-friends">${count} mutual friend${count === 1 ? '' : 's'}</span>`;
+}
+
+async function loadFriendSuggestions() {
+    try {
+        const response = await fetch('/api/friends/suggestions?limit=5');
+        const data = await response.json();
+        
+        // The user may have started typing while this was loading
+        if (!data.success || data.suggestions.length === 0 || searchInput.value.trim().length > 0) {
+            return;
+        }
+        
+        searchResults.innerHTML = '<div class="search-results-header">People you may know</div>';
+        data.suggestions.forEach(user => {
+            const item = document.createElement('div');
+            item.className = 'search-result-item';
+            item.innerHTML = `
+                <div class="search-result-info">
+                    <span class="user-tag">${user.user_tag}</span>
+                    <span class="username">${user.username}</span>
+                    ${mutualFriendsLabel(user.mutual_friends)}
+                </div>
+                <div class="search-result-actions">
+                    <button class="btn-small btn-add-friend" onclick="sendFriendRequest('${user.user_tag}')">Add Friend</button>
+                </div>
+            `;
+            searchResults.appendChild(item);
+        });
+        searchResults.classList.add('show');
+    } catch (error) {
+        console.error('Error loading friend suggestions:', error);
+    }
+}
+
 // Open chat from search results
 function openChatFromSearch(userId, userTag, username) {
     const user = {
@@ -189,11 +554,6 @@ async function openChat(user) {
         return;
     }
     
-    // Leave server room if in one (before clearing state)
-    if (socket && currentServerId) {
-        socket.emit('leave_server', { server_id: currentServerId });
-    }
-
     // Reset server chat state
     isServerChat = false;
     currentServerId = null;
@@ -213,7 +573,7 @@ async function openChat(user) {
             <div class="contact-avatar">${user.username[0].toUpperCase()}</div>
             <div class="chat-header-info">
                 <h3>${user.user_tag || user.username}</h3>
-                <span class="status">Online</span>
+                <span class="status${onlineUsers.has(user.id) ? '' : ' offline'}">${onlineUsers.has(user.id) ? 'Online' : 'Offline'}</span>
             </div>
         </div>
         <button class="settings-btn" onclick="openDmSettings('${user.id}', '${user.user_tag || user.username}')" title="Chat Settings">
@@ -230,6 +590,8 @@ async function openChat(user) {
     // Show message input
     document.getElementById('messageInputContainer').style.display = 'flex';
     
+    renderTypingIndicator();
+    
     // Load messages for this user
     await loadMessages(user.id);
     
@@ -249,7 +611,7 @@ function addToContactsList(user) {
             <div class="contact-avatar">${user.username[0].toUpperCase()}</div>
             <div class="contact-info">
                 <h3>${user.user_tag || user.username}</h3>
-                <p class="status">Online</p>
+                <p class="status${onlineUsers.has(user.id) ? '' : ' offline'}">${onlineUsers.has(user.id) ? 'Online' : 'Offline'}</p>
             </div>
             <span class="contact-badge" id="badge-${user.id}" style="display: none;">0</span>
         `;
@@ -269,6 +631,7 @@ function addToContactsList(user) {
         // Clear unread count when opening chat
         unreadCounts[user.id] = 0;
         updateContactBadge(user.id, 0);
+        markRead('dm', user.id);
     }
 }
 
@@ -285,6 +648,19 @@ function updateContactBadge(userId, count) {
     }
 }
 
+// Update server notification badge
+function updateServerBadge(serverId, count) {
+    const badge = document.getElementById(`server-badge-${serverId}`);
+    if (badge) {
+        if (count > 0) {
+            badge.textContent = count > 99 ? '99+' : count;
+            badge.style.display = 'block';
+        } else {
+            badge.style.display = 'none';
+        }
+    }
+}
+
 // Load messages for a specific user
 async function loadMessages(userId) {
     try {
@@ -295,6 +671,7 @@ async function loadMessages(userId) {
             const messagesContainer = document.getElementById('messages');
             messagesContainer.innerHTML = '';
             displayedMessageIds.clear();
+            delete lastSeq[`dm:${userId}`];
             
             data.messages.forEach(message => {
                 displayMessage(message);
@@ -317,13 +694,14 @@ async function loadMessages(userId) {
 // Display a single message
 function displayMessage(message) {
     if (displayedMessageIds.has(message.id)) {
-        return;
+        if (message.pending || !takePendingMessage(message.id)) return;
     }
     displayedMessageIds.add(message.id);
+    noteSeq('dm', message.sender_id === CURRENT_USER_ID ? message.receiver_id : message.sender_id, message.seq);
     
     const messagesContainer = document.getElementById('messages');
     const messageDiv = document.createElement('div');
-    messageDiv.className = `message ${message.sender_id === CURRENT_USER_ID ? 'sent' : 'received'} message-hoverable`;
+    messageDiv.className = `message ${message.sender_id === CURRENT_USER_ID ? 'sent' : 'received'} message-hoverable${message.pending ? ' pending' : ''}`;
     messageDiv.dataset.messageId = message.id;
     
     let content = '';
@@ -388,7 +766,7 @@ function displayMessage(message) {
         `}
     `;
     
-    messagesContainer.appendChild(messageDiv);
+    insertInSeqOrder(messagesContainer, messageDiv, message.seq);
     
     // Update last timestamp
     if (message.created_at && message.created_at > lastTimestamp) {
@@ -403,10 +781,15 @@ function initMessageForm() {
     const fileInput = document.getElementById('fileInput');
     const filePreview = document.getElementById('filePreview');
 
+    messageInput.addEventListener('input', () => {
+        emitTyping(messageInput.value.length > 0);
+    });
+    
     messageForm.addEventListener('submit', async (e) => {
         e.preventDefault();
         
         const content = messageInput.value.trim();
+        lastTypingEmit = 0; // the server clears our indicator when the message lands
         
         console.log('Form submitted:', { 
             content, 
@@ -428,9 +811,11 @@ function initMessageForm() {
             console.log('Sending server message:', { server_id: currentServerId, content });
             
             // Send via WebSocket
+            const messageId = newMessageId();
             const messageData = {
                 server_id: currentServerId,
-                content: content
+                content: content,
+                message_id: messageId
             };
             
             // Include reply_to_id if replying
@@ -438,7 +823,26 @@ function initMessageForm() {
                 messageData.reply_to_id = replyingTo.id;
             }
             
-            socket.emit('server_message', messageData);
+            // Shown straight away; the broadcast copy replaces it once stored
+            displayServerMessage({
+                id: messageId,
+                server_id: currentServerId,
+                content: content,
+                created_at: new Date().toISOString(),
+                sender: profiles[CURRENT_USER_ID],
+                is_own_message: true,
+                pending: true
+            });
+            scrollToBottom();
+            
+            socket.emit('server_message', messageData, (ack) => {
+                if (!ack) {
+                    markFailed(messageId);
+                } else if (ack.id !== messageId) {
+                    // The server didn't accept our id (e.g. this device's clock is off)
+                    takePendingMessage(messageId);
+                }
+            });
             
             messageInput.value = '';
             return;
@@ -450,9 +854,13 @@ function initMessageForm() {
             return;
         }
         
+        const messageId = newMessageId();
         const formData = new FormData();
         formData.append('receiver_id', currentChatUserId);
         formData.append('content', content);
+        formData.append('message_id', messageId);
+        // Lets the server skip echoing message_sent back to this tab
+        formData.append('socket_id', socket.id || '');
         
         if (selectedFile) {
             formData.append('file', selectedFile);
@@ -463,15 +871,31 @@ function initMessageForm() {
             formData.append('reply_to_id', replyingTo.id);
         }
         
-        try {
-            const response = await fetch('/api/send_message', {
-                method: 'POST',
-                body: formData
+        // Text is shown straight away; the stored copy replaces it
+        if (!selectedFile) {
+            displayMessage({
+                id: messageId,
+                sender_id: CURRENT_USER_ID,
+                receiver_id: currentChatUserId,
+                content: content,
+                created_at: new Date().toISOString(),
+                pending: true
             });
+            scrollToBottom();
+        }
+        
+        try {
+            const send = () => fetch('/api/send_message', { method: 'POST', body: formData });
+            // Retried once if the request never got an answer; the id makes that safe
+            const response = await send().catch(send);
             
             const data = await response.json();
             
             if (data.success) {
+                if (data.message.id !== messageId) takePendingMessage(messageId);
+                displayMessage(data.message);
+                scrollToBottom();
+                
                 messageInput.value = '';
                 selectedFile = null;
                 filePreview.innerHTML = '';
@@ -482,10 +906,12 @@ function initMessageForm() {
                     cancelReply();
                 }
             } else {
+                markFailed(messageId);
                 alert('Failed to send message: ' + (data.error || 'Unknown error'));
             }
         } catch (error) {
             console.error('Send error:', error);
+            markFailed(messageId);
             alert('Failed to send message');
         }
     });
@@ -529,6 +955,13 @@ function clearFilePreview() {
 async function fetchNewMessages() {
     if (!currentChatUserId) return;
     
+    // Once a sequence number is known, ask for exactly what came after it
+    const seq = lastSeq[`dm:${currentChatUserId}`];
+    if (seq !== undefined) {
+        await syncMessages('dm', currentChatUserId, seq);
+        return;
+    }
+    
     try {
         let url = `/api/messages?friend_id=${currentChatUserId}`;
         if (lastTimestamp) {
@@ -549,6 +982,80 @@ async function fetchNewMessages() {
     }
 }
 
+// Show incoming server messages, or count them as unread if their server isn't open
+function receiveServerMessages(messages) {
+    let shown = false;
+    messages.forEach(message => {
+        if (isServerChat && currentServerId === message.server_id) {
+            displayServerMessage(message);
+            shown = true;
+        } else if ((message.sender_id ?? message.sender?.id) !== CURRENT_USER_ID) {
+            // Compact payloads carry sender_id, full ones the sender object
+            // The broadcast itself is the unread increment; no extra event per member
+            serverUnreadCounts[message.server_id] = (serverUnreadCounts[message.server_id] || 0) + 1;
+            updateServerBadge(message.server_id, serverUnreadCounts[message.server_id]);
+        }
+    });
+    if (shown) {
+        scrollToBottom();
+        markRead('server', currentServerId);
+    }
+}
+
+// Record a shown message's sequence number; a jump means events were missed, so fetch the hole
+function noteSeq(kind, id, seq) {
+    if (!seq || !id) return;
+    const key = `${kind}:${id}`;
+    const last = lastSeq[key];
+    if (last !== undefined && seq <= last) return;
+    lastSeq[key] = seq;
+    if (last !== undefined && seq > last + 1) {
+        syncMessages(kind, id, last, seq);
+    }
+}
+
+// Fetch the messages of a channel after sinceSeq (and before untilSeq) and show them in order
+async function syncMessages(kind, id, sinceSeq, untilSeq = null) {
+    try {
+        while (true) {
+            const params = new URLSearchParams({ since_seq: sinceSeq });
+            if (untilSeq) params.set('until_seq', untilSeq);
+            const url = kind === 'dm'
+                ? `/api/messages?friend_id=${id}&${params}`
+                : `/api/servers/${id}/messages?${params}`;
+            const response = await fetch(url);
+            const data = await response.json();
+            
+            const open = kind === 'dm' ? currentChatUserId === id : isServerChat && currentServerId === id;
+            if (!data.success || !open || data.messages.length === 0) return;
+            
+            if (kind === 'dm') {
+                data.messages.forEach(message => displayMessage(message));
+            } else {
+                rememberProfiles(data.messages.map(message => message.sender));
+                data.messages.forEach(message => displayServerMessage(message));
+            }
+            scrollToBottom();
+            
+            if (!data.has_more) return;
+            sinceSeq = data.messages[data.messages.length - 1].seq;
+        }
+    } catch (error) {
+        console.error('Error syncing messages:', error);
+    }
+}
+
+// Place a message element after every shown message with a lower sequence number
+function insertInSeqOrder(container, element, seq) {
+    if (seq) element.dataset.seq = seq;
+    let next = null;
+    for (let child = container.lastElementChild; child && child.dataset.seq && seq; child = child.previousElementSibling) {
+        if (Number(child.dataset.seq) < seq) break;
+        next = child;
+    }
+    container.insertBefore(element, next);
+}
+
 // Scroll to bottom
 function scrollToBottom() {
     const messagesContainer = document.getElementById('messages');
@@ -603,11 +1110,8 @@ document.addEventListener('DOMContentLoaded', () => {
     initMessageForm();
     initEmojiPicker();
     
-    // Load friends list into sidebar
-    loadFriendsToSidebar();
-    
-    // Load servers list
-    loadServersToSidebar();
+    // Friends, servers, badges and presence in one request
+    loadBootstrap();
     
     // Start polling
     setInterval(fetchNewMessages, 2500);
@@ -664,13 +1168,10 @@ function initFriendsPanel() {
         });
     });
     
-    // Poll for new friend requests
+    // Poll for new friend requests (the initial count comes from the bootstrap)
     setInterval(() => {
         updateNotificationBadge();
     }, 5000);
-    
-    // Initial badge update
-    updateNotificationBadge();
 }
 
 // Load friend requests
@@ -904,21 +1405,23 @@ async function updateNotificationBadge() {
         const data = await response.json();
         
         if (data.success) {
-            const badge = document.getElementById('friendRequestBadge');
-            const count = data.incoming.length;
-            
-            if (count > 0) {
-                badge.textContent = count;
-                badge.style.display = 'block';
-            } else {
-                badge.style.display = 'none';
-            }
+            renderFriendRequestBadge(data.incoming.length);
         }
     } catch (error) {
         console.error('Error updating notification badge:', error);
     }
 }
 
+function renderFriendRequestBadge(count) {
+    const badge = document.getElementById('friendRequestBadge');
+    if (count > 0) {
+        badge.textContent = count;
+        badge.style.display = 'block';
+    } else {
+        badge.style.display = 'none';
+    }
+}
+
 // Send friend request from search
 async function sendFriendRequest(userTag) {
     try {
@@ -933,8 +1436,13 @@ async function sendFriendRequest(userTag) {
         
         if (data.success) {
             alert('Friend request sent!');
-            // Refresh search results to update button
-            searchUsers(document.getElementById('searchInput').value.trim());
+            // Refresh search results (or suggestions) to update button
+            const query = document.getElementById('searchInput').value.trim();
+            if (query) {
+                searchUsers(query);
+            } else {
+                loadFriendSuggestions();
+            }
         } else {
             alert('Failed to send request: ' + (data.error || 'Unknown error'));
         }
@@ -953,7 +1461,9 @@ async function checkFriendshipStatus(userId) {
         if (data.success) {
             return {
                 is_friend: data.is_friend,
-                request_status: data.request_status
+                request_status: data.request_status,
+                request_id: data.request_id,
+                mutual_friends: data.mutual_friends || 0
             };
         }
         return { is_friend: false, request_status: 'none' };
@@ -969,40 +1479,50 @@ async function loadFriendsToSidebar() {
         const response = await fetch('/api/friends/');
         const data = await response.json();
         
-        if (data.success && data.friends.length > 0) {
-            const contactsList = document.getElementById('contactsList');
-            
-            // Clear existing contacts
-            contactsList.innerHTML = '';
-            
-            // Add all friends to the sidebar
-            data.friends.forEach(friend => {
-                const contact = document.createElement('div');
-                contact.className = 'contact';
-                contact.dataset.userId = friend.id;
-                contact.innerHTML = `
-                    <div class="contact-avatar">${friend.username[0].toUpperCase()}</div>
-                    <div class="contact-info">
-                        <h3>${friend.user_tag}</h3>
-                        <p class="status">Online</p>
-                    </div>
-                    <span class="contact-badge" id="badge-${friend.id}" style="display: none;">0</span>
-                `;
-                contact.addEventListener('click', () => {
-                    openChat({
-                        id: friend.id,
-                        user_tag: friend.user_tag,
-                        username: friend.username
-                    });
-                });
-                contactsList.appendChild(contact);
-            });
+        if (data.success) {
+            renderFriendsSidebar(data.friends);
         }
     } catch (error) {
         console.error('Error loading friends to sidebar:', error);
     }
 }
 
+// Fill the sidebar contacts list with friends
+function renderFriendsSidebar(friends) {
+    if (friends.length === 0) {
+        return;
+    }
+    rememberProfiles(friends);
+    const contactsList = document.getElementById('contactsList');
+    
+    // Clear existing contacts
+    contactsList.innerHTML = '';
+    
+    // Add all friends to the sidebar
+    friends.forEach(friend => {
+        const contact = document.createElement('div');
+        contact.className = 'contact';
+        contact.dataset.userId = friend.id;
+        contact.innerHTML = `
+            <div class="contact-avatar">${friend.username[0].toUpperCase()}</div>
+            <div class="contact-info">
+                <h3>${friend.user_tag}</h3>
+                <p class="status${onlineUsers.has(friend.id) ? '' : ' offline'}">${onlineUsers.has(friend.id) ? 'Online' : 'Offline'}</p>
+            </div>
+            <span class="contact-badge" id="badge-${friend.id}" style="display: none;">0</span>
+        `;
+        contact.addEventListener('click', () => {
+            openChat({
+                id: friend.id,
+                user_tag: friend.user_tag,
+                username: friend.username
+            });
+        });
+        contactsList.appendChild(contact);
+        updateContactBadge(friend.id, unreadCounts[friend.id] || 0);
+    });
+}
+
 // --- Server/Group Functions ---
 
 function initServerFunctions() {
@@ -1095,8 +1615,7 @@ function initServerFunctions() {
         await createServer();
     });
     
-    // Load pending server invites on init
-    updateServerInvitesBadge();
+    // Poll pending server invites (the initial list comes from the bootstrap)
     setInterval(updateServerInvitesBadge, 5000); // Check every 5 seconds
 }
 
@@ -1122,6 +1641,8 @@ async function createServer() {
         const data = await response.json();
         
         if (data.success) {
+            // Membership began after this socket connected, so ask to be added to the room
+            socket.emit('join_server', { server_id: data.server.id });
             alert('Server created successfully!');
             document.getElementById('createServerModal').classList.remove('active');
             loadServersToSidebar();
@@ -1141,58 +1662,60 @@ async function loadServersToSidebar() {
         const data = await response.json();
         
         if (data.success) {
-            const serversList = document.getElementById('serversList');
-            
-            if (data.servers.length === 0) {
-                serversList.innerHTML = '<p class="empty-state-small">No servers yet</p>';
-            } else {
-                serversList.innerHTML = '';
-                data.servers.forEach(server => {
-                    const serverItem = document.createElement('div');
-                    serverItem.className = 'server-item';
-                    serverItem.dataset.serverId = server.id;
-                    
-                    const initial = server.name[0].toUpperCase();
-                    const memberCount = server.member_count || 0;
-                    
-                    serverItem.innerHTML = `
-                        <div class="server-avatar">${initial}</div>
-                        <div class="server-info">
-                            <h3>${server.name}</h3>
-                            <span class="members-count">${memberCount} member${memberCount !== 1 ? 's' : ''}</span>
-                        </div>
-                    `;
-                    
-                    serverItem.addEventListener('click', () => {
-                        // Remove active class from all server items
-                        document.querySelectorAll('.server-item').forEach(item => {
-                            item.classList.remove('active');
-                        });
-                        // Remove active class from all contacts
-                        document.querySelectorAll('.contact').forEach(contact => {
-                            contact.classList.remove('active');
-                        });
-                        // Add active class to clicked server
-                        serverItem.classList.add('active');
-                        openServer(server);
-                    });
-                    
-                    serversList.appendChild(serverItem);
-                });
-            }
+            renderServersSidebar(data.servers);
         }
     } catch (error) {
         console.error('Error loading servers:', error);
     }
 }
 
-// Open a server (show chat area)
-async function openServer(server) {
-    // Leave previous server room if we were in one
-    if (currentServerId && currentServerId !== server.id) {
-        socket.emit('leave_server', { server_id: currentServerId });
+// Fill the sidebar servers list
+function renderServersSidebar(servers) {
+    const serversList = document.getElementById('serversList');
+    
+    if (servers.length === 0) {
+        serversList.innerHTML = '<p class="empty-state-small">No servers yet</p>';
+    } else {
+        serversList.innerHTML = '';
+        servers.forEach(server => {
+            const serverItem = document.createElement('div');
+            serverItem.className = 'server-item';
+            serverItem.dataset.serverId = server.id;
+            
+            const initial = server.name[0].toUpperCase();
+            const memberCount = server.member_count || 0;
+            
+            serverItem.innerHTML = `
+                <div class="server-avatar">${initial}</div>
+                <div class="server-info">
+                    <h3>${server.name}</h3>
+                    <span class="members-count">${memberCount} member${memberCount !== 1 ? 's' : ''}</span>
+                </div>
+                <span class="contact-badge" id="server-badge-${server.id}" style="display: none;">0</span>
+            `;
+            
+            serverItem.addEventListener('click', () => {
+                // Remove active class from all server items
+                document.querySelectorAll('.server-item').forEach(item => {
+                    item.classList.remove('active');
+                });
+                // Remove active class from all contacts
+                document.querySelectorAll('.contact').forEach(contact => {
+                    contact.classList.remove('active');
+                });
+                // Add active class to clicked server
+                serverItem.classList.add('active');
+                openServer(server);
+            });
+            
+            serversList.appendChild(serverItem);
+            updateServerBadge(server.id, serverUnreadCounts[server.id] || 0);
+        });
     }
+}
 
+// Open a server (show chat area)
+async function openServer(server) {
     currentServerId = server.id;
     currentServerName = server.name;
     isServerChat = true;
@@ -1205,9 +1728,6 @@ async function openServer(server) {
         messagesRoot.innerHTML = '<div id="chatMessages"></div>';
     }
     displayedMessageIds.clear();
-
-    // Join server room for WebSocket
-    socket.emit('join_server', { server_id: server.id });
     
     // Update chat header
     const chatHeader = document.getElementById('chatHeader');
@@ -1245,6 +1765,11 @@ async function openServer(server) {
     const messageInputContainer = document.getElementById('messageInputContainer');
     messageInputContainer.style.display = 'flex';
     
+    renderTypingIndicator();
+    serverUnreadCounts[server.id] = 0;
+    updateServerBadge(server.id, 0);
+    markRead('server', server.id);
+    
     // Load server messages
     await loadServerMessages(server.id);
     
@@ -1329,32 +1854,36 @@ async function updateServerInvitesBadge() {
         const response = await fetch('/api/servers/invites/pending');
         const data = await response.json();
         
-        if (data.success && data.invites && data.invites.length > 0) {
-            const serverInvitesBtn = document.getElementById('serverInvitesBtn');
-            const serverInvitesBadge = document.getElementById('serverInvitesBadge');
-            
-            // Show button and badge
-            serverInvitesBtn.style.display = '';
-            serverInvitesBadge.style.display = '';
-            serverInvitesBadge.textContent = data.invites.length;
-            
-            // Auto-open modal on first load if there are invites
-            if (!sessionStorage.getItem('serverInvitesChecked')) {
-                sessionStorage.setItem('serverInvitesChecked', 'true');
-                loadServerInvites();
-            }
-        } else {
-            // Hide button and badge if no invites
-            const serverInvitesBtn = document.getElementById('serverInvitesBtn');
-            const serverInvitesBadge = document.getElementById('serverInvitesBadge');
-            serverInvitesBtn.style.display = 'none';
-            serverInvitesBadge.style.display = 'none';
+        if (data.success) {
+            renderServerInvitesBadge(data.invites || []);
         }
     } catch (error) {
         console.error('Error checking server invites:', error);
     }
 }
 
+function renderServerInvitesBadge(invites) {
+    const serverInvitesBtn = document.getElementById('serverInvitesBtn');
+    const serverInvitesBadge = document.getElementById('serverInvitesBadge');
+    
+    if (invites.length > 0) {
+        // Show button and badge
+        serverInvitesBtn.style.display = '';
+        serverInvitesBadge.style.display = '';
+        serverInvitesBadge.textContent = invites.length;
+        
+        // Auto-open modal on first load if there are invites
+        if (!sessionStorage.getItem('serverInvitesChecked')) {
+            sessionStorage.setItem('serverInvitesChecked', 'true');
+            loadServerInvites();
+        }
+    } else {
+        // Hide button and badge if no invites
+        serverInvitesBtn.style.display = 'none';
+        serverInvitesBadge.style.display = 'none';
+    }
+}
+
 async function checkServerInvites() {
     try {
         const response = await fetch('/api/servers/invites/pending');
@@ -1418,6 +1947,7 @@ async function acceptServerInvite(inviteId) {
         const data = await response.json();
         
         if (data.success) {
+            socket.emit('join_server', { server_id: data.server_id });
             alert('Server invite accepted!');
             loadServerInvites();
             loadServersToSidebar();
@@ -1459,6 +1989,11 @@ window.showServerInviteModal = showServerInviteModal;
 
 // --- Settings Functions ---
 
+// Server settings state (member list is paged lazily)
+let settingsServerId = null;
+let settingsUserRole = null;
+let settingsMembersCursor = null;
+
 // Open server settings modal
 async function openServerSettings(serverId) {
     try {
@@ -1467,37 +2002,17 @@ async function openServerSettings(serverId) {
         
         if (data.success) {
             const server = data.server;
-            const currentUserRole = server.members.find(m => m.id === CURRENT_USER_ID)?.role;
+            settingsServerId = serverId;
+            settingsUserRole = server.user_role;
+            settingsMembersCursor = null;
             
-            document.getElementById('serverSettingsTitle').textContent = `${server.name} - Settings`;
+            document.getElementById('serverSettingsTitle').textContent = `${server.name} - Settings (${server.member_count} members)`;
             
             const membersList = document.getElementById('serverMembersList');
             membersList.innerHTML = '';
             
-            server.members.forEach(member => {
-                const memberItem = document.createElement('div');
-                memberItem.className = 'member-item';
-                
-                const initial = member.username[0].toUpperCase();
-                const isCurrentUser = member.id === CURRENT_USER_ID;
-                const canRemove = (currentUserRole === 'owner' || currentUserRole === 'admin') && 
-                                  member.role !== 'owner' && !isCurrentUser;
-                
-                memberItem.innerHTML = `
-                    <div style="display: flex; align-items: center; gap: 12px; flex: 1;">
-                        <div class="member-avatar">${initial}</div>
-                        <div class="member-info">
-                            <div class="member-name">${member.user_tag}</div>
-                            <div class="member-role ${member.role}">${member.role}</div>
-                        </div>
-                    </div>
-                    ${canRemove ? `<button class="btn-remove" onclick="removeMember('${serverId}', '${member.id}', '${member.username}')">Remove</button>` : ''}
-                `;
-                
-                membersList.appendChild(memberItem);
-            });
-            
             document.getElementById('serverSettingsModal').classList.add('active');
+            await loadServerMembersPage(serverId);
         }
     } catch (error) {
         console.error('Error loading server settings:', error);
@@ -1505,6 +2020,95 @@ async function openServerSettings(serverId) {
     }
 }
 
+// Load the next page of members into the settings modal
+async function loadServerMembersPage(serverId) {
+    const membersList = document.getElementById('serverMembersList');
+    const params = new URLSearchParams({ limit: 50 });
+    if (settingsMembersCursor) {
+        params.set('cursor', settingsMembersCursor);
+    }
+    
+    try {
+        const response = await fetch(`/api/servers/${serverId}/members?${params}`);
+        const data = await response.json();
+        
+        if (!data.success || settingsServerId !== serverId) {
+            return;
+        }
+        
+        const loadMoreBtn = document.getElementById('loadMoreMembersBtn');
+        if (loadMoreBtn) {
+            loadMoreBtn.remove();
+        }
+        
+        data.groups.forEach(group => {
+            group.members.forEach(member => {
+                membersList.appendChild(createMemberItem(serverId, member));
+            });
+        });
+        
+        settingsMembersCursor = data.next_cursor;
+        if (settingsMembersCursor) {
+            const button = document.createElement('button');
+            button.id = 'loadMoreMembersBtn';
+            button.className = 'btn-small btn-chat';
+            button.textContent = 'Load more members';
+            button.addEventListener('click', () => loadServerMembersPage(serverId));
+            membersList.appendChild(button);
+        }
+    } catch (error) {
+        console.error('Error loading server members:', error);
+    }
+}
+
+// Build a member row for the settings modal
+function createMemberItem(serverId, member) {
+    const memberItem = document.createElement('div');
+    memberItem.className = 'member-item';
+    memberItem.dataset.memberId = member.id;
+    
+    const initial = member.username[0].toUpperCase();
+    const isCurrentUser = member.id === CURRENT_USER_ID;
+    const canRemove = (settingsUserRole === 'owner' || settingsUserRole === 'admin') && 
+                      member.role !== 'owner' && !isCurrentUser;
+    
+    memberItem.innerHTML = `
+        <div style="display: flex; align-items: center; gap: 12px; flex: 1;">
+            <div class="member-avatar">${initial}</div>
+            <div class="member-info">
+                <div class="member-name">${member.user_tag}</div>
+                <div class="member-role ${member.role}">${member.role}</div>
+            </div>
+        </div>
+        ${canRemove ? `<button class="btn-remove" onclick="removeMember('${serverId}', '${member.id}', '${member.username}')">Remove</button>` : ''}
+    `;
+    
+    return memberItem;
+}
+
+// Apply a member join/leave delta pushed over the server room
+function applyServerMemberUpdate(update) {
+    const countEl = document.querySelector('#chatHeader .header-status');
+    if (countEl && isServerChat && currentServerId === update.server_id) {
+        const count = (parseInt(countEl.textContent, 10) || 0) + (update.action === 'join' ? 1 : -1);
+        countEl.textContent = `${Math.max(count, 0)} members`;
+    }
+    
+    const modalOpen = document.getElementById('serverSettingsModal').classList.contains('active');
+    if (!modalOpen || settingsServerId !== update.server_id) {
+        return;
+    }
+    
+    const membersList = document.getElementById('serverMembersList');
+    const existing = membersList.querySelector(`[data-member-id="${update.member.id}"]`);
+    if (update.action === 'leave' && existing) {
+        existing.remove();
+    } else if (update.action === 'join' && !existing && !settingsMembersCursor) {
+        // Only append when the whole list is loaded; otherwise it arrives with a later page
+        membersList.appendChild(createMemberItem(update.server_id, update.member));
+    }
+}
+
 // Remove member from server
 async function removeMember(serverId, memberId, memberName) {
     if (!confirm(`Are you sure you want to remove ${memberName} from the server?`)) {
@@ -1625,7 +2229,9 @@ async function loadServerMessages(serverId) {
             const messagesContainer = document.getElementById('chatMessages');
             messagesContainer.innerHTML = '';
             displayedMessageIds.clear();
+            delete lastSeq[`server:${serverId}`];
             
+            rememberProfiles(data.messages.map(message => message.sender));
             data.messages.forEach(message => {
                 displayServerMessage(message);
             });
@@ -1643,9 +2249,10 @@ let replyingTo = null;
 // Display a server message
 function displayServerMessage(message) {
     if (displayedMessageIds.has(message.id)) {
-        return;
+        if (message.pending || !takePendingMessage(message.id)) return;
     }
     displayedMessageIds.add(message.id);
+    noteSeq('server', message.server_id, message.seq);
 
     const messagesContainer = document.getElementById('chatMessages');
     const messageDiv = document.createElement('div');
@@ -1656,7 +2263,7 @@ function displayServerMessage(message) {
 
     const senderName = senderInfo.username || (isOwnMessage ? CURRENT_USERNAME : 'Unknown');
 
-    messageDiv.className = `message server-message ${isOwnMessage ? 'sent' : 'received'} message-hoverable`;
+    messageDiv.className = `message server-message ${isOwnMessage ? 'sent' : 'received'} message-hoverable${message.pending ? ' pending' : ''}`;
     messageDiv.dataset.messageId = message.id;
 
     const timeString = formatToISTTime(message.created_at);
@@ -1718,7 +2325,7 @@ function displayServerMessage(message) {
         `;
     }
 
-    messagesContainer.appendChild(messageDiv);
+    insertInSeqOrder(messagesContainer, messageDiv, message.seq);
 }
 
 // Show reply option on right-click
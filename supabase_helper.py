@@ -50,3 +50,64 @@ def get_count(response):
         return response['count']
     
     return 0
+
+
+def get_users_by_ids(client, user_ids, columns='id, username, user_tag'):
+    """
+    Fetch several user profiles in a single query.
+    
+    Args:
+        client: Supabase client to query with
+        user_ids: Iterable of user ids (duplicates and None are ignored)
+        columns: Columns to select from the users table (must include 'id')
+    
+    Returns:
+        Dict mapping user id to the user row
+    """
+    ids = list({uid for uid in user_ids if uid})
+    if not ids:
+        return {}
+    
+    response = client.table('users').select(columns).in_('id', ids).execute()
+    return {user['id']: user for user in (get_data(response) or [])}
+
+
+def get_friendships(client, user_ids):
+    """
+    Friendships of several users at once, in two queries.
+    
+    Args:
+        client: Supabase client to query with
+        user_ids: Users whose friendships to load
+    
+    Returns:
+        Dict of user id -> {friend id: friendship created_at}, with an entry for every user
+    """
+    ids = list({uid for uid in user_ids if uid})
+    result = {uid: {} for uid in ids}
+    if not ids:
+        return result
+    
+    # Query both directions (user as user1 or user2)
+    f1 = client.table('friendships').select('user1_id, user2_id, created_at').in_('user1_id', ids).execute()
+    f2 = client.table('friendships').select('user1_id, user2_id, created_at').in_('user2_id', ids).execute()
+    for row in get_data(f1) or []:
+        result[row['user1_id']][row['user2_id']] = row['created_at']
+    for row in get_data(f2) or []:
+        result[row['user2_id']][row['user1_id']] = row['created_at']
+    return result
+
+
+def get_server_ids(client, user_id):
+    """
+    Ids of every server the user is a member of, in one query.
+    
+    Args:
+        client: Supabase client to query with
+        user_id: Member to look up
+    
+    Returns:
+        List of server ids
+    """
+    response = client.table('server_members').select('server_id').eq('user_id', user_id).execute()
+    return [row['server_id'] for row in (get_data(response) or [])]
@@ -0,0 +1,53 @@
+"""
+User Cache Module
+In-process set of user ids known to exist, filled incrementally from rows the
+app already reads (logins, profile lookups, search results, friend lists), so
+hot paths such as sending a DM can skip a separate existence query.
+
+Like the message caches this is per process; a miss falls back to the
+database, and the direct_messages foreign key remains the final check.
+"""
+
+import threading
+from collections import OrderedDict
+
+from config import Config
+
+
+class KnownUserIds:
+    """Bounded, least-recently-used set of user ids that exist"""
+
+    def __init__(self, max_ids):
+        self.max_ids = max_ids
+        self._ids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, user_ids):
+        """
+        Remember ids that were just read from the users table (or a table referencing it).
+
+        Args:
+            user_ids: Iterable of user ids (None is ignored)
+        """
+        with self._lock:
+            for user_id in user_ids:
+                if not user_id:
+                    continue
+                self._ids[str(user_id)] = True
+                self._ids.move_to_end(str(user_id))
+            while len(self._ids) > self.max_ids:
+                self._ids.popitem(last=False)
+
+    def __contains__(self, user_id):
+        with self._lock:
+            if str(user_id) in self._ids:
+                self._ids.move_to_end(str(user_id))
+                return True
+            return False
+
+    def discard(self, user_id):
+        with self._lock:
+            self._ids.pop(str(user_id), None)
+
+
+known_users = KnownUserIds(max_ids=Config.KNOWN_USER_IDS_MAX)